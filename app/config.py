@@ -1,6 +1,99 @@
+import json
 import os
+import tempfile
 
+# SQLite database file (tests point this at a temporary file)
+DB_PATH = os.getenv("DB_PATH", "shelf_assistant.db")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "phi")  # e.g., phi, phi3:mini, tinyllama
 WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "tiny")  # tiny/base/small
 CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.25"))
+OLLAMA_TEXT_MODEL = os.getenv("OLLAMA_TEXT_MODEL", "phi3:mini")
+OLLAMA_VISION_MODEL = os.getenv("OLLAMA_VISION_MODEL", "moondream")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # how long Ollama keeps a model loaded; "-1" pins it
+# Comma-separated models to load at startup; empty means text + vision defaults, "none" disables
+OLLAMA_PRELOAD_MODELS = os.getenv("OLLAMA_PRELOAD_MODELS", "")
+# Answer "where is / how much / in stock" questions from the DB without calling the LLM
+LLM_FAST_PATH = os.getenv("LLM_FAST_PATH", "1").lower() in ("1", "true", "yes")
+# Scheduling of Ollama work: concurrent upstream calls, aging for starvation protection, queue deadlines
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "1"))
+LLM_PRIORITY_AGING_S = float(os.getenv("LLM_PRIORITY_AGING_S", "20"))
+LLM_DEADLINE_INTERACTIVE_S = float(os.getenv("LLM_DEADLINE_INTERACTIVE_S", "30"))
+LLM_DEADLINE_NORMAL_S = float(os.getenv("LLM_DEADLINE_NORMAL_S", "120"))
+# Conversational sessions: max live sessions, idle eviction, history token budget per turn
+LLM_SESSION_MAX = int(os.getenv("LLM_SESSION_MAX", "256"))
+LLM_SESSION_IDLE_S = float(os.getenv("LLM_SESSION_IDLE_S", "600"))
+LLM_SESSION_TOKEN_BUDGET = int(os.getenv("LLM_SESSION_TOKEN_BUDGET", "600"))
+# Upper bound (estimated tokens) for the product context sent with a question
+LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "1024"))
+# A call whose Ollama load_duration exceeds this counts as a cold model load
+LLM_COLD_LOAD_MS = float(os.getenv("LLM_COLD_LOAD_MS", "500"))
+# Pre-rendered product context blocks kept per (search term, catalogue version)
+LLM_CONTEXT_CACHE_ENTRIES = int(os.getenv("LLM_CONTEXT_CACHE_ENTRIES", "64"))
+LLM_CONTEXT_CACHE_MAX_CHARS = int(os.getenv("LLM_CONTEXT_CACHE_MAX_CHARS", "2000000"))
+# Object detection service
+VISION_MODEL_PATH = os.getenv("VISION_MODEL_PATH", "yolov8n.pt")
+VISION_PRELOAD = os.getenv("VISION_PRELOAD", "1").lower() in ("1", "true", "yes")
+VISION_BATCH_SIZE = int(os.getenv("VISION_BATCH_SIZE", "8"))  # images per model call
+VISION_BATCH_WINDOW_MS = float(os.getenv("VISION_BATCH_WINDOW_MS", "10"))  # wait to merge concurrent /vision/detect calls
+VISION_BATCH_MAX_IMAGES = int(os.getenv("VISION_BATCH_MAX_IMAGES", "64"))  # per /vision/detect/batch request
+# Detector registry: extra weights in VISION_MODELS_DIR are selectable per request and loaded on demand
+VISION_MODELS_DIR = os.getenv("VISION_MODELS_DIR", "models")
+VISION_MAX_MODELS = int(os.getenv("VISION_MAX_MODELS", "2"))  # resident detectors, LRU-evicted
+VISION_MODEL_MEMORY_MB = float(os.getenv("VISION_MODEL_MEMORY_MB", "1024"))
+# Longest image side sent to the vision LLM; larger uploads are downscaled in memory
+VISION_LLM_MAX_SIDE = int(os.getenv("VISION_LLM_MAX_SIDE", "768"))
+# Captured/uploaded media written to disk: content-addressed, deleted after processing, bounded
+MEDIA_DIR = os.getenv("MEDIA_DIR", os.path.join(tempfile.gettempdir(), "shelf_media"))
+MEDIA_QUOTA_MB = float(os.getenv("MEDIA_QUOTA_MB", "200"))
+MEDIA_MAX_AGE_S = float(os.getenv("MEDIA_MAX_AGE_S", "86400"))  # 0 = no age limit
+MEDIA_RETAIN = os.getenv("MEDIA_RETAIN", "0").lower() in ("1", "true", "yes")  # keep processed files for debugging
+# Perceptual-hash result cache for repeated (near-identical) images
+IMAGE_CACHE_ENTRIES = int(os.getenv("IMAGE_CACHE_ENTRIES", "256"))  # 0 disables
+IMAGE_CACHE_HASH = os.getenv("IMAGE_CACHE_HASH", "dhash")  # ahash | dhash | phash
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "4"))  # Hamming bits out of 64
+IMAGE_CACHE_TTL_S = float(os.getenv("IMAGE_CACHE_TTL_S", "300"))
+# Persistent camera session
+CAMERA_INDEX = int(os.getenv("CAMERA_INDEX", "0"))
+CAMERA_RING_SIZE = int(os.getenv("CAMERA_RING_SIZE", "4"))
+CAMERA_FPS = float(os.getenv("CAMERA_FPS", "5"))
+CAMERA_IDLE_TIMEOUT_S = float(os.getenv("CAMERA_IDLE_TIMEOUT_S", "60"))
+CAMERA_WARMUP_S = float(os.getenv("CAMERA_WARMUP_S", "0.5"))  # auto-exposure settling after open
+# Change gating for camera frames: named regions as normalised [x0, y0, x1, y1]
+SHELF_REGIONS = json.loads(os.getenv("SHELF_REGIONS", '{"shelf": [0, 0, 1, 1]}'))
+CHANGE_THUMB_WIDTH = int(os.getenv("CHANGE_THUMB_WIDTH", "96"))
+CHANGE_THUMB_HEIGHT = int(os.getenv("CHANGE_THUMB_HEIGHT", "72"))
+CHANGE_PIXEL_THRESHOLD = float(os.getenv("CHANGE_PIXEL_THRESHOLD", "20"))  # grey levels
+CHANGE_REGION_FRACTION = float(os.getenv("CHANGE_REGION_FRACTION", "0.02"))  # of a region's pixels
+CHANGE_MAX_SKIP_S = float(os.getenv("CHANGE_MAX_SKIP_S", "300"))
+# Multi-frame tracking (ByteTrack-style) for stable per-region counts
+TRACK_HIGH_THRESH = float(os.getenv("TRACK_HIGH_THRESH", "0.5"))  # detections that can start tracks
+TRACK_LOW_THRESH = float(os.getenv("TRACK_LOW_THRESH", "0.1"))  # weaker detections only extend tracks
+TRACK_MATCH_IOU = float(os.getenv("TRACK_MATCH_IOU", "0.3"))
+TRACK_MIN_HITS = int(os.getenv("TRACK_MIN_HITS", "2"))  # frames before a track counts
+TRACK_MAX_AGE = int(os.getenv("TRACK_MAX_AGE", "15"))  # missed frames before a track is dropped
+TRACK_COUNT_ALPHA = float(os.getenv("TRACK_COUNT_ALPHA", "0.3"))  # EMA weight of the newest frame's counts
+# Planogram compliance
+PLANOGRAM_MIN_OVERLAP = float(os.getenv("PLANOGRAM_MIN_OVERLAP", "0.5"))  # share of a detection inside a facing
+PLANOGRAM_FRAME_BUDGET_MS = float(os.getenv("PLANOGRAM_FRAME_BUDGET_MS", "500"))  # detect + match, per frame
+PLANOGRAM_EMPTY_FRAMES = int(os.getenv("PLANOGRAM_EMPTY_FRAMES", "3"))  # consecutive empty frames before stock is zeroed
+# Detector backend: ultralytics (PyTorch), onnx (ONNX Runtime) or openvino; VISION_MODEL_PATH must match
+VISION_BACKEND = os.getenv("VISION_BACKEND", "ultralytics")
+VISION_IMGSZ = int(os.getenv("VISION_IMGSZ", "640"))
+VISION_NMS_IOU = float(os.getenv("VISION_NMS_IOU", "0.45"))
+VISION_MAX_DETECTIONS = int(os.getenv("VISION_MAX_DETECTIONS", "300"))
+VISION_ONNX_THREADS = int(os.getenv("VISION_ONNX_THREADS", "0"))  # 0 = runtime default
+# Tiled detection for wide panoramas
+VISION_TILE_SIZE = int(os.getenv("VISION_TILE_SIZE", "640"))
+VISION_TILE_OVERLAP = float(os.getenv("VISION_TILE_OVERLAP", "0.2"))  # fraction of the tile size
+VISION_TILE_BATCH = int(os.getenv("VISION_TILE_BATCH", "4"))
+VISION_TILE_WORKERS = int(os.getenv("VISION_TILE_WORKERS", "1"))  # tile batches in flight; >1 in-process only for onnx/openvino
+VISION_TILE_FULL_FRAME = os.getenv("VISION_TILE_FULL_FRAME", "1").lower() not in ("0", "false", "no")
+VISION_TILE_MERGE = os.getenv("VISION_TILE_MERGE", "nms")  # nms | fusion
+VISION_TILE_MERGE_IOU = float(os.getenv("VISION_TILE_MERGE_IOU", "0.5"))
+# Detection worker processes (0 = run the model in the API process via the batcher)
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", "0"))
+VISION_WORKER_THREADS = int(os.getenv("VISION_WORKER_THREADS", "1"))  # inference threads per worker
+VISION_WORKER_PIN_CPUS = os.getenv("VISION_WORKER_PIN_CPUS", "0").lower() in ("1", "true", "yes")
+VISION_WORKER_TIMEOUT_S = float(os.getenv("VISION_WORKER_TIMEOUT_S", "30"))  # per frame; hung workers are restarted
+VISION_WORKER_HEALTH_S = float(os.getenv("VISION_WORKER_HEALTH_S", "5"))  # idle ping interval
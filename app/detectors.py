@@ -0,0 +1,265 @@
+"""Detector backends that don't need PyTorch at inference time.
+
+``app.vision`` calls a detector as ``model(images, conf=..., verbose=False)``
+and reads ultralytics-style results (``.boxes`` with ``data``/``xyxy``/
+``conf``/``cls``, ``.names``, ``.speed``). The ultralytics ``YOLO`` object
+is one such detector; the classes here run a YOLOv8 model exported with
+``scripts/export_detector.py`` through ONNX Runtime or OpenVINO and return
+the same result shape, so everything downstream is backend-agnostic.
+"""
+import ast
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .services.image_pipeline import letterbox
+from .config import VISION_IMGSZ, VISION_NMS_IOU, VISION_MAX_DETECTIONS, VISION_ONNX_THREADS
+
+try:
+    import onnxruntime as ort  # type: ignore
+    ONNXRUNTIME_AVAILABLE = True
+except Exception:
+    ONNXRUNTIME_AVAILABLE = False
+
+try:
+    import openvino as ov  # type: ignore
+    OPENVINO_AVAILABLE = True
+except Exception:
+    OPENVINO_AVAILABLE = False
+
+
+class Boxes:
+    """numpy equivalent of ultralytics ``Boxes``: rows of x0, y0, x1, y1, conf, cls."""
+
+    def __init__(self, data: np.ndarray):
+        self.data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+        self.xyxy = self.data[:, :4]
+        self.conf = self.data[:, 4]
+        self.cls = self.data[:, 5]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield Boxes(self.data[i:i + 1])
+
+
+class Result:
+    def __init__(self, boxes: np.ndarray, names: Dict[int, str], speed: Dict[str, float]):
+        self.boxes = Boxes(boxes)
+        self.names = names
+        self.speed = speed
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, metric: str = "iou") -> np.ndarray:
+    """Indices of boxes kept by greedy non-maximum suppression, best first.
+
+    ``metric="ios"`` measures overlap as intersection over the smaller box,
+    which also suppresses a box cut off at a tile edge by its complete twin.
+    """
+    order = np.argsort(-scores, kind="stable")
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = w * h
+        if metric == "ios":
+            overlap = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+        else:
+            overlap = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[overlap <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(
+    boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, iou_threshold: float, metric: str = "iou"
+) -> np.ndarray:
+    """Class-aware NMS: boxes of different classes never suppress each other."""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = classes.astype(np.float32)[:, None] * (float(boxes.max()) + 1.0)
+    return nms(boxes + offsets, scores, iou_threshold, metric)
+
+
+def parse_names(raw: Any) -> Dict[int, str]:
+    """Class names from exported metadata (a dict, or its string repr)."""
+    if isinstance(raw, str):
+        raw = ast.literal_eval(raw)
+    return {int(k): str(v) for k, v in dict(raw).items()}
+
+
+class ExportedYOLODetector:
+    """YOLOv8 pre/post-processing around a raw ``(B, 4 + classes, anchors)`` forward pass.
+
+    Subclasses implement ``_forward`` for a specific runtime. Images are
+    letterboxed to ``imgsz``, run as one batch, and decoded with confidence
+    filtering and class-aware NMS; boxes are mapped back to the original
+    image coordinates.
+    """
+
+    backend = "exported"
+
+    def __init__(
+        self,
+        names: Dict[int, str],
+        imgsz: int = VISION_IMGSZ,
+        iou: float = VISION_NMS_IOU,
+        max_det: int = VISION_MAX_DETECTIONS,
+        batch_size: Optional[int] = None,
+    ):
+        self.names = names
+        self.imgsz = imgsz
+        self.iou = iou
+        self.max_det = max_det
+        # Models exported with a fixed batch dimension are fed in chunks of that size
+        self.batch_size = batch_size
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def preprocess(self, images: Sequence[np.ndarray]):
+        tensors, meta = [], []
+        for image in images:
+            boxed, scale, pad = letterbox(image, self.imgsz)
+            # BGR HWC uint8 -> RGB CHW float in [0, 1]
+            tensors.append(boxed[:, :, ::-1].transpose(2, 0, 1))
+            meta.append((scale, pad, image.shape[1], image.shape[0]))
+        batch = np.ascontiguousarray(np.stack(tensors), dtype=np.float32) / 255.0
+        return batch, meta
+
+    def postprocess(self, output: np.ndarray, conf: float, scale: float, pad, width: int, height: int) -> np.ndarray:
+        """One image's raw predictions -> (N, 6) rows in original pixel coordinates."""
+        preds = output.T  # (anchors, 4 + classes)
+        scores_all = preds[:, 4:]
+        classes = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(classes)), classes]
+        keep = scores >= conf
+        if not keep.any():
+            return np.zeros((0, 6), dtype=np.float32)
+        cx, cy, w, h = preds[keep, :4].T
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        scores, classes = scores[keep], classes[keep]
+        kept = batched_nms(boxes, scores, classes, self.iou)[:self.max_det]
+        boxes = (boxes[kept] - np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)) / scale
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        return np.column_stack([boxes, scores[kept], classes[kept]]).astype(np.float32)
+
+    def __call__(self, source, conf: float = 0.25, verbose: bool = False, **kwargs) -> List[Result]:
+        images = list(source) if isinstance(source, (list, tuple)) else [source]
+        if not images:
+            return []
+        images = [_load(image) for image in images]
+        t0 = time.perf_counter()
+        batch, meta = self.preprocess(images)
+        t1 = time.perf_counter()
+        step = self.batch_size or len(batch)
+        outputs = np.concatenate([self._forward(batch[i:i + step]) for i in range(0, len(batch), step)])
+        t2 = time.perf_counter()
+        rows = [self.postprocess(out, conf, *m) for out, m in zip(outputs, meta)]
+        t3 = time.perf_counter()
+        n = len(images)
+        speed = {
+            "preprocess": (t1 - t0) * 1000 / n,
+            "inference": (t2 - t1) * 1000 / n,
+            "postprocess": (t3 - t2) * 1000 / n,
+        }
+        return [Result(r, self.names, dict(speed)) for r in rows]
+
+
+def _load(image) -> np.ndarray:
+    if isinstance(image, np.ndarray):
+        return image
+    from .services.image_pipeline import decode_image
+    return decode_image(Path(image).read_bytes())
+
+
+class OnnxYOLODetector(ExportedYOLODetector):
+    """YOLOv8 exported to ONNX (fp32 or int8) on ONNX Runtime's CPU provider."""
+
+    backend = "onnx"
+
+    def __init__(self, path: str, threads: int = VISION_ONNX_THREADS, **kwargs):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        shape = self.session.get_inputs()[0].shape
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        names = parse_names(metadata["names"]) if "names" in metadata else {}
+        kwargs.setdefault("imgsz", int(shape[2]) if isinstance(shape[2], int) else VISION_IMGSZ)
+        kwargs.setdefault("batch_size", shape[0] if isinstance(shape[0], int) else None)
+        super().__init__(names, **kwargs)
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVINOYOLODetector(ExportedYOLODetector):
+    """YOLOv8 exported to OpenVINO IR (``*_openvino_model/`` dir or ``.xml``) on CPU."""
+
+    backend = "openvino"
+
+    def __init__(self, path: str, **kwargs):
+        if not OPENVINO_AVAILABLE:
+            raise RuntimeError("openvino is not installed (pip install openvino)")
+        path = Path(path)
+        xml = path if path.suffix == ".xml" else next(path.glob("*.xml"))
+        core = ov.Core()
+        model = core.read_model(str(xml))
+        self.compiled = core.compile_model(model, "CPU", {"PERFORMANCE_HINT": "LATENCY"})
+        shape = model.inputs[0].get_partial_shape()
+        kwargs.setdefault("imgsz", shape[2].get_length() if shape[2].is_static else VISION_IMGSZ)
+        kwargs.setdefault("batch_size", shape[0].get_length() if shape[0].is_static else None)
+        super().__init__(_openvino_names(xml.parent), **kwargs)
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        return self.compiled(batch)[0]
+
+
+def _openvino_names(directory: Path) -> Dict[int, str]:
+    # ultralytics writes the class names to metadata.yaml next to the IR
+    meta = directory / "metadata.yaml"
+    if not meta.exists():
+        return {}
+    try:
+        import yaml  # type: ignore
+        return parse_names(yaml.safe_load(meta.read_text())["names"])
+    except Exception:
+        return {}
+
+
+BACKENDS = {"onnx": OnnxYOLODetector, "openvino": OpenVINOYOLODetector}
+
+
+def load_detector(backend: str, path: str):
+    """Detector for ``backend`` ("ultralytics", "onnx" or "openvino")."""
+    if backend == "ultralytics":
+        from ultralytics import YOLO  # type: ignore
+        return YOLO(path)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown vision backend '{backend}' (expected ultralytics, onnx or openvino)")
+    return BACKENDS[backend](path)
+
+
+def backend_available(backend: str) -> bool:
+    if backend == "onnx":
+        return ONNXRUNTIME_AVAILABLE
+    if backend == "openvino":
+        return OPENVINO_AVAILABLE
+    try:
+        import importlib.util
+        return importlib.util.find_spec("ultralytics") is not None
+    except Exception:
+        return False
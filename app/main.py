@@ -2,7 +2,11 @@ from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 
 # Import routers
-from .routes import products, vision, llm
+from .routes import products, vision, llm, planogram
+from .services.residency import residency_manager
+from .services.vision import vision_service
+from .services.camera import camera_session
+from .config import VISION_PRELOAD
 
 app = FastAPI(
     title="ShelfAssistant API",
@@ -14,6 +18,19 @@ app = FastAPI(
 app.include_router(products.router)
 app.include_router(vision.router)
 app.include_router(llm.router)
+app.include_router(planogram.router)
+
+@app.on_event("startup")
+def warm_models():
+    # Load the configured Ollama models up front so the first shopper doesn't pay the cold load
+    residency_manager.preload_in_background()
+    if VISION_PRELOAD:
+        vision_service.initialize_in_background()
+
+@app.on_event("shutdown")
+def release_resources():
+    camera_session.stop()
+    vision_service.shutdown()
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -82,12 +99,24 @@ async def root():
         
         <div class="section">
             <h2>👁️ Vision Recognition</h2>
-            <p>YOLOv8-based shelf product detection (coming soon)</p>
+            <p>YOLOv8-based shelf product detection</p>
             
             <div class="endpoint">
                 <div class="method">POST</div>
                 <div class="url">/vision/detect</div>
-                <div class="description">Detect products in shelf images (TODO: Implement YOLOv8)</div>
+                <div class="description">Detect products in shelf images with the resident YOLOv8 model</div>
+            </div>
+
+            <div class="endpoint">
+                <div class="method">POST</div>
+                <div class="url">/vision/capture/detect</div>
+                <div class="description">Detect products in the latest camera frame (skipped while the shelf is unchanged)</div>
+            </div>
+
+            <div class="endpoint">
+                <div class="method">POST</div>
+                <div class="url">/planogram/check</div>
+                <div class="description">Check a shelf image against the planogram: empty facings, misplaced items, stock events</div>
             </div>
         </div>
         
@@ -0,0 +1,176 @@
+"""Registry of detector weights, loaded on first use and evicted LRU.
+
+Weights are discovered in ``VISION_MODELS_DIR`` (``*.pt`` for ultralytics,
+``*.onnx``, and OpenVINO ``*_openvino_model/`` dirs); the configured
+``VISION_MODEL_PATH`` is always registered and is the default. At most
+``VISION_MAX_MODELS`` models stay resident, and their combined memory is
+kept under ``VISION_MODEL_MEMORY_MB``; the least recently used model goes
+first. The default model is pinned and never evicted.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import VISION_MODEL_PATH, VISION_BACKEND, VISION_MODELS_DIR, VISION_MAX_MODELS, VISION_MODEL_MEMORY_MB
+from .detectors import load_detector
+
+
+def backend_for(path: Path) -> str:
+    """Backend implied by a weights path."""
+    if path.suffix == ".onnx":
+        return "onnx"
+    if path.suffix == ".xml" or path.name.endswith("_openvino_model"):
+        return "openvino"
+    return "ultralytics"
+
+
+def model_name(path: str) -> str:
+    """Models are addressed by file name, e.g. ``yolov8n.pt`` or ``yolov8n-int8.onnx``."""
+    return Path(path).name
+
+
+def _disk_bytes(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelRegistry:
+    """Lazily loaded, LRU-evicted detector models keyed by name."""
+
+    def __init__(
+        self,
+        models_dir: str = VISION_MODELS_DIR,
+        default_path: str = VISION_MODEL_PATH,
+        default_backend: str = VISION_BACKEND,
+        max_models: int = VISION_MAX_MODELS,
+        memory_budget_mb: float = VISION_MODEL_MEMORY_MB,
+        loader: Callable[[str, str], Any] = load_detector,
+    ):
+        self.models_dir = Path(models_dir)
+        self.max_models = max(1, max_models)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.loader = loader
+        self.default = model_name(default_path)
+        self._entries: Dict[str, Dict[str, Any]] = {
+            self.default: {"path": default_path, "backend": default_backend, "pinned": True}
+        }
+        self._resident: "OrderedDict[str, Any]" = OrderedDict()
+        self._memory: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    def discover(self) -> List[str]:
+        """Register weights found in ``models_dir``; returns every known name."""
+        if self.models_dir.is_dir():
+            for path in sorted(self.models_dir.iterdir()):
+                if path.suffix in (".pt", ".onnx") or (path.is_dir() and path.name.endswith("_openvino_model")):
+                    self.register(model_name(str(path)), str(path), backend_for(path))
+        return list(self._entries)
+
+    def register(self, name: str, path: str, backend: str) -> None:
+        with self._lock:
+            entry = self._entries.setdefault(name, {"pinned": False})
+            entry.update(path=path, backend=backend)
+
+    def resolve(self, name: Optional[str]) -> str:
+        """Canonical model name; None means the default. KeyError if unknown."""
+        if name is None or name == self.default:
+            return self.default
+        if name not in self._entries:
+            self.discover()
+        if name not in self._entries:
+            raise KeyError(f"Unknown vision model '{name}'")
+        return name
+
+    def get(self, name: Optional[str] = None) -> Any:
+        """The loaded model, loading it (and evicting others) if needed."""
+        name = self.resolve(name)
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                entry = self._entries[name]
+                entry["uses"] = entry.get("uses", 0) + 1
+                entry["last_used"] = time.time()
+                return self._resident[name]
+            entry = self._entries[name]
+            # Models are loaded one at a time, so the RSS growth is this model's footprint
+            before, start = _rss_bytes(), time.perf_counter()
+            try:
+                model = self.loader(entry["backend"], entry["path"])
+            except Exception as e:
+                entry["error"] = str(e)
+                raise
+            after = _rss_bytes()
+            measured = after - before if before is not None and after is not None else 0
+            self._memory[name] = max(measured, _disk_bytes(Path(entry["path"])))
+            entry.update(load_ms=round((time.perf_counter() - start) * 1000, 1), uses=1, last_used=time.time(), error=None)
+            self._resident[name] = model
+            self.loads += 1
+            self._evict(keep=name)
+            return model
+
+    def _evict(self, keep: str) -> None:
+        while len(self._resident) > self.max_models or sum(self._memory.get(n, 0) for n in self._resident) > self.memory_budget:
+            victim = next((n for n in self._resident if n != keep and not self._entries[n]["pinned"]), None)
+            if victim is None:
+                break
+            self.unload(victim)
+            self.evictions += 1
+            print(f"Evicted vision model '{victim}' (LRU)")
+
+    def unload(self, name: str) -> bool:
+        with self._lock:
+            if self._resident.pop(self.resolve(name), None) is None:
+                return False
+            self._memory.pop(name, None)
+            return True
+
+    def is_loaded(self, name: Optional[str] = None) -> bool:
+        return self.resolve(name) in self._resident
+
+    def get_status(self) -> Dict[str, Any]:
+        self.discover()
+        with self._lock:
+            models = []
+            for name, entry in self._entries.items():
+                loaded = name in self._resident
+                models.append({
+                    "name": name,
+                    "path": entry["path"],
+                    "backend": entry["backend"],
+                    "default": name == self.default,
+                    "loaded": loaded,
+                    "memory_mb": round(self._memory[name] / 2**20, 1) if loaded else None,
+                    "disk_mb": round(_disk_bytes(Path(entry["path"])) / 2**20, 1),
+                    "load_ms": entry.get("load_ms"),
+                    "uses": entry.get("uses", 0),
+                    "last_used": entry.get("last_used"),
+                    "error": entry.get("error"),
+                })
+            used = sum(self._memory.get(n, 0) for n in self._resident)
+            return {
+                "models": models,
+                "resident": list(self._resident),
+                "max_models": self.max_models,
+                "memory_budget_mb": round(self.memory_budget / 2**20, 1),
+                "memory_used_mb": round(used / 2**20, 1),
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+# Global registry of detector models
+model_registry = ModelRegistry()
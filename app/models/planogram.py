@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+
+class FacingBase(BaseModel):
+    product_id: int = Field(..., description="Product expected in this facing")
+    shelf_location: Optional[str] = Field(None, description="Shelf location identifier")
+    label: str = Field(..., description="Detector class label expected in this facing")
+    x0: float = Field(..., ge=0.0, le=1.0, description="Left edge (fraction of image width)")
+    y0: float = Field(..., ge=0.0, le=1.0, description="Top edge (fraction of image height)")
+    x1: float = Field(..., ge=0.0, le=1.0, description="Right edge (fraction of image width)")
+    y1: float = Field(..., ge=0.0, le=1.0, description="Bottom edge (fraction of image height)")
+    expected_count: int = Field(default=1, ge=1, description="Number of items a full facing holds")
+
+class FacingCreate(FacingBase):
+    pass
+
+class Facing(FacingBase):
+    id: int = Field(..., description="Facing ID")
+    created_at: datetime = Field(default_factory=datetime.now, description="Creation timestamp")
+    updated_at: datetime = Field(default_factory=datetime.now, description="Last update timestamp")
+
+    class Config:
+        from_attributes = True
@@ -1,17 +1,40 @@
 from fastapi import APIRouter, HTTPException, Form, Query, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pathlib import Path
 from ..models.response import DataResponse
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union
 from ..services.llm import llm_service
-from ..services.image_handler import image_handler
+from ..services.media_store import media_store
 from ..services.stt import stt_service
+from ..services.residency import residency_manager
+from ..services.intent import intent_router
+from ..services.scheduler import Priority
+from ..services.sessions import session_store
+from ..services.telemetry import llm_telemetry
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
 @router.get("/status", response_model=DataResponse[Dict[str, Any]])
 async def get_llm_status():
     status = llm_service.get_service_status()
+    status["fast_path"] = intent_router.get_stats()
+    status["sessions"] = session_store.get_stats()
     return DataResponse(success=status.get("is_connected", False), message="LLM status", data=status)
 
+@router.get("/metrics")
+async def get_llm_metrics(format: str = Query("json", description="'json' or 'prometheus'")):
+    """Per-model inference histograms built from Ollama's timing fields."""
+    if format == "prometheus":
+        return PlainTextResponse(llm_telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+    return DataResponse(success=True, message="LLM metrics", data=llm_telemetry.get_stats())
+
+@router.get("/models", response_model=DataResponse[Dict[str, Any]])
+async def get_model_residency():
+    """Report configured models, their preload results and which are resident in Ollama."""
+    status = await run_in_threadpool(residency_manager.get_status)
+    return DataResponse(success=True, message="Model residency", data=status)
+
 @router.post("/ask", response_model=DataResponse[str])
 async def ask_question(
     question: str = Form(..., description="User question"),
@@ -19,15 +42,52 @@ async def ask_question(
     model: Optional[str] = Form(None, description="Override text model name (e.g., phi3:mini)")
 ):
     try:
-        if model:
-            llm_service.set_text_model(model)
-        ctx = llm_service.build_product_context(search)
-        answer = llm_service.generate_answer(question=question, context=ctx["context"]) 
+        fast = await run_in_threadpool(intent_router.answer, question)
+        if fast is not None:
+            return DataResponse(success=True, message="OK", data=fast)
+        ctx = await run_in_threadpool(llm_service.build_product_context, search, question)
+        answer = await run_in_threadpool(
+            llm_service.generate_answer, question=question, context=ctx["context"], model=model,
+            priority=Priority.INTERACTIVE,
+        )
         return DataResponse(success=True, message="OK", data=answer)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/query", response_model=DataResponse[str])
+@router.post("/chat", response_model=DataResponse[Dict[str, str]])
+async def chat(
+    question: str = Form(..., description="User question"),
+    session_id: Optional[str] = Form(None, description="Conversation id from a previous reply; omit to start one"),
+    search: Optional[str] = Form(None, description="Keyword to filter product context; kept for the session"),
+    model: Optional[str] = Form(None, description="Override text model name (e.g., phi3:mini)")
+):
+    """Multi-turn Q&A. Follow-up questions see the earlier turns of the same session."""
+    try:
+        # A new session is only stored once it has an answer, so failed requests leave no orphans
+        session = session_store.get_or_create(session_id, search, register=False)
+        # Follow-ups ("how much is it?") depend on the history, which only the LLM sees
+        answer = None
+        if not (session.turns or session.summary):
+            answer = await run_in_threadpool(intent_router.answer, question)
+        if answer is None:
+            ctx = await run_in_threadpool(llm_service.build_product_context, session.search, question)
+            answer = await run_in_threadpool(
+                llm_service.generate_answer, question=question, context=ctx["context"], model=model,
+                priority=Priority.INTERACTIVE, history=session.history_messages(),
+            )
+        session_store.record_turn(session, question, answer)
+        return DataResponse(success=True, message="OK", data={"session_id": session.id, "answer": answer})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/chat/{session_id}", response_model=DataResponse[None])
+async def end_chat(session_id: str):
+    """Forget a conversation."""
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return DataResponse(success=True, message="Session ended", data=None)
+
+@router.post("/query", response_model=DataResponse[Union[str, Dict[str, Any]]])
 async def unified_query(
     # Text mode
     question: Optional[str] = Form(None, description="Text question"),
@@ -36,33 +96,42 @@ async def unified_query(
     image: Optional[UploadFile] = File(None, description="Image to analyze"),
     user_query: Optional[str] = Form(None, description="Query about the image"),
     text_model: Optional[str] = Form(None, description="Override text model (e.g., phi3:mini)"),
-    vision_model: Optional[str] = Form(None, description="Override vision model (e.g., moondream)")
+    vision_model: Optional[str] = Form(None, description="Override vision model (e.g., moondream)"),
+    detailed: bool = Form(False, description="Image mode: return caption, matches and per-stage timings")
 ):
     try:
-        if text_model:
-            llm_service.set_text_model(text_model)
-        if vision_model:
-            llm_service.set_vision_model(vision_model)
-
         # Auto-detect: image takes precedence if provided
         if image is not None:
-            # Save uploaded image to temp and analyze
+            # Analyze the upload straight from memory
             bytes_data = await image.read()
-            img_path = image_handler.save_uploaded_image(bytes_data, filename_prefix="query")
+            await run_in_threadpool(media_store.retain_copy, bytes_data, "query")
             
             # Use two-stage pipeline if user_query provided, otherwise simple caption
             if user_query:
-                result = llm_service.image_to_text(str(img_path), user_query)
+                result = await run_in_threadpool(
+                    llm_service.image_to_text_detailed, bytes_data, user_query,
+                    text_model=text_model, vision_model=vision_model, priority=Priority.NORMAL,
+                )
+                if not detailed:
+                    result = result["answer"]
             else:
-                result = llm_service.caption_image(str(img_path))
+                result = await run_in_threadpool(
+                    llm_service.caption_image, bytes_data, model=vision_model, priority=Priority.NORMAL
+                )
             
             return DataResponse(success=True, message="image", data=result)
 
         # Otherwise treat as text
         if not question:
             raise HTTPException(status_code=400, detail="Provide either 'image' or 'question'")
-        ctx = llm_service.build_product_context(search)
-        answer = llm_service.generate_answer(question=question, context=ctx["context"]) 
+        fast = await run_in_threadpool(intent_router.answer, question)
+        if fast is not None:
+            return DataResponse(success=True, message="text", data=fast)
+        ctx = await run_in_threadpool(llm_service.build_product_context, search, question)
+        answer = await run_in_threadpool(
+            llm_service.generate_answer, question=question, context=ctx["context"], model=text_model,
+            priority=Priority.INTERACTIVE,
+        )
         return DataResponse(success=True, message="text", data=answer)
 
     except HTTPException:
@@ -76,15 +145,15 @@ async def voice_query(
 ):
     """Process voice query: transcribe audio and generate LLM response."""
     try:
-        # Save uploaded audio to temp file
+        # Transcribe the upload from memory
         bytes_data = await audio.read()
-        audio_path = image_handler.save_uploaded_image(bytes_data, filename_prefix="voice")
-        
-        # Get transcript
-        transcript = stt_service.transcribe_audio(str(audio_path))
+        await run_in_threadpool(media_store.retain_copy, bytes_data, "voice", Path(audio.filename or "").suffix or ".wav")
+        transcript = await run_in_threadpool(stt_service.transcribe_audio, bytes_data)
         
-        # Get LLM response
-        response = llm_service.generate_text(transcript)
+        # Answer templated questions from the DB; otherwise get LLM response
+        response = await run_in_threadpool(intent_router.answer, transcript)
+        if response is None:
+            response = await run_in_threadpool(llm_service.generate_text, transcript, priority=Priority.INTERACTIVE)
         
         return DataResponse(
             success=True, 
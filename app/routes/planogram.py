@@ -0,0 +1,101 @@
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from typing import List, Dict, Any, Optional
+from ..models.planogram import Facing, FacingCreate
+from ..models.response import DataResponse, ListResponse
+from ..services.db import db_service
+from ..services.planogram import planogram_engine
+from ..services.tracker import shelf_tracker
+from ..services.vision import vision_service
+from ..config import CONFIDENCE_THRESHOLD
+
+router = APIRouter(prefix="/planogram", tags=["planogram"])
+
+@router.post("/facings", response_model=DataResponse[Facing])
+async def create_facing(facing: FacingCreate):
+    """Add an expected facing: a shelf region that should hold a product"""
+    if facing.x1 <= facing.x0 or facing.y1 <= facing.y0:
+        raise HTTPException(status_code=400, detail="Facing region must have x1 > x0 and y1 > y0")
+    if not db_service.get_product(facing.product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    try:
+        facing_id = planogram_engine.add_facing(facing.model_dump())
+        created = next(f for f in db_service.get_facings() if f["id"] == facing_id)
+        return DataResponse(success=True, message="Facing created successfully", data=Facing(**created))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create facing: {str(e)}")
+
+@router.get("/facings", response_model=ListResponse[Facing])
+async def get_facings(
+    shelf_location: Optional[str] = Query(None, description="Only facings at this shelf location")
+):
+    """List planogram facings"""
+    facings = db_service.get_facings(shelf_location)
+    return ListResponse(
+        success=True,
+        message="Facings retrieved successfully",
+        data=[Facing(**f) for f in facings],
+        total=len(facings)
+    )
+
+@router.delete("/facings/{facing_id}")
+async def delete_facing(facing_id: int):
+    """Delete a planogram facing by ID"""
+    if not planogram_engine.delete_facing(facing_id):
+        raise HTTPException(status_code=404, detail="Facing not found")
+    return DataResponse(success=True, message="Facing deleted successfully", data=None)
+
+@router.post("/check", response_model=DataResponse[Dict[str, Any]])
+async def check_compliance(
+    file: UploadFile = File(..., description="Shelf image"),
+    shelf_location: Optional[str] = Form(None, description="Only check facings at this shelf location"),
+    conf: float = Form(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0, description="Minimum detection confidence"),
+    apply_stock: bool = Form(False, description="Set stock_quantity to 0 for products found empty"),
+    track: bool = Form(False, description="Check tracked items across consecutive frames of this shelf")
+):
+    """Detect items in a shelf image and check them against the planogram.
+
+    Returns per-facing counts, empty facings and misplaced items, plus the
+    out-of-stock / low / misplaced / restocked events this frame triggered.
+    With ``track`` the frame extends the shelf location's multi-frame track
+    set and the check uses confirmed tracks instead of raw detections, so an
+    item missed in a single frame doesn't raise an empty/restocked pair.
+    """
+    data = await file.read()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    try:
+        # Compliance must reflect this frame: a removed item can leave the near-duplicate hash unchanged
+        detected = await vision_service.detect_products_async(data, conf, cache=False)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    detections = detected["detections"]
+    tracking = None
+    if track:
+        tracking = shelf_tracker.update(("planogram", shelf_location), detections, detected["image_size"])
+        detections = shelf_tracker.detections(tracking)
+    try:
+        report = planogram_engine.check(
+            detections, detected["image_size"], shelf_location=shelf_location,
+            apply_stock=apply_stock, elapsed_ms=detected["timings"]["total_ms"],
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    report["timings"] = dict(detected["timings"], **{f"planogram_{k}": v for k, v in report["timings"].items()})
+    if tracking is not None:
+        report["tracking"] = tracking
+        report["timings"]["track_ms"] = tracking["track_ms"]
+    return DataResponse(success=True, message=f"{len(report['events'])} events", data=report)
+
+@router.get("/events", response_model=DataResponse[List[Dict[str, Any]]])
+async def get_events(limit: int = Query(100, ge=1, le=1000, description="Maximum number of events to return")):
+    """Recent planogram events, newest first"""
+    planogram_engine.flush()
+    events = db_service.get_planogram_events(limit)
+    return DataResponse(success=True, message=f"{len(events)} events", data=events)
+
+@router.get("/status", response_model=DataResponse[Dict[str, Any]])
+async def get_planogram_status():
+    """Compliance check counters and frame budget usage"""
+    return DataResponse(success=True, message="Planogram status", data=planogram_engine.get_stats())
@@ -1,52 +1,243 @@
+import io
+import zipfile
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from ..models.response import DataResponse
-from typing import List, Dict, Any, Optional
-from ..services.image_handler import image_handler
+from typing import List, Dict, Any, Literal, Optional
+from ..services.camera import camera_session
+from ..services.change_gate import change_gate
+from ..services.image_pipeline import encode_jpeg
 from ..services.llm import llm_service
+from ..services.media_store import media_store
+from ..services.residency import residency_manager
+from ..services.scheduler import Priority
+from ..services.tracker import shelf_tracker
+from ..services.vision import vision_service
+from ..model_registry import model_registry
+from .. import vision
+from ..config import CONFIDENCE_THRESHOLD, VISION_BATCH_MAX_IMAGES
 
 router = APIRouter(prefix="/vision", tags=["vision"])
 
-@router.post("/detect", response_model=DataResponse[List[Dict[str, Any]]])
-async def detect_products(file: UploadFile = File(...)):
+@router.post("/detect", response_model=DataResponse[Dict[str, Any]])
+async def detect_products(
+    file: UploadFile = File(..., description="Shelf image"),
+    conf: float = Form(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0, description="Minimum detection confidence"),
+    tiled: bool = Form(False, description="Detect on overlapping full-resolution tiles (wide panoramas)"),
+    model: Optional[str] = Form(None, description="Detector from /vision/models (default: VISION_MODEL_PATH)"),
+    format: Literal["records", "columnar"] = Form("records", description="'columnar': detections as parallel label/confidence/bbox_xyxy lists")
+):
+    """Detect objects in an uploaded shelf image with the resident YOLOv8 model.
+
+    Returns labels, confidences and xyxy boxes plus per-stage timings
+    (decode, preprocess, infer, postprocess). ``format=columnar`` returns the
+    detections as parallel lists, which is much smaller for crowded shelves.
     """
-    TODO: Implement YOLOv8 shelf recognition
-    This endpoint will:
-    1. Process uploaded shelf images
-    2. Use YOLOv8 model for product detection
-    3. Return detected products with confidence scores
-    4. Map detections to product database
+    data = await file.read()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    await run_in_threadpool(media_store.retain_copy, data, "detect")
+    try:
+        result = await vision_service.detect_products_async(data, conf, tiled=tiled, model=model)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return DataResponse(success=True, message=f"{result['count']} objects detected", data=_formatted(result, format))
+
+def _formatted(result: Dict[str, Any], format: str) -> Dict[str, Any]:
+    # Results may be shared with the detection cache, so copy rather than mutate
+    if format != "columnar" or "detections" not in result:
+        return result
+    return dict(result, detections=vision.to_columns(result["detections"]), format="columnar")
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+def _images_from_zip(data: bytes) -> List[tuple]:
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="'archive' is not a valid zip file")
+    with archive:
+        names = [
+            info.filename for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(_IMAGE_EXTENSIONS)
+        ]
+        if len(names) > VISION_BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {VISION_BATCH_MAX_IMAGES} images per batch")
+        return [(name, archive.read(name)) for name in sorted(names)]
+
+@router.post("/detect/batch", response_model=DataResponse[List[Dict[str, Any]]])
+async def detect_products_batch(
+    files: List[UploadFile] = File([], description="Shelf images"),
+    archive: Optional[UploadFile] = File(None, description="Zip of shelf images (alternative to 'files')"),
+    conf: float = Form(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0, description="Minimum detection confidence"),
+    model: Optional[str] = Form(None, description="Detector from /vision/models (default: VISION_MODEL_PATH)"),
+    format: Literal["records", "columnar"] = Form("records", description="'columnar': detections as parallel label/confidence/bbox_xyxy lists")
+):
+    """Detect objects in many shelf images in one request.
+
+    Images are micro-batched through the model (``VISION_BATCH_SIZE`` per
+    forward pass). Results come back in upload order (zip entries sorted by
+    name); an image that fails to decode gets an ``error`` instead of detections.
     """
-    raise HTTPException(
-        status_code=501, 
-        detail="Vision endpoint not yet implemented. TODO: Integrate YOLOv8 detection"
-    )
+    items = []
+    for f in files:
+        items.append((f.filename, await f.read()))
+    if archive is not None:
+        items.extend(await run_in_threadpool(_images_from_zip, await archive.read()))
+    if not items:
+        raise HTTPException(status_code=400, detail="Provide 'files' or a zip 'archive'")
+    if len(items) > VISION_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {VISION_BATCH_MAX_IMAGES} images per batch")
+
+    await run_in_threadpool(vision_service.initialize_model)
+    if not vision_service.is_initialized:
+        raise HTTPException(status_code=503, detail=vision_service.error or "Vision service not initialized")
+    try:
+        results = await vision_service.detect_batch_async(items, conf, model=model)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    detected = sum(1 for r in results if "error" not in r)
+    return DataResponse(success=True, message=f"{detected}/{len(results)} images processed",
+                        data=[_formatted(r, format) for r in results])
+
+@router.get("/status", response_model=DataResponse[Dict[str, Any]])
+async def get_vision_status():
+    """Detection model load state, warm-up timings, camera session, change-gate, tracker and media store counts."""
+    data = dict(vision_service.get_model_info(), camera=camera_session.get_stats(), change_gate=change_gate.get_stats(),
+                tracker=shelf_tracker.get_stats(), media=media_store.get_stats())
+    return DataResponse(success=True, message="Vision status", data=data)
+
+def _vision_llm_models() -> List[Dict[str, Any]]:
+    # Ollama loads and evicts these itself; report what's pulled and what's resident
+    resident = {m["name"]: m for m in residency_manager.resident_models()}
+    default = llm_service.vision_model.split(":")[0]
+    models = []
+    for m in residency_manager.available_models():
+        if "clip" not in m["families"] and m["name"].split(":")[0] != default:
+            continue
+        loaded = resident.get(m["name"])
+        models.append({
+            "name": m["name"],
+            "default": m["name"].split(":")[0] == default,
+            "loaded": loaded is not None,
+            "size_mb": round(m["size"] / 2**20, 1) if m.get("size") else None,
+            "memory_mb": round(loaded["size"] / 2**20, 1) if loaded and loaded.get("size") else None,
+        })
+    return models
 
-@router.get("/models", response_model=DataResponse[List[str]])
+@router.get("/models", response_model=DataResponse[Dict[str, Any]])
 async def get_available_models():
+    """Detector weights (load state, memory, LRU budget) and vision-LLM models available in Ollama.
+
+    Detectors are loaded on first use and the least recently used one is
+    evicted when ``VISION_MAX_MODELS`` or ``VISION_MODEL_MEMORY_MB`` is
+    exceeded. With ``VISION_WORKERS`` each worker keeps its own registry;
+    this reports the API process.
     """
-    TODO: Return available YOLOv8 models
+    detectors = await run_in_threadpool(model_registry.get_status)
+    vision_llm = await run_in_threadpool(_vision_llm_models)
+    return DataResponse(success=True, message=f"{len(detectors['models'])} detectors",
+                        data={"detectors": detectors, "vision_llm": vision_llm})
+
+@router.post("/models/{name}/load", response_model=DataResponse[Dict[str, Any]])
+async def load_detector_model(name: str):
+    """Load a detector now instead of on its first request.
+
+    With the worker pool enabled only the default detector can be preloaded
+    (starting the pool loads it in every worker); other detectors load inside
+    each worker on their first request.
     """
-    raise HTTPException(
-        status_code=501,
-        detail="Model listing not yet implemented"
-    )
+    try:
+        if vision_service.resolve_model(name) is None:
+            await run_in_threadpool(vision_service.initialize_model)
+            loaded = vision_service.is_initialized
+        elif vision_service.workers > 0:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Detection runs in {vision_service.workers} worker processes (VISION_WORKERS); "
+                       f"'{name}' loads in each worker on its first request and can't be preloaded here",
+            )
+        else:
+            loaded = await run_in_threadpool(vision.load_model, name) is not None
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    if not loaded:
+        raise HTTPException(status_code=503, detail=f"Vision model '{name}' could not be loaded")
+    status = next(m for m in model_registry.get_status()["models"] if m["name"] == model_registry.resolve(name))
+    return DataResponse(success=True, message=f"{status['name']} loaded", data=status)
+
+@router.delete("/models/{name}", response_model=DataResponse[Dict[str, Any]])
+async def unload_detector_model(name: str):
+    """Release a detector's memory; it is loaded again on its next request."""
+    try:
+        if vision_service.resolve_model(name) is None:
+            raise HTTPException(status_code=400, detail="The default detector is pinned")
+        unloaded = model_registry.unload(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return DataResponse(success=True, message="unloaded" if unloaded else "not loaded", data={"name": name, "unloaded": unloaded})
 
 @router.post("/capture", response_model=DataResponse[str])
 async def capture_and_caption(
-    user_query: Optional[str] = Form(None, description="Query about the captured image")
+    user_query: Optional[str] = Form(None, description="Query about the captured image"),
+    force: bool = Form(False, description="Analyse even if the shelf hasn't changed")
 ):
     """Capture an image from the camera and return a text caption via LLM.
-    Uses moondream for vision analysis and phi3:mini for refinement.
+    Uses moondream for vision analysis and phi3:mini for refinement. The
+    frame comes from the persistent camera session, so no per-request open.
+    If no shelf region changed since the last analysed frame, the previous
+    caption is returned without calling the LLM.
     """
     try:
-        img_path = image_handler.capture_image(filename_prefix="capture", prefer_picamera=True)
-        
-        # Use two-stage pipeline if user_query provided, otherwise simple caption
-        if user_query:
-            result = llm_service.image_to_text(str(img_path), user_query)
-        else:
-            result = llm_service.caption_image(str(img_path))
-        
-        return DataResponse(success=True, message="captured", data=result)
+        frame, _ = await run_in_threadpool(camera_session.latest)
+
+        def analyse():
+            image = encode_jpeg(frame)
+            # Use two-stage pipeline if user_query provided, otherwise simple caption. The gate only
+            # calls this for a changed frame, which the near-duplicate cache could still match
+            if user_query:
+                return llm_service.image_to_text(image, user_query, priority=Priority.BACKGROUND, cache=False)
+            return llm_service.caption_image(image, priority=Priority.BACKGROUND, cache=False)
+
+        gated = await run_in_threadpool(change_gate.run, ("caption", user_query), frame, analyse, force)
+        message = "unchanged" if gated["skipped"] else "captured"
+        return DataResponse(success=True, message=message, data=gated["result"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/capture/detect", response_model=DataResponse[Dict[str, Any]])
+async def capture_and_detect(
+    conf: float = Form(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0, description="Minimum detection confidence"),
+    force: bool = Form(False, description="Detect even if the shelf hasn't changed")
+):
+    """Detect objects in the latest camera frame, skipping the model when no shelf region changed.
+
+    Detections also advance the camera's multi-frame tracker, so ``tracking``
+    carries persistent track ids and smoothed per-region counts that don't
+    flicker when an item is missed for a frame or two.
+    """
+    def analyse():
+        # Changed (or forced) frames only; skip the near-duplicate cache, it can't see a single missing item
+        result = vision_service.detect_image(frame, conf, cache=False)
+        media = media_store.retain_copy(encode_jpeg(frame), "capture") if media_store.retain else None
+        return dict(result, tracking=shelf_tracker.update("camera", result["detections"], result["image_size"]), media=media)
+
+    try:
+        frame, captured_at = await run_in_threadpool(camera_session.latest)
+        gated = await run_in_threadpool(change_gate.run, ("detect", conf), frame, analyse, force)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    data = dict(gated["result"], captured_at=captured_at,
+                gate={k: v for k, v in gated.items() if k != "result"})
+    message = "unchanged" if gated["skipped"] else f"{data['count']} objects detected"
+    return DataResponse(success=True, message=message, data=data)
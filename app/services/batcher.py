@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class DynamicBatcher:
+    """Merge items submitted within a short window into one batched call.
+
+    A single worker thread owns ``process_batch``. It waits for the first
+    item, keeps collecting for up to ``window_ms`` or until ``max_batch``
+    items have arrived, then runs them together and resolves each item's
+    future. Because only this thread calls ``process_batch``, a model that
+    can't be called concurrently is safe behind it. ``process_batch`` can
+    return an exception in place of a result to fail only that item; if it
+    raises, every item in the batch fails.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch: int = 8,
+        window_ms: float = 10.0,
+        name: str = "batcher",
+    ):
+        self.process_batch = process_batch
+        self.max_batch = max(1, max_batch)
+        self.window_s = max(0.0, window_ms) / 1000
+        self.name = name
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[Any, Future]] = []
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        future: Future = Future()
+        with self._cond:
+            self._ensure_thread()
+            self._pending.append((item, future))
+            self._cond.notify()
+        return future
+
+    def submit_many(self, items: List[Any]) -> List[Future]:
+        futures = [Future() for _ in items]
+        with self._cond:
+            self._ensure_thread()
+            self._pending.extend(zip(items, futures))
+            self._cond.notify()
+        return futures
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window_s
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            live = [(item, f) for item, f in batch if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                results = self.process_batch([item for item, _ in live])
+                for (_, future), result in zip(live, results):
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except BaseException as e:
+                for _, future in live:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches += 1
+            self.items += len(live)
+            self.max_seen = max(self.max_seen, len(live))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "max_batch": self.max_batch,
+            "window_ms": self.window_s * 1000,
+            "queued": queued,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.max_seen,
+        }
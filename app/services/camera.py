@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .image_pipeline import encode_jpeg
+from ..config import CAMERA_INDEX, CAMERA_RING_SIZE, CAMERA_FPS, CAMERA_IDLE_TIMEOUT_S, CAMERA_WARMUP_S
+
+try:
+    from picamera2 import Picamera2  # type: ignore
+    PICAMERA_AVAILABLE = True
+except Exception:
+    PICAMERA_AVAILABLE = False
+
+try:
+    import cv2  # type: ignore
+    OPENCV_AVAILABLE = True
+except Exception:
+    OPENCV_AVAILABLE = False
+
+
+class PicameraSource:
+    """Picamera2 in video mode; frames come back as BGR arrays."""
+
+    name = "picamera2"
+
+    def __init__(self):
+        self.cam = Picamera2()
+        # Picamera2's "RGB888" is BGR in memory, which is what OpenCV/YOLO expect
+        self.cam.configure(self.cam.create_video_configuration(main={"format": "RGB888"}))
+        self.cam.start()
+
+    def read(self) -> np.ndarray:
+        return self.cam.capture_array()
+
+    def close(self) -> None:
+        self.cam.stop()
+        self.cam.close()
+
+
+class OpenCVSource:
+    name = "opencv"
+
+    def __init__(self, index: int = CAMERA_INDEX):
+        self.cap = cv2.VideoCapture(index)
+        if not self.cap.isOpened():
+            self.cap.release()
+            raise RuntimeError(f"OpenCV could not open camera index {index}")
+
+    def read(self) -> np.ndarray:
+        ret, frame = self.cap.read()
+        if not ret:
+            raise RuntimeError("OpenCV failed to read frame from camera")
+        return frame
+
+    def close(self) -> None:
+        self.cap.release()
+
+
+def open_default_source(prefer_picamera: bool = True):
+    if prefer_picamera and PICAMERA_AVAILABLE:
+        return PicameraSource()
+    if OPENCV_AVAILABLE:
+        return OpenCVSource()
+    raise RuntimeError("No supported camera backend available (Picamera2 or OpenCV required)")
+
+
+class CameraSession:
+    """Keeps the camera open on a capture thread and serves the latest frame.
+
+    Opening a camera and letting auto-exposure settle costs hundreds of
+    milliseconds, so the first request starts a thread that holds the device
+    and keeps the ``ring_size`` most recent frames. Later requests return the
+    newest frame immediately. Frames from the first ``warmup_s`` after opening
+    are discarded while exposure settles, and the camera is released after
+    ``idle_timeout_s`` without a request so an idle shelf unit saves power.
+    """
+
+    def __init__(
+        self,
+        open_source: Optional[Callable[[], Any]] = None,
+        ring_size: int = CAMERA_RING_SIZE,
+        fps: float = CAMERA_FPS,
+        idle_timeout_s: float = CAMERA_IDLE_TIMEOUT_S,
+        warmup_s: float = CAMERA_WARMUP_S,
+    ):
+        self.open_source = open_source or open_default_source
+        self.ring_size = max(1, ring_size)
+        self.interval_s = 1.0 / fps if fps > 0 else 0.0
+        self.idle_timeout_s = idle_timeout_s
+        self.warmup_s = warmup_s
+        self._frames: Deque[Tuple[float, np.ndarray]] = deque(maxlen=self.ring_size)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # Set (under _cond) once the capture thread has decided to exit; it may still be closing the device
+        self._stopping = False
+        self._last_access = 0.0
+        self.backend: Optional[str] = None
+        self.error: Optional[str] = None
+        self.opens = 0
+        self.open_ms: Optional[float] = None
+        self.frames_captured = 0
+        self.requests = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        while True:
+            with self._cond:
+                self._last_access = time.monotonic()
+                thread = self._thread
+                if thread is None or not thread.is_alive():
+                    self._stop.clear()
+                    self._stopping = False
+                    self._frames.clear()
+                    self.error = None
+                    self._thread = threading.Thread(target=self._run, name="camera-session", daemon=True)
+                    self._thread.start()
+                    return
+                if not self._stopping:
+                    return
+            # The capture thread is on its way out (idle, error or stop); let it release the device first
+            thread.join()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self._stop.set()
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+        try:
+            source = self.open_source()
+        except Exception as e:
+            with self._cond:
+                self.error = str(e)
+                self._stopping = True
+                self._cond.notify_all()
+            return
+        self.opens += 1
+        self.open_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.backend = getattr(source, "name", type(source).__name__)
+        settled_at = time.monotonic() + self.warmup_s
+        try:
+            while not self._stop.is_set():
+                frame = source.read()
+                now = time.monotonic()
+                with self._cond:
+                    if now >= settled_at:
+                        self._frames.append((time.time(), frame))
+                        self.frames_captured += 1
+                        self._cond.notify_all()
+                    # Decided under the lock, so a concurrent start() either refreshes _last_access first or sees _stopping
+                    if now - self._last_access > self.idle_timeout_s:
+                        self._stopping = True
+                        break
+                if self.interval_s:
+                    self._stop.wait(self.interval_s)
+        except Exception as e:
+            with self._cond:
+                self.error = str(e)
+                self._stopping = True
+                self._cond.notify_all()
+        finally:
+            source.close()
+            with self._cond:
+                self._stopping = True
+                self._frames.clear()
+                self._cond.notify_all()
+
+    def latest(self, timeout: float = 5.0) -> Tuple[np.ndarray, float]:
+        """Newest frame and its capture time, opening the camera if needed."""
+        self.start()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.requests += 1
+            while not self._frames:
+                if self.error:
+                    raise RuntimeError(self.error)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping or not self.running:
+                    raise RuntimeError(self.error or "Camera produced no frame in time")
+                self._cond.wait(remaining)
+            captured_at, frame = self._frames[-1]
+        return frame, captured_at
+
+    def recent(self) -> List[Tuple[float, np.ndarray]]:
+        """Buffered (capture time, frame) pairs, oldest first."""
+        with self._cond:
+            return list(self._frames)
+
+    def capture_jpeg(self, quality: int = 90) -> bytes:
+        frame, _ = self.latest()
+        return encode_jpeg(frame, quality=quality)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            newest = self._frames[-1][0] if self._frames else None
+            buffered = len(self._frames)
+        return {
+            "running": self.running,
+            "backend": self.backend,
+            "opens": self.opens,
+            "open_ms": self.open_ms,
+            "frames_captured": self.frames_captured,
+            "buffered": buffered,
+            "ring_size": self.ring_size,
+            "latest_age_ms": round((time.time() - newest) * 1000, 1) if newest else None,
+            "idle_timeout_s": self.idle_timeout_s,
+            "requests": self.requests,
+            "error": self.error,
+        }
+
+
+# Global camera session
+camera_session = CameraSession()
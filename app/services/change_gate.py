@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .image_pipeline import gray_thumbnail
+from ..config import (
+    SHELF_REGIONS,
+    CHANGE_THUMB_WIDTH,
+    CHANGE_THUMB_HEIGHT,
+    CHANGE_PIXEL_THRESHOLD,
+    CHANGE_REGION_FRACTION,
+    CHANGE_MAX_SKIP_S,
+)
+
+
+class ChangeGate:
+    """Run expensive frame analysis only when a shelf region has changed.
+
+    Each frame is reduced to a small grayscale thumbnail (the downscale also
+    smooths sensor noise) and differenced against the thumbnail that was last
+    analysed for the same key, e.g. ("caption", prompt) or ("detect", conf).
+    A region counts as changed when more than ``region_fraction`` of its
+    pixels moved by over ``pixel_threshold`` grey levels. Unchanged frames get
+    the previous result back; after ``max_skip_s`` the analysis is re-run
+    anyway so a slowly drifting scene can't be served stale forever.
+
+    ``regions`` maps names to normalised ``[x0, y0, x1, y1]`` rectangles.
+    """
+
+    def __init__(
+        self,
+        regions: Dict[str, List[float]] = SHELF_REGIONS,
+        size: Tuple[int, int] = (CHANGE_THUMB_WIDTH, CHANGE_THUMB_HEIGHT),
+        pixel_threshold: float = CHANGE_PIXEL_THRESHOLD,
+        region_fraction: float = CHANGE_REGION_FRACTION,
+        max_skip_s: float = CHANGE_MAX_SKIP_S,
+        max_keys: int = 32,
+    ):
+        self.regions = regions or {"shelf": [0.0, 0.0, 1.0, 1.0]}
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.region_fraction = region_fraction
+        self.max_skip_s = max_skip_s
+        self.max_keys = max_keys
+        self.masks = self._build_masks()
+        self._state: Dict[Hashable, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.triggers = 0
+        self.skips = 0
+        self.region_triggers = {name: 0 for name in self.regions}
+
+    def _build_masks(self) -> Dict[str, np.ndarray]:
+        width, height = self.size
+        masks = {}
+        for name, (x0, y0, x1, y1) in self.regions.items():
+            mask = np.zeros((height, width), dtype=bool)
+            mask[int(y0 * height):max(int(y0 * height) + 1, round(y1 * height)),
+                 int(x0 * width):max(int(x0 * width) + 1, round(x1 * width))] = True
+            masks[name] = mask
+        return masks
+
+    def region_changes(self, reference: np.ndarray, thumb: np.ndarray) -> Dict[str, float]:
+        """Fraction of changed pixels per region between two thumbnails."""
+        moved = np.abs(thumb - reference) > self.pixel_threshold
+        return {name: round(float(moved[mask].mean()), 4) for name, mask in self.masks.items()}
+
+    def run(self, key: Hashable, frame: np.ndarray, analyse: Callable[[], Any], force: bool = False) -> Dict[str, Any]:
+        """``analyse()`` if ``frame`` differs from the last analysed one for ``key``.
+
+        Returns the (fresh or previous) result together with whether it was
+        skipped, why it ran and the per-region change fractions.
+        """
+        thumb = gray_thumbnail(frame, *self.size)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+        changes: Dict[str, float] = {}
+        if force:
+            reason = "forced"
+        elif state is None:
+            reason = "initial"
+        elif now - state["at"] > self.max_skip_s:
+            reason = "stale"
+        else:
+            changes = self.region_changes(state["reference"], thumb)
+            changed = [name for name, fraction in changes.items() if fraction > self.region_fraction]
+            if not changed:
+                with self._lock:
+                    self.skips += 1
+                    state["skips"] += 1
+                return {"result": state["result"], "skipped": True, "reason": "unchanged",
+                        "changed_regions": [], "region_changes": changes}
+            reason = "changed"
+
+        result = analyse()
+        changed = [name for name, fraction in changes.items() if fraction > self.region_fraction]
+        with self._lock:
+            self.triggers += 1
+            for name in changed:
+                self.region_triggers[name] += 1
+            self._state.pop(key, None)
+            self._state[key] = {"reference": thumb, "result": result, "at": now, "skips": 0}
+            while len(self._state) > self.max_keys:
+                self._state.pop(next(iter(self._state)))
+        return {"result": result, "skipped": False, "reason": reason,
+                "changed_regions": changed, "region_changes": changes}
+
+    def reset(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._state.clear()
+            else:
+                self._state.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.triggers + self.skips
+            return {
+                "regions": self.regions,
+                "pixel_threshold": self.pixel_threshold,
+                "region_fraction": self.region_fraction,
+                "max_skip_s": self.max_skip_s,
+                "keys": len(self._state),
+                "triggers": self.triggers,
+                "skips": self.skips,
+                "skip_rate": round(self.skips / total, 3) if total else 0.0,
+                "region_triggers": dict(self.region_triggers),
+            }
+
+
+# Global gate for camera frames
+change_gate = ChangeGate()
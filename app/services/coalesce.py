@@ -0,0 +1,89 @@
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class _Call:
+    """A single in-flight upstream call shared by every identical caller."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        self.context: Any = None
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one upstream execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive with the same key while it is still running block until it
+    finishes and receive the same result (or exception). Nothing is cached
+    once the call completes, so later requests always hit the backend.
+    The leader's ``context`` is passed to each joiner's ``on_join``, e.g. so
+    a more urgent joiner can promote the leader's queued job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a stable key from JSON-serialisable parts (dicts are key-sorted)."""
+        raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        context: Any = None,
+        on_join: Optional[Callable[[Any], None]] = None,
+    ) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                call.context = context
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            if on_join is not None:
+                on_join(call.context)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight(),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import LLM_CONTEXT_CACHE_ENTRIES, LLM_CONTEXT_CACHE_MAX_CHARS
+
+
+class ContextCache:
+    """LRU of pre-rendered catalogue blocks keyed by (search term, DB data version).
+
+    Entries for older versions can never be hit again, so they are dropped as
+    soon as a newer version is seen. Memory is bounded both by entry count and
+    by the total length of the cached context strings.
+    """
+
+    def __init__(self, max_entries: int = LLM_CONTEXT_CACHE_ENTRIES, max_chars: int = LLM_CONTEXT_CACHE_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+        self._chars = 0
+        self._version = -1
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, search: Optional[str], version: int) -> Optional[Dict[str, Any]]:
+        key = ((search or "").lower(), version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, search: Optional[str], version: int, entry: Dict[str, Any]) -> None:
+        key = ((search or "").lower(), version)
+        size = len(entry["context"])
+        with self._lock:
+            if version > self._version:
+                self._entries.clear()
+                self._chars = 0
+                self._version = version
+            elif version < self._version:
+                return
+            if size > self.max_chars:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._chars -= len(old["context"])
+            self._entries[key] = entry
+            self._chars += size
+            while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted["context"])
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "chars": self._chars,
+                "version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -1,13 +1,23 @@
 import sqlite3
+import threading
 from typing import List, Optional, Dict, Any
 from pathlib import Path
 import json
 from datetime import datetime
 
+from ..config import DB_PATH
+
 class DatabaseService:
-    def __init__(self, db_path: str = "shelf_assistant.db"):
+    def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
+        # Monotonic counter bumped on every write; lets callers cache derived data
+        self.data_version = 0
+        self._version_lock = threading.Lock()
         self.init_database()
+
+    def _bump_version(self):
+        with self._version_lock:
+            self.data_version += 1
     
     def init_database(self):
         """Initialize the database with required tables"""
@@ -28,9 +38,41 @@ class DatabaseService:
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
+
+        # Planogram: expected facings per shelf region (normalised image coordinates)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS planogram_facings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                shelf_location TEXT,
+                label TEXT NOT NULL,
+                x0 REAL NOT NULL,
+                y0 REAL NOT NULL,
+                x1 REAL NOT NULL,
+                y1 REAL NOT NULL,
+                expected_count INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS planogram_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_type TEXT NOT NULL,
+                facing_id INTEGER,
+                product_id INTEGER,
+                shelf_location TEXT,
+                label TEXT,
+                detail TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
         conn.commit()
         conn.close()
+        # The schema (or the whole file, if db_path changed) may be new
+        self._bump_version()
     
     def create_product(self, product_data: Dict[str, Any]) -> int:
         """Create a new product and return its ID"""
@@ -52,6 +94,7 @@ class DatabaseService:
         product_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        self._bump_version()
         
         return product_id
     
@@ -106,6 +149,8 @@ class DatabaseService:
         rows_affected = cursor.rowcount
         conn.commit()
         conn.close()
+        if rows_affected > 0:
+            self._bump_version()
         
         return rows_affected > 0
     
@@ -116,9 +161,12 @@ class DatabaseService:
         
         cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
         rows_affected = cursor.rowcount
+        cursor.execute("DELETE FROM planogram_facings WHERE product_id = ?", (product_id,))
         
         conn.commit()
         conn.close()
+        if rows_affected > 0:
+            self._bump_version()
         
         return rows_affected > 0
     
@@ -142,5 +190,111 @@ class DatabaseService:
             return [dict(zip(columns, row)) for row in rows]
         return []
 
+    def create_facing(self, facing_data: Dict[str, Any]) -> int:
+        """Create a planogram facing and return its ID"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        facing_data.pop('id', None)
+        facing_data['created_at'] = datetime.now().isoformat()
+        facing_data['updated_at'] = datetime.now().isoformat()
+
+        columns = ', '.join(facing_data.keys())
+        placeholders = ', '.join(['?' for _ in facing_data])
+        query = f"INSERT INTO planogram_facings ({columns}) VALUES ({placeholders})"
+        cursor.execute(query, list(facing_data.values()))
+
+        facing_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        return facing_id
+
+    def get_facings(self, shelf_location: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get planogram facings, optionally for one shelf location"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        if shelf_location:
+            cursor.execute("SELECT * FROM planogram_facings WHERE shelf_location = ? ORDER BY id", (shelf_location,))
+        else:
+            cursor.execute("SELECT * FROM planogram_facings ORDER BY id")
+        rows = cursor.fetchall()
+        conn.close()
+
+        if rows:
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in rows]
+        return []
+
+    def delete_facing(self, facing_id: int) -> bool:
+        """Delete a planogram facing by ID"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("DELETE FROM planogram_facings WHERE id = ?", (facing_id,))
+        rows_affected = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+
+        return rows_affected > 0
+
+    def record_planogram_events(
+        self,
+        events: List[Dict[str, Any]],
+        stock_updates: Optional[Dict[int, int]] = None,
+    ) -> int:
+        """Store planogram events and apply stock updates in one transaction.
+
+        Returns the number of products whose stock_quantity changed.
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        now = datetime.now().isoformat()
+        cursor.executemany(
+            """
+            INSERT INTO planogram_events (event_type, facing_id, product_id, shelf_location, label, detail, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (e["event_type"], e.get("facing_id"), e.get("product_id"), e.get("shelf_location"),
+                 e.get("label"), json.dumps(e.get("detail")), now)
+                for e in events
+            ],
+        )
+        changed = 0
+        for product_id, quantity in (stock_updates or {}).items():
+            cursor.execute(
+                "UPDATE products SET stock_quantity = ?, updated_at = ? WHERE id = ? AND stock_quantity != ?",
+                (quantity, now, product_id, quantity),
+            )
+            changed += cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        if changed > 0:
+            self._bump_version()
+
+        return changed
+
+    def get_planogram_events(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Get planogram events, most recent first"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT * FROM planogram_events ORDER BY id DESC LIMIT ?", (limit,))
+        rows = cursor.fetchall()
+        conn.close()
+
+        if rows:
+            columns = [description[0] for description in cursor.description]
+            events = [dict(zip(columns, row)) for row in rows]
+            for event in events:
+                event["detail"] = json.loads(event["detail"]) if event["detail"] else None
+            return events
+        return []
+
 # Global database service instance
 db_service = DatabaseService()
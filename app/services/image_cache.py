@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+import numpy as np
+
+from .image_pipeline import IMAGE_HASHES, hamming
+from ..config import IMAGE_CACHE_ENTRIES, IMAGE_CACHE_HASH, IMAGE_CACHE_MAX_DISTANCE, IMAGE_CACHE_TTL_S
+
+
+class PerceptualCache:
+    """LRU of image results keyed by perceptual hash.
+
+    Fixed cameras resend almost the same frame, so a lookup matches any entry
+    in the same namespace (operation, prompt, model, ...) whose 64-bit hash is
+    within ``max_distance`` bits of the new image's. Entries expire after
+    ``ttl_s`` so a changed shelf is eventually re-analysed even if it hashes
+    close to the old one.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = IMAGE_CACHE_ENTRIES,
+        max_distance: int = IMAGE_CACHE_MAX_DISTANCE,
+        algorithm: str = IMAGE_CACHE_HASH,
+        ttl_s: float = IMAGE_CACHE_TTL_S,
+    ):
+        if algorithm not in IMAGE_HASHES:
+            raise ValueError(f"Unknown image hash '{algorithm}' (expected one of {sorted(IMAGE_HASHES)})")
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.algorithm = algorithm
+        self.ttl_s = ttl_s
+        self._hash_fn = IMAGE_HASHES[algorithm]
+        self._entries: "OrderedDict[Tuple[Hashable, int], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.unhashable = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def hash(self, image: Union[bytes, np.ndarray]) -> Optional[int]:
+        """Perceptual hash of encoded bytes or a decoded array; None if it can't be read."""
+        if not self.enabled:
+            return None
+        try:
+            return self._hash_fn(image)
+        except Exception:
+            self.unhashable += 1
+            return None
+
+    def get(self, namespace: Hashable, image_hash: Optional[int], max_distance: Optional[int] = None) -> Optional[Any]:
+        """Closest live entry within ``max_distance`` bits (default: the cache's; 0 for exact-only)."""
+        if image_hash is None or not self.enabled:
+            return None
+        max_distance = self.max_distance if max_distance is None else max_distance
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_distance = None, max_distance + 1
+            for key, (stored_at, _) in self._entries.items():
+                if key[0] != namespace or now - stored_at > self.ttl_s:
+                    continue
+                distance = hamming(key[1], image_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            if best_distance == 0:
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            return self._entries[best_key][1]
+
+    def put(self, namespace: Hashable, image_hash: Optional[int], result: Any) -> None:
+        if image_hash is None or not self.enabled:
+            return
+        key = (namespace, image_hash)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            total = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "algorithm": self.algorithm,
+                "max_distance": self.max_distance,
+                "ttl_s": self.ttl_s,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "unhashable": self.unhashable,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+            }
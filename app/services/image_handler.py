@@ -1,7 +1,9 @@
-from typing import Optional, Tuple
+from contextlib import contextmanager
+from typing import Iterator, Optional
 from pathlib import Path
-import time
-import tempfile
+
+from .camera import camera_session
+from .media_store import MediaStore, media_store
 
 # Prefer Picamera2; fallback to OpenCV for non-RPi environments
 try:
@@ -20,13 +22,16 @@ class ImageHandler:
     """Image capture and IO utilities with modular backends.
 
     This class abstracts camera capture using Picamera2 (preferred on RPi)
-    or OpenCV fallback. It also manages temporary files for downstream
-    processing pipelines (e.g., LLM multimodal inference, detection).
+    or OpenCV fallback, via the shared persistent ``camera_session``. Files
+    for downstream processing pipelines (e.g., LLM multimodal inference,
+    detection) go to the bounded ``media_store``: use ``captured_image`` /
+    ``staged_upload`` to have them deleted once processed, or ``release`` a
+    path returned by ``capture_image`` / ``save_uploaded_image``.
     """
 
-    def __init__(self, output_dir: Optional[Path] = None):
-        self.output_dir = Path(output_dir) if output_dir else Path(tempfile.gettempdir())
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, output_dir: Optional[Path] = None, store: Optional[MediaStore] = None):
+        self.store = store or (MediaStore(root=str(output_dir)) if output_dir else media_store)
+        self.output_dir = self.store.root
         self.camera_initialized = False
         self.backend = None  # 'picamera2' or 'opencv'
 
@@ -41,45 +46,33 @@ class ImageHandler:
             return
         raise RuntimeError("No supported camera backend available (Picamera2 or OpenCV required)")
 
-    def capture_image(self, filename_prefix: str = "capture", prefer_picamera: bool = True) -> Path:
+    def _capture_jpeg(self, prefer_picamera: bool) -> bytes:
         if not self.camera_initialized:
             self.initialize_camera(prefer_picamera=prefer_picamera)
+        return camera_session.capture_jpeg()
 
-        timestamp = int(time.time() * 1000)
-        out_path = self.output_dir / f"{filename_prefix}_{timestamp}.jpg"
+    def capture_image(self, filename_prefix: str = "capture", prefer_picamera: bool = True) -> Path:
+        """Save the latest frame from the persistent camera session as a JPEG."""
+        return self.store.put(self._capture_jpeg(prefer_picamera), filename_prefix)
 
-        if self.backend == 'picamera2':
-            # Minimal Picamera2 capture path (no preview)
-            cam = Picamera2()
-            config = cam.create_still_configuration()
-            cam.configure(config)
-            cam.start()
-            time.sleep(0.2)
-            cam.capture_file(str(out_path))
-            cam.stop()
-            cam.close()
-            return out_path
+    def save_uploaded_image(self, data: bytes, filename_prefix: str = "upload") -> Path:
+        return self.store.put(data, filename_prefix)
 
-        if self.backend == 'opencv':
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
-                cap.release()
-                raise RuntimeError("OpenCV could not open camera index 0")
-            ret, frame = cap.read()
-            cap.release()
-            if not ret:
-                raise RuntimeError("OpenCV failed to read frame from camera")
-            cv2.imwrite(str(out_path), frame)
-            return out_path
+    @contextmanager
+    def captured_image(self, filename_prefix: str = "capture", prefer_picamera: bool = True) -> Iterator[Path]:
+        """Latest camera frame as a JPEG file for the ``with`` block, deleted afterwards."""
+        with self.store.stage(self._capture_jpeg(prefer_picamera), filename_prefix) as path:
+            yield path
 
-        raise RuntimeError("Camera backend not initialized correctly")
+    @contextmanager
+    def staged_upload(self, data: bytes, filename_prefix: str = "upload") -> Iterator[Path]:
+        """Uploaded bytes as a file for the ``with`` block, deleted afterwards."""
+        with self.store.stage(data, filename_prefix) as path:
+            yield path
 
-    def save_uploaded_image(self, data: bytes, filename_prefix: str = "upload") -> Path:
-        timestamp = int(time.time() * 1000)
-        out_path = self.output_dir / f"{filename_prefix}_{timestamp}.jpg"
-        with open(out_path, 'wb') as f:
-            f.write(data)
-        return out_path
+    def release(self, path: Path) -> None:
+        """Done with a file from ``capture_image`` / ``save_uploaded_image``."""
+        self.store.release(path)
 
 # Global instance
 image_handler = ImageHandler()
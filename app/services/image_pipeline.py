@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import io
+from typing import Tuple, Union
+
+import numpy as np
+
+from ..config import VISION_LLM_MAX_SIDE
+
+try:
+    import cv2  # type: ignore
+    OPENCV_AVAILABLE = True
+except Exception:
+    OPENCV_AVAILABLE = False
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode encoded image bytes (JPEG/PNG/...) to a BGR uint8 array."""
+    if OPENCV_AVAILABLE:
+        arr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if arr is None:
+            raise ValueError("Could not decode image data")
+        return arr
+    from PIL import Image
+    try:
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+    except Exception as e:
+        raise ValueError(f"Could not decode image data: {e}")
+    return np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+
+
+def resize(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    if image.shape[1] == width and image.shape[0] == height:
+        return image
+    if OPENCV_AVAILABLE:
+        return cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+    from PIL import Image
+    return np.asarray(Image.fromarray(image).resize((width, height), Image.BILINEAR))
+
+
+def letterbox(
+    image: np.ndarray,
+    size: Union[int, Tuple[int, int]] = 640,
+    color: int = 114,
+) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """Resize keeping aspect ratio and pad to ``size`` (YOLO-style).
+
+    Returns the padded image, the scale applied and the (x, y) padding so
+    boxes can be mapped back: ``orig = (box - pad) / scale``.
+    """
+    target_w, target_h = (size, size) if isinstance(size, int) else size
+    h, w = image.shape[:2]
+    scale = min(target_w / w, target_h / h)
+    new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+    resized = resize(image, new_w, new_h)
+    pad_x, pad_y = (target_w - new_w) // 2, (target_h - new_h) // 2
+    out = np.full((target_h, target_w) + image.shape[2:], color, dtype=image.dtype)
+    out[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return out, scale, (pad_x, pad_y)
+
+
+def encode_jpeg(image: np.ndarray, quality: int = 85) -> bytes:
+    """Encode a BGR array as JPEG bytes."""
+    if OPENCV_AVAILABLE:
+        ok, buf = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return buf.tobytes()
+    from PIL import Image
+    out = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(image[:, :, ::-1])).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def image_size(data: bytes) -> Tuple[int, int]:
+    """(width, height) from the image header, without decoding pixels."""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def vision_llm_image(data: bytes, max_side: int = VISION_LLM_MAX_SIDE) -> str:
+    """Base64 image for an Ollama vision call, downscaled when larger than needed.
+
+    Small enough images are passed through untouched (no decode/re-encode);
+    vision LLMs like moondream work at a few hundred pixels, so larger ones
+    are shrunk in memory before the (much smaller) payload is encoded.
+    """
+    try:
+        width, height = image_size(data)
+    except Exception:
+        width = height = 0
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        image = decode_image(data)
+        data = encode_jpeg(resize(image, max(1, round(width * scale)), max(1, round(height * scale))))
+    return base64.b64encode(data).decode("ascii")
+
+
+def gray_thumbnail(image: Union[bytes, np.ndarray], width: int, height: int) -> np.ndarray:
+    """Tiny float32 grayscale version of an image (encoded bytes or BGR array)."""
+    if isinstance(image, (bytes, bytearray)):
+        from PIL import Image
+        with Image.open(io.BytesIO(image)) as img:
+            img.draft("L", (width * 4, height * 4))  # JPEG: decode at reduced scale
+            small = img.convert("L").resize((width, height), Image.BILINEAR)
+            return np.asarray(small, dtype=np.float32)
+    if OPENCV_AVAILABLE:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+    from PIL import Image
+    gray = image[:, :, ::-1] if image.ndim == 3 else image
+    small = Image.fromarray(np.ascontiguousarray(gray)).convert("L").resize((width, height), Image.BILINEAR)
+    return np.asarray(small, dtype=np.float32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def ahash(image: Union[bytes, np.ndarray]) -> int:
+    """64-bit average hash: pixels of an 8x8 thumbnail above its mean."""
+    thumb = gray_thumbnail(image, 8, 8)
+    return _bits_to_int(thumb > thumb.mean())
+
+
+def dhash(image: Union[bytes, np.ndarray]) -> int:
+    """64-bit difference hash: horizontal gradients of a 9x8 thumbnail."""
+    thumb = gray_thumbnail(image, 9, 8)
+    return _bits_to_int(thumb[:, 1:] > thumb[:, :-1])
+
+
+def phash(image: Union[bytes, np.ndarray]) -> int:
+    """64-bit DCT hash: low frequencies of a 32x32 thumbnail above their median."""
+    thumb = gray_thumbnail(image, 32, 32)
+    low = (_DCT_32 @ thumb @ _DCT_32.T)[:8, :8]
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+IMAGE_HASHES = {"ahash": ahash, "dhash": dhash, "phash": phash}
+
+
+def content_hash(image: np.ndarray) -> int:
+    """64-bit hash of the exact pixels, for results that must not be shared with near-duplicates."""
+    return int.from_bytes(hashlib.blake2b(np.ascontiguousarray(image), digest_size=8).digest(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
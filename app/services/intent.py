@@ -0,0 +1,156 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from .db import db_service
+from ..config import LLM_FAST_PATH
+
+# Each intent maps to question templates with an <item> group naming the product.
+INTENT_PATTERNS = {
+    "location": [
+        r"^where (?:is|are|'s|can i find|do i find|do you keep|would i find) (?P<item>.+)$",
+        r"^which (?:aisle|shelf) (?:is|are) (?P<item>.+?)(?: on| in| at)?$",
+        r"^(?:find|locate) (?P<item>.+)$",
+    ],
+    "price": [
+        r"^how much (?:is|are|does|do) (?P<item>.+?)(?: cost| costs)?$",
+        r"^what(?:'s| is| are) the (?:price|cost) (?:of|for) (?P<item>.+)$",
+        r"^(?:price|cost) (?:of|for) (?P<item>.+)$",
+        r"^what does (?P<item>.+?) cost$",
+    ],
+    "stock": [
+        r"^(?:is|are) (?:there )?(?:any )?(?P<item>.+?) (?:in stock|available|left)$",
+        r"^(?:do you have|have you got|do you stock|do you sell) (?:any )?(?P<item>.+?)(?: in stock| available)?$",
+    ],
+}
+
+_COMPILED = {
+    intent: [re.compile(p) for p in patterns]
+    for intent, patterns in INTENT_PATTERNS.items()
+}
+
+_FILLER = re.compile(r"^(?:the|a|an|some|your)\s+")
+# "it", "that one", "those" ... refer back to an earlier turn; the DB can't resolve them
+_REFERENCE = re.compile(r"^(?:(?:it|that|this|they|them|these|those)(?: ones?| items?| products?)?|one)$")
+
+
+def _normalize(question: str) -> str:
+    q = question.lower().strip()
+    q = re.sub(r"[?!.]+$", "", q)
+    q = re.sub(r"[,\s]+(?:please|thanks|thank you)$", "", q)
+    return " ".join(q.split())
+
+
+class IntentRouter:
+    """Answer templated product questions straight from the DB, skipping the LLM.
+
+    Questions like "where is milk", "how much is bread" or "is rice in stock"
+    are matched against fixed templates, the product is resolved with a DB
+    search and the answer is rendered from the row. Anything that doesn't
+    match, or doesn't resolve to a single product, returns ``None`` so the
+    caller falls through to the LLM.
+    """
+
+    def __init__(self, enabled: bool = LLM_FAST_PATH):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.total = 0
+        self.no_intent = 0
+        self.unresolved = 0
+        self.hits: Dict[str, int] = {intent: 0 for intent in INTENT_PATTERNS}
+
+    def classify(self, question: str) -> Optional[Dict[str, str]]:
+        q = _normalize(question)
+        for intent, patterns in _COMPILED.items():
+            for pattern in patterns:
+                m = pattern.match(q)
+                if m:
+                    item = _FILLER.sub("", m.group("item")).strip()
+                    if item:
+                        return {"intent": intent, "item": item}
+        return None
+
+    @staticmethod
+    def is_reference(item: str) -> bool:
+        """True for pronouns and demonstratives ("it", "that one") rather than a product name."""
+        return bool(_REFERENCE.match(item))
+
+    def resolve_product(self, item: str) -> Optional[Dict[str, Any]]:
+        if self.is_reference(item):
+            return None
+        candidates = db_service.search_products(item)
+        if not candidates and item.endswith("s"):
+            candidates = db_service.search_products(item[:-1])
+        return self._pick(item, candidates)
+
+    @staticmethod
+    def _pick(item: str, candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not candidates:
+            return None
+        # Whole words only, so "it" doesn't find "Biscuits"; a trailing plural "s" is optional
+        singular = item[:-1] if item.endswith("s") else item
+        word = re.compile(rf"\b(?:{re.escape(item)}|{re.escape(singular)})s?\b")
+        named = [p for p in candidates if word.search((p.get("name") or "").lower())]
+        exact = [p for p in named if (p.get("name") or "").lower() in (item, item.rstrip("s"))]
+        if exact:
+            return exact[0]
+        if len(named) == 1:
+            return named[0]
+        if not named and len(candidates) == 1:
+            return candidates[0]
+        # Several different products match; let the LLM deal with the ambiguity
+        return None
+
+    @staticmethod
+    def render(intent: str, product: Dict[str, Any]) -> str:
+        name = product.get("name")
+        location = product.get("shelf_location")
+        if intent == "location":
+            if location:
+                return f"{name} is on shelf {location}."
+            return f"I don't have a shelf location for {name}."
+        if intent == "price":
+            price = product.get("price")
+            if price is None:
+                return f"I don't have a price for {name}."
+            return f"{name} costs {float(price):.2f}."
+        quantity = product.get("stock_quantity") or 0
+        if quantity > 0:
+            where = f" on shelf {location}" if location else ""
+            return f"Yes, {name} is in stock ({quantity} available){where}."
+        return f"Sorry, {name} is currently out of stock."
+
+    def answer(self, question: str) -> Optional[str]:
+        """Return a templated answer, or ``None`` if the LLM should handle it."""
+        if not self.enabled or not question:
+            return None
+        match = self.classify(question)
+        product = self.resolve_product(match["item"]) if match else None
+        with self._lock:
+            self.total += 1
+            if match is None:
+                self.no_intent += 1
+            elif product is None:
+                self.unresolved += 1
+            else:
+                self.hits[match["intent"]] += 1
+        if product is None:
+            return None
+        return self.render(match["intent"], product)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                "enabled": self.enabled,
+                "questions": self.total,
+                "fast_path_hits": hits,
+                "hits_by_intent": dict(self.hits),
+                "no_intent": self.no_intent,
+                "unresolved": self.unresolved,
+                "hit_rate": round(hits / self.total, 3) if self.total else 0.0,
+            }
+
+
+# Global intent router instance
+intent_router = IntentRouter()
@@ -1,7 +1,30 @@
+import json
+import re
+import time
 import requests
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any, List, Union
 from .db import db_service
-from ..config import OLLAMA_BASE_URL, OLLAMA_MODEL
+from .coalesce import SingleFlight
+from .residency import residency_manager
+from .prompts import (
+    PrefixCacheStats,
+    assemble_context,
+    build_chat_messages,
+    build_conversation_messages,
+    prefix_key,
+    query_terms,
+    render_catalogue,
+)
+from .scheduler import Priority, llm_scheduler
+from .telemetry import llm_telemetry
+from .context_cache import ContextCache
+from .image_cache import PerceptualCache
+from .image_pipeline import vision_llm_image
+from ..config import OLLAMA_BASE_URL, OLLAMA_TEXT_MODEL, OLLAMA_VISION_MODEL, LLM_CONTEXT_TOKEN_BUDGET
+
+# An image path on disk, or the encoded image bytes straight from an upload
+ImageSource = Union[str, bytes]
 
 DEFAULT_SYSTEM_PROMPT = (
     "You are a concise supermarket shelf assistant. Use ONLY the provided product context. "
@@ -19,12 +42,37 @@ REFINEMENT_SYSTEM_PROMPT = (
     "that directly answers the user's query about the image."
 )
 
+# Queries the vision model alone answers well enough that refinement adds only latency
+_DESCRIBE_QUERY = re.compile(
+    r"^\s*(?:describe|caption|what(?:'s| is| do you see)? (?:in |on )?(?:this|the) (?:image|picture|photo|shelf)|what do you see)",
+    re.IGNORECASE,
+)
+_YES_NO_QUERY = re.compile(r"^\s*(?:is|are|does|do|can|was|were|has|have)\b", re.IGNORECASE)
+def caption_answers_query(caption: str, user_query: str) -> bool:
+    """Heuristic: True when the stage-one caption already answers the query."""
+    caption = caption.strip()
+    if not caption:
+        return False
+    if _DESCRIBE_QUERY.match(user_query):
+        return True
+    if _YES_NO_QUERY.match(user_query) and re.match(r"^(?:yes|no)\b", caption, re.IGNORECASE):
+        return True
+    return False
+
 class LLMService:
     def __init__(self):
         self.base_url = OLLAMA_BASE_URL.rstrip('/')
-        self.text_model = "phi3:mini"  # Updated to phi3:mini for text generation
-        self.vision_model = "moondream"  # For image analysis
+        self.text_model = OLLAMA_TEXT_MODEL  # Default text model (phi3:mini); override per request
+        self.vision_model = OLLAMA_VISION_MODEL  # Default vision model (moondream); override per request
         self.is_connected = False
+        self._inflight = SingleFlight()
+        self.prefix_stats = PrefixCacheStats()
+        self.scheduler = llm_scheduler
+        self.telemetry = llm_telemetry
+        self.context_token_budget = LLM_CONTEXT_TOKEN_BUDGET
+        self.context_stats = {"builds": 0, "truncated_builds": 0, "truncated_products": 0}
+        self.context_cache = ContextCache()
+        self.image_cache = PerceptualCache()
 
     def _ping(self) -> bool:
         try:
@@ -46,13 +94,135 @@ class LLMService:
             "vision_model": self.vision_model,
             "is_connected": self._ping(),
             "status": "ok" if self.is_connected else "unreachable",
+            "coalescing": self._inflight.get_stats(),
+            "prefix_cache": self.prefix_stats.get_stats(),
+            "scheduler": self.scheduler.get_stats(),
+            "inference": self.telemetry.get_summary(),
+            "context": dict(
+                self.context_stats, token_budget=self.context_token_budget, cache=self.context_cache.get_stats()
+            ),
+            "image_cache": self.image_cache.get_stats(),
         }
         return status
 
+    def _request(
+        self,
+        endpoint: str,
+        payload: Dict[str, Any],
+        timeout: int,
+        error_label: str,
+        priority: Priority = Priority.NORMAL,
+        operation: str = "generate",
+    ) -> Dict[str, Any]:
+        """POST to an Ollama endpoint, sharing one upstream call between identical payloads.
+
+        The key covers the model, prompt, options and base64 images, so only
+        requests that would produce the same generation are coalesced. Every
+        call carries ``keep_alive`` so pinned models are not unloaded by traffic.
+        The upstream call waits its turn in the priority scheduler (at the
+        most urgent priority of the callers sharing it), and its timing
+        fields are recorded in telemetry under ``operation``.
+        """
+        payload.setdefault("keep_alive", residency_manager.keep_alive_value())
+        key = SingleFlight.make_key(endpoint, payload)
+
+        def call() -> Dict[str, Any]:
+            resp = requests.post(f"{self.base_url}{endpoint}", json=payload, timeout=timeout)
+            if not resp.ok:
+                raise RuntimeError(f"{error_label} {resp.status_code}: {resp.text}")
+            data = resp.json()
+            self.telemetry.record(payload["model"], operation, data)
+            return data
+
+        return self._scheduled(key, call, priority)
+
+    def _scheduled(self, key: str, call: Callable[[], Dict[str, Any]], priority: Priority) -> Dict[str, Any]:
+        """Run ``call`` through the scheduler, coalesced on ``key``.
+
+        A caller that joins an identical request already waiting in the queue
+        promotes it to its own priority, so an interactive question is never
+        stuck behind background work because a background caller asked first.
+        """
+        job = self.scheduler.prepare(call, priority)
+        return self._inflight.do(
+            key,
+            lambda: self.scheduler.enqueue(job).result(),
+            context=job,
+            on_join=lambda leader: self.scheduler.promote(leader, priority),
+        )
+
+    def _stream(
+        self,
+        endpoint: str,
+        payload: Dict[str, Any],
+        timeout: int,
+        error_label: str,
+        stop_after_sentences: Optional[int] = None,
+        priority: Priority = Priority.NORMAL,
+        operation: str = "generate",
+    ) -> Dict[str, Any]:
+        """Stream an Ollama call and return the full text plus first-token latency.
+
+        Closing the stream early (``stop_after_sentences``) makes Ollama abort the
+        generation, so a rambling caption stops costing CPU as soon as we have enough.
+        Identical concurrent streams are coalesced like ``_request``.
+        """
+        payload = dict(payload, stream=True)
+        payload.setdefault("keep_alive", residency_manager.keep_alive_value())
+        key = SingleFlight.make_key("stream", endpoint, payload, stop_after_sentences)
+
+        def call() -> Dict[str, Any]:
+            start = time.perf_counter()
+            first_token_ms = None
+            parts: List[str] = []
+            final: Dict[str, Any] = {}
+            with requests.post(f"{self.base_url}{endpoint}", json=payload, timeout=timeout, stream=True) as resp:
+                if not resp.ok:
+                    raise RuntimeError(f"{error_label} {resp.status_code}: {resp.text}")
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    token = chunk.get("response") or chunk.get("message", {}).get("content", "")
+                    if token:
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - start) * 1000
+                        parts.append(token)
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+                    if stop_after_sentences and len(re.findall(r"[.!?](?:\s|$)", "".join(parts))) >= stop_after_sentences:
+                        break
+            if not final and first_token_ms is not None:
+                # Stopped early: Ollama's timing fields only come on the final chunk, so use wall-clock
+                elapsed_ns = int((time.perf_counter() - start) * 1e9)
+                final = {
+                    "total_duration": elapsed_ns,
+                    "eval_count": len(parts),
+                    "eval_duration": max(1, elapsed_ns - int(first_token_ms * 1e6)),
+                }
+            self.telemetry.record(payload["model"], operation, final)
+            return {"text": "".join(parts).strip(), "first_token_ms": first_token_ms, "data": final}
+
+        return self._scheduled(key, call, priority)
+
+    def _generate(
+        self,
+        payload: Dict[str, Any],
+        timeout: int,
+        error_label: str,
+        priority: Priority = Priority.NORMAL,
+        operation: str = "generate",
+    ) -> str:
+        data = self._request("/api/generate", payload, timeout, error_label, priority, operation)
+        return data.get("response", "")
+
     def set_text_model(self, model_name: str):
+        """Change the default text model. Use the ``model`` argument for per-request overrides."""
         self.text_model = model_name
 
     def set_vision_model(self, model_name: str):
+        """Change the default vision model. Use the ``model`` argument for per-request overrides."""
         self.vision_model = model_name
 
     def generate_answer(
@@ -64,22 +234,27 @@ class LLMService:
         top_p: float = 0.9,
         repeat_penalty: float = 1.1,
         max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> str:
         if not self._ping():
             raise RuntimeError(
                 f"Cannot reach Ollama at {self.base_url}. Ensure 'ollama serve' is running and the model is pulled."
             )
 
+        # System prompt + catalogue first and byte-stable, question last, so Ollama
+        # can reuse the evaluated prefix from its KV cache across requests.
         sys_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
-        prompt_parts = []
-        if context:
-            prompt_parts.append(f"Context:\n{context}\n")
-        prompt_parts.append(f"Question: {question}\nAnswer:")
-        full_prompt = "\n".join(prompt_parts)
+        if history:
+            messages = build_conversation_messages(sys_prompt, context, history, question)
+        else:
+            messages = build_chat_messages(sys_prompt, context, question)
+        model_name = model or self.text_model
 
         payload = {
-            "model": self.text_model,
-            "prompt": f"{sys_prompt}\n\n{full_prompt}",
+            "model": model_name,
+            "messages": messages,
             "stream": False,
             "options": {
                 "temperature": temperature,
@@ -90,64 +265,179 @@ class LLMService:
         if max_tokens is not None:
             payload["options"]["num_predict"] = max_tokens
 
-        resp = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=60)
-        if not resp.ok:
-            raise RuntimeError(f"Ollama error {resp.status_code}: {resp.text}")
-        data = resp.json()
-        return data.get("response", "")
+        data = self._request(
+            "/api/chat", payload, timeout=60, error_label="Ollama error", priority=priority,
+            operation="generate_answer",
+        )
+        self.prefix_stats.record(prefix_key(model_name, messages), data)
+        return data.get("message", {}).get("content", "")
 
-    def analyze_image(self, image_path: str, prompt: str) -> str:
+    def analyze_image(
+        self,
+        image: ImageSource,
+        prompt: str,
+        model: Optional[str] = None,
+        priority: Priority = Priority.NORMAL,
+    ) -> str:
         """Analyze an image using moondream model for vision understanding."""
         if not self._ping():
             raise RuntimeError(
                 f"Cannot reach Ollama at {self.base_url}. Ensure 'ollama serve' is running and moondream model is pulled."
             )
 
-        # Convert image to base64 for Ollama API
-        import base64
-        with open(image_path, 'rb') as f:
-            b64 = base64.b64encode(f.read()).decode('utf-8')
+        payload = self._vision_payload(image, prompt, model)
+        return self._generate(
+            payload, timeout=120, error_label="Ollama vision error", priority=priority, operation="analyze_image"
+        )
 
-        payload = {
-            "model": self.vision_model,
+    @staticmethod
+    def _image_bytes(image: ImageSource) -> bytes:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return bytes(image)
+        with open(image, 'rb') as f:
+            return f.read()
+
+    def _vision_payload(self, image: ImageSource, prompt: str, model: Optional[str]) -> Dict[str, Any]:
+        # Raw upload bytes are used as-is; paths are read once. Either way the
+        # image is downscaled in memory before base64 if it is larger than needed.
+        return {
+            "model": model or self.vision_model,
             "prompt": prompt,
-            "images": [b64],
+            "images": [vision_llm_image(self._image_bytes(image))],
             "stream": False,
             "options": {"temperature": 0.2}
         }
 
-        resp = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=120)
-        if not resp.ok:
-            raise RuntimeError(f"Ollama vision error {resp.status_code}: {resp.text}")
-        
-        data = resp.json()
-        return data.get("response", "")
+    def _query_context(self, user_query: str) -> Dict[str, Any]:
+        """Products mentioned by the query, for grounding the refinement stage."""
+        seen: Dict[int, Dict[str, Any]] = {}
+        for term in query_terms(user_query):
+            for p in db_service.search_products(term):
+                seen.setdefault(p["id"], p)
+        matches = [seen[pid] for pid in sorted(seen)]
+        if not matches:
+            return {"context": "", "matches": [], "truncated": 0}
+        assembled = assemble_context(matches, user_query, self.context_token_budget)
+        return dict(assembled, matches=matches)
 
-    def image_to_text(self, image_path: str, user_query: str) -> str:
+    def image_to_text(
+        self,
+        image: ImageSource,
+        user_query: str,
+        text_model: Optional[str] = None,
+        vision_model: Optional[str] = None,
+        priority: Priority = Priority.NORMAL,
+        cache: bool = True,
+    ) -> str:
         """Two-stage pipeline: moondream for image analysis, then phi3:mini for refinement."""
-        # Stage 1: Raw image analysis with moondream
-        moondream_output = self.analyze_image(image_path, user_query)
-        
-        # Stage 2: Refine with phi3:mini
-        refinement_prompt = f"Raw image analysis: {moondream_output}\n\nUser query: {user_query}"
-        
-        payload = {
-            "model": self.text_model,
-            "prompt": f"{REFINEMENT_SYSTEM_PROMPT}\n\n{refinement_prompt}",
-            "stream": False,
-            "options": {"temperature": 0.3}
+        return self.image_to_text_detailed(
+            image, user_query, text_model, vision_model, priority=priority, cache=cache
+        )["answer"]
+
+    def image_to_text_detailed(
+        self,
+        image: ImageSource,
+        user_query: str,
+        text_model: Optional[str] = None,
+        vision_model: Optional[str] = None,
+        max_caption_sentences: int = 3,
+        priority: Priority = Priority.NORMAL,
+        cache: bool = True,
+    ) -> Dict[str, Any]:
+        """Pipelined two-stage image Q&A returning the answer and per-stage timings.
+
+        Product context for the query is looked up while moondream streams its
+        caption. Stage one is cut off after ``max_caption_sentences`` and the
+        phi3:mini refinement is skipped when the caption already answers the query.
+        A near-identical image asked the same query (with an unchanged catalogue)
+        is answered from the perceptual-hash cache, unless ``cache`` is False.
+        """
+        start = time.perf_counter()
+        image = self._image_bytes(image)
+        namespace = (
+            "image_to_text", user_query, vision_model or self.vision_model, text_model or self.text_model,
+            max_caption_sentences, db_service.data_version,
+        )
+        image_hash = self.image_cache.hash(image) if cache else None
+        cached = self.image_cache.get(namespace, image_hash)
+        if cached is not None:
+            return dict(cached, cached=True, timings={"total_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+        if not self._ping():
+            raise RuntimeError(
+                f"Cannot reach Ollama at {self.base_url}. Ensure 'ollama serve' is running and moondream model is pulled."
+            )
+        timings: Dict[str, Optional[float]] = {}
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            def fetch_context():
+                t0 = time.perf_counter()
+                ctx = self._query_context(user_query)
+                timings["context_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                return ctx
+
+            ctx_future = pool.submit(fetch_context)
+
+            # Stage 1: Raw image analysis with moondream, streamed
+            t0 = time.perf_counter()
+            payload = self._vision_payload(image, user_query, vision_model)
+            stage1 = self._stream(
+                "/api/generate", payload, timeout=120, error_label="Ollama vision error",
+                stop_after_sentences=max_caption_sentences, priority=priority,
+                operation="image_to_text.vision",
+            )
+            timings["stage1_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            first = stage1["first_token_ms"]
+            timings["stage1_first_token_ms"] = round(first, 1) if first is not None else None
+            ctx = ctx_future.result()
+
+        caption = stage1["text"]
+        result: Dict[str, Any] = {
+            "caption": caption,
+            "matches": [{"id": p["id"], "name": p.get("name")} for p in ctx["matches"]],
+            "context_truncated": ctx["truncated"],
         }
 
-        resp = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=60)
-        if not resp.ok:
-            raise RuntimeError(f"Ollama refinement error {resp.status_code}: {resp.text}")
-        
-        data = resp.json()
-        return data.get("response", "")
+        if caption_answers_query(caption, user_query):
+            result.update(answer=caption, refined=False)
+            timings["stage2_ms"] = 0.0
+        else:
+            # Stage 2: Refine with phi3:mini, grounded in the product context
+            t0 = time.perf_counter()
+            model_name = text_model or self.text_model
+            messages = build_chat_messages(
+                REFINEMENT_SYSTEM_PROMPT,
+                ctx["context"],
+                f"Raw image analysis: {caption}\n\nUser query: {user_query}",
+            )
+            refine_payload = {
+                "model": model_name,
+                "messages": messages,
+                "stream": False,
+                "options": {"temperature": 0.3},
+            }
+            data = self._request(
+                "/api/chat", refine_payload, timeout=60, error_label="Ollama refinement error",
+                priority=priority, operation="image_to_text.refine",
+            )
+            self.prefix_stats.record(prefix_key(model_name, messages), data)
+            result.update(answer=data.get("message", {}).get("content", ""), refined=True)
+            timings["stage2_ms"] = round((time.perf_counter() - t0) * 1000, 1)
 
-    def generate_text(self, prompt: str) -> str:
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["cached"] = False
+        self.image_cache.put(namespace, image_hash, {k: v for k, v in result.items() if k != "timings"})
+        result["timings"] = timings
+        return result
+
+    def generate_text(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> str:
         """Generate text using phi3:mini model."""
-        return self.generate_answer(question=prompt, context="", system_prompt=None)
+        return self.generate_answer(question=prompt, context="", system_prompt=None, model=model, priority=priority)
 
     def voice_query(self, audio_path: str) -> str:
         """Complete voice query pipeline: STT -> LLM response.
@@ -168,25 +458,61 @@ class LLMService:
         
         return response
 
-    def caption_image(self, image_path: str, prompt: Optional[str] = None) -> str:
-        """Caption an image using moondream model for vision understanding."""
+    def caption_image(
+        self,
+        image: ImageSource,
+        prompt: Optional[str] = None,
+        model: Optional[str] = None,
+        priority: Priority = Priority.NORMAL,
+        cache: bool = True,
+    ) -> str:
+        """Caption an image using moondream model for vision understanding.
+
+        Near-identical images with the same prompt and model reuse a cached
+        caption unless ``cache`` is False.
+        """
         user_prompt = prompt or "Describe the image succinctly."
-        return self.analyze_image(image_path, user_prompt)
+        image = self._image_bytes(image)
+        namespace = ("caption", user_prompt, model or self.vision_model)
+        image_hash = self.image_cache.hash(image) if cache else None
+        cached = self.image_cache.get(namespace, image_hash)
+        if cached is not None:
+            return cached
+        caption = self.analyze_image(image, user_prompt, model=model, priority=priority)
+        self.image_cache.put(namespace, image_hash, caption)
+        return caption
 
-    def build_product_context(self, query: Optional[str]) -> Dict[str, Any]:
-        if query:
-            matches = db_service.search_products(query)
-        else:
-            matches = db_service.get_all_products()
-        if matches:
-            lines = [
-                f"- #{p['id']} | {p.get('name','')} | {p.get('category','')} | {p.get('price','')} | {p.get('shelf_location','')}"
-                for p in matches
-            ]
-            context = "Products:\n" + "\n".join(lines)
-        else:
-            context = "Products: (none)"
-        return {"context": context, "matches": matches}
+    def build_product_context(
+        self,
+        query: Optional[str],
+        question: Optional[str] = None,
+        token_budget: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Product context for a prompt, capped at ``token_budget`` estimated tokens.
+
+        When the matches don't fit, the products most relevant to ``question`` are
+        kept and ``truncated`` says how many were left out. The rendered catalogue
+        is cached per (search term, DB data version), so between catalogue edits
+        a context that fits the budget costs a dict lookup.
+        """
+        # Read the version before querying: a concurrent write then only makes the entry newer than its key
+        version = db_service.data_version
+        entry = self.context_cache.get(query, version)
+        if entry is None:
+            if query:
+                matches = db_service.search_products(query)
+            else:
+                matches = db_service.get_all_products()
+            entry = {"matches": matches, "context": render_catalogue(matches, version=str(version))}
+            self.context_cache.put(query, version, entry)
+        matches = entry["matches"]
+        budget = token_budget if token_budget is not None else self.context_token_budget
+        assembled = assemble_context(matches, question, budget, version=str(version), full_context=entry["context"])
+        self.context_stats["builds"] += 1
+        if assembled["truncated"]:
+            self.context_stats["truncated_builds"] += 1
+            self.context_stats["truncated_products"] += assembled["truncated"]
+        return dict(assembled, matches=matches)
 
 # Global LLM service instance
 llm_service = LLMService()
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from ..config import MEDIA_DIR, MEDIA_QUOTA_MB, MEDIA_MAX_AGE_S, MEDIA_RETAIN
+
+
+class MediaStore:
+    """Bounded on-disk store for captured and uploaded media.
+
+    Files are named ``<kind>_<sha256 prefix><suffix>``, so concurrent writers
+    never collide and identical content is stored once. Writes go to a temp
+    file and are renamed into place. ``stage`` hands out a file for the
+    duration of a ``with`` block and deletes it afterwards unless the store
+    is in retain mode (``MEDIA_RETAIN``, for debugging); a file staged by
+    several callers at once is deleted when the last one is done. Everything
+    else is kept until it is older than ``max_age_s`` or the store exceeds
+    ``quota_mb``, when least recently used files are removed first.
+    """
+
+    def __init__(
+        self,
+        root: str = MEDIA_DIR,
+        quota_mb: float = MEDIA_QUOTA_MB,
+        max_age_s: float = MEDIA_MAX_AGE_S,
+        retain: bool = MEDIA_RETAIN,
+    ):
+        self.root = Path(root)
+        self.quota = int(quota_mb * 1024 * 1024)
+        self.max_age_s = max_age_s
+        self.retain = retain
+        self._lock = threading.Lock()
+        # name -> (size, last used), least recently used first
+        self._index: "OrderedDict[str, Any]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        self._bytes = 0
+        self._loaded = False
+        self.writes = 0
+        self.dedup_hits = 0
+        self.deleted = 0
+        self.evicted = 0
+
+    def _load(self) -> None:
+        # Index files left by a previous run so they count against the quota
+        if self._loaded:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.root.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                stat = path.stat()
+                files.append((stat.st_mtime, path.name, stat.st_size))
+        for mtime, name, size in sorted(files):
+            self._index[name] = (size, mtime)
+            self._bytes += size
+        self._loaded = True
+
+    @staticmethod
+    def name_for(data: bytes, kind: str, suffix: str = ".jpg") -> str:
+        return f"{kind}_{hashlib.sha256(data).hexdigest()[:24]}{suffix}"
+
+    def put(self, data: bytes, kind: str = "media", suffix: str = ".jpg", hold: bool = False) -> Path:
+        """Store ``data`` (or refresh an identical stored file) and return its path.
+
+        ``hold`` marks the file in use (see ``release``) before any cleanup can see it.
+        """
+        name = self.name_for(data, kind, suffix)
+        path = self.root / name
+        with self._lock:
+            self._load()
+            if name in self._index and path.exists():
+                self.dedup_hits += 1
+                self._index[name] = (self._index[name][0], time.time())
+                self._index.move_to_end(name)
+                if hold:
+                    self._in_use[name] = self._in_use.get(name, 0) + 1
+                return path
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".", suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._lock:
+                os.replace(tmp, path)
+                if name not in self._index:
+                    self._bytes += len(data)
+                self._index[name] = (len(data), time.time())
+                self._index.move_to_end(name)
+                if hold:
+                    self._in_use[name] = self._in_use.get(name, 0) + 1
+                self.writes += 1
+                self._enforce()
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return path
+
+    def touch(self, path: Path) -> None:
+        """Mark a stored file as recently used."""
+        with self._lock:
+            if path.name in self._index:
+                self._index[path.name] = (self._index[path.name][0], time.time())
+                self._index.move_to_end(path.name)
+
+    def delete(self, path: Path) -> bool:
+        with self._lock:
+            return self._remove(Path(path).name)
+
+    def _remove(self, name: str) -> bool:
+        entry = self._index.pop(name, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[0]
+        (self.root / name).unlink(missing_ok=True)
+        return True
+
+    def _enforce(self) -> None:
+        """Drop files past ``max_age_s``, then LRU files while over quota; files in use are skipped."""
+        if self.max_age_s > 0:
+            cutoff = time.time() - self.max_age_s
+            for name, (_, used) in list(self._index.items()):
+                if used >= cutoff:
+                    break
+                if name not in self._in_use and self._remove(name):
+                    self.evicted += 1
+        for name in list(self._index):
+            if self._bytes <= self.quota:
+                break
+            if name not in self._in_use and self._remove(name):
+                self.evicted += 1
+
+    def cleanup(self) -> int:
+        """Apply the age and quota limits now; returns how many files were removed."""
+        with self._lock:
+            self._load()
+            before = self.evicted
+            self._enforce()
+            return self.evicted - before
+
+    @contextmanager
+    def stage(self, data: bytes, kind: str = "media", suffix: str = ".jpg") -> Iterator[Path]:
+        """Path to ``data`` on disk for the ``with`` block; deleted afterwards unless retaining."""
+        path = self.put(data, kind, suffix, hold=True)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def release(self, path: Path) -> None:
+        """Done with a staged (or ``put``) file: delete it unless retaining or still in use."""
+        name = Path(path).name
+        with self._lock:
+            count = self._in_use.pop(name, 0) - 1
+            if count > 0:
+                self._in_use[name] = count
+                return
+            if not self.retain and self._remove(name):
+                self.deleted += 1
+
+    def retain_copy(self, data: bytes, kind: str, suffix: str = ".jpg") -> Optional[str]:
+        """In retain mode, keep what a request processed (for debugging); returns the file name."""
+        if not self.retain or not data:
+            return None
+        return self.put(data, kind, suffix).name
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._load()
+            return {
+                "root": str(self.root),
+                "files": len(self._index),
+                "bytes": self._bytes,
+                "quota_bytes": self.quota,
+                "max_age_s": self.max_age_s,
+                "retain": self.retain,
+                "in_use": sum(self._in_use.values()),
+                "writes": self.writes,
+                "dedup_hits": self.dedup_hits,
+                "deleted": self.deleted,
+                "evicted": self.evicted,
+            }
+
+
+# Global media store
+media_store = MediaStore()
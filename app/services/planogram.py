@@ -0,0 +1,251 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .db import db_service
+from ..config import PLANOGRAM_MIN_OVERLAP, PLANOGRAM_FRAME_BUDGET_MS, PLANOGRAM_EMPTY_FRAMES
+
+
+def overlap_matrix(a: np.ndarray, b: np.ndarray, mode: str = "iou") -> np.ndarray:
+    """Pairwise overlap of (N, 4) and (M, 4) xyxy boxes as an (N, M) array.
+
+    ``mode="iou"`` is intersection over union; ``mode="ioa"`` is intersection
+    over the area of the boxes in ``a`` (how much of each ``a`` box lies
+    inside each ``b`` box).
+    """
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = w * h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    if mode == "ioa":
+        return inter / np.maximum(area_a[:, None], 1e-9)
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class PlanogramEngine:
+    """Match detections to expected facings and emit compliance events.
+
+    Each detection is assigned to the facing that contains most of it
+    (IoU breaks ties between overlapping facings); detections covering less
+    than ``min_overlap`` of their area with any facing are left unassigned.
+    Per facing, detections with the expected label count towards the facing
+    and other labels are misplaced items. Events are only emitted when a
+    facing's state changes, so a shelf that stays empty doesn't produce one
+    event per frame.
+
+    Matching is a handful of numpy operations on (detections x facings)
+    arrays; event and stock writes go to SQLite on a background writer so
+    the frame path stays within ``frame_budget_ms``.
+    """
+
+    def __init__(
+        self,
+        min_overlap: float = PLANOGRAM_MIN_OVERLAP,
+        frame_budget_ms: float = PLANOGRAM_FRAME_BUDGET_MS,
+        empty_frames: int = PLANOGRAM_EMPTY_FRAMES,
+    ):
+        self.min_overlap = min_overlap
+        self.frame_budget_ms = frame_budget_ms
+        self.empty_frames = max(1, empty_frames)
+        self._facings: Dict[Optional[str], Tuple[List[Dict[str, Any]], np.ndarray, np.ndarray]] = {}
+        self._facings_version = -1
+        self._state: Dict[int, Tuple[str, Tuple[str, ...]]] = {}
+        # product_id -> consecutive apply_stock frames with none of its items found
+        self._empty_streak: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="planogram-writer")
+        self._pending: Optional[Future] = None
+        self.checks = 0
+        self.events = 0
+        self.stock_updates = 0
+        self.over_budget = 0
+        self.last_ms: Optional[float] = None
+
+    # Facings
+
+    def add_facing(self, facing_data: Dict[str, Any]) -> int:
+        facing_id = db_service.create_facing(facing_data)
+        self.invalidate()
+        return facing_id
+
+    def delete_facing(self, facing_id: int) -> bool:
+        deleted = db_service.delete_facing(facing_id)
+        self.invalidate()
+        with self._lock:
+            self._state.pop(facing_id, None)
+        return deleted
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._facings.clear()
+
+    def _load(self, shelf_location: Optional[str]) -> Tuple[List[Dict[str, Any]], np.ndarray, np.ndarray]:
+        with self._lock:
+            # Product deletions remove their facings and bump the data version
+            if db_service.data_version != self._facings_version:
+                self._facings.clear()
+                self._facings_version = db_service.data_version
+            cached = self._facings.get(shelf_location)
+        if cached is None:
+            facings = db_service.get_facings(shelf_location)
+            boxes = np.array([[f["x0"], f["y0"], f["x1"], f["y1"]] for f in facings], dtype=np.float32).reshape(-1, 4)
+            labels = np.array([f["label"] for f in facings], dtype=object)
+            cached = (facings, boxes, labels)
+            with self._lock:
+                self._facings[shelf_location] = cached
+        return cached
+
+    # Matching
+
+    def match(
+        self,
+        detections: Sequence[Dict[str, Any]],
+        image_size: Sequence[int],
+        shelf_location: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Per-facing counts for one frame's detections (no events, no writes)."""
+        facings, facing_boxes, facing_labels = self._load(shelf_location)
+        width, height = image_size
+        n_facings = len(facings)
+        det_boxes = np.array([d["bbox_xyxy"] for d in detections], dtype=np.float32).reshape(-1, 4)
+        det_boxes = det_boxes / np.array([width, height, width, height], dtype=np.float32)
+        det_labels = np.array([d["label"] for d in detections], dtype=object)
+
+        found = np.zeros(n_facings, dtype=int)
+        misplaced: List[List[str]] = [[] for _ in range(n_facings)]
+        unassigned = len(detections)
+        if n_facings and len(detections):
+            score = overlap_matrix(det_boxes, facing_boxes, "ioa") + 1e-3 * overlap_matrix(det_boxes, facing_boxes)
+            best = score.argmax(axis=1)
+            assigned = score[np.arange(len(best)), best] >= self.min_overlap
+            correct = assigned & (det_labels == facing_labels[best])
+            found = np.bincount(best[correct], minlength=n_facings)
+            for det_index in np.flatnonzero(assigned & ~correct):
+                misplaced[best[det_index]].append(str(det_labels[det_index]))
+            unassigned = int((~assigned).sum())
+
+        report = []
+        for i, facing in enumerate(facings):
+            expected = int(facing["expected_count"] or 1)
+            count = int(found[i])
+            status = "out_of_stock" if count == 0 else ("low" if count < expected else "ok")
+            report.append({
+                "facing_id": facing["id"],
+                "product_id": facing["product_id"],
+                "shelf_location": facing["shelf_location"],
+                "label": facing["label"],
+                "expected": expected,
+                "found": count,
+                "empty_facings": max(0, expected - count),
+                "status": status,
+                "misplaced": sorted(misplaced[i]),
+            })
+        return {"facings": report, "unassigned": unassigned}
+
+    def _events_for(self, facing: Dict[str, Any]) -> List[Dict[str, Any]]:
+        status, misplaced = facing["status"], tuple(facing["misplaced"])
+        previous_status, previous_misplaced = self._state.get(facing["facing_id"], ("ok", ()))
+        self._state[facing["facing_id"]] = (status, misplaced)
+        base = {k: facing[k] for k in ("facing_id", "product_id", "shelf_location", "label")}
+        events = []
+        if status != previous_status:
+            if status == "ok" or (status == "low" and previous_status == "out_of_stock"):
+                event_type = "restocked"
+            else:
+                event_type = status
+            detail = {"found": facing["found"], "expected": facing["expected"], "previous": previous_status}
+            events.append(dict(base, event_type=event_type, detail=detail))
+        if misplaced and misplaced != previous_misplaced:
+            events.append(dict(base, event_type="misplaced", detail={"items": list(misplaced)}))
+        return events
+
+    def check(
+        self,
+        detections: Sequence[Dict[str, Any]],
+        image_size: Sequence[int],
+        shelf_location: Optional[str] = None,
+        apply_stock: bool = False,
+        elapsed_ms: float = 0.0,
+    ) -> Dict[str, Any]:
+        """Match a frame against the planogram and emit state-change events.
+
+        With ``apply_stock``, products with no matching item in any of their
+        facings for ``empty_frames`` consecutive frames have ``stock_quantity``
+        set to 0, so one missed detection doesn't empty the stock. ``elapsed_ms``
+        is time already spent on the frame (e.g. detection) and counts
+        against the frame budget.
+        """
+        start = time.perf_counter()
+        result = self.match(detections, image_size, shelf_location)
+
+        per_product: Dict[int, int] = {}
+        if apply_stock:
+            for facing in result["facings"]:
+                per_product[facing["product_id"]] = per_product.get(facing["product_id"], 0) + facing["found"]
+        stock_updates: Dict[int, int] = {}
+        with self._lock:
+            events = [e for facing in result["facings"] for e in self._events_for(facing)]
+            for pid, count in per_product.items():
+                if count:
+                    self._empty_streak.pop(pid, None)
+                    continue
+                self._empty_streak[pid] = self._empty_streak.get(pid, 0) + 1
+                if self._empty_streak[pid] >= self.empty_frames:
+                    stock_updates[pid] = 0
+        if events or stock_updates:
+            self._pending = self._writer.submit(self._write, events, stock_updates)
+
+        match_ms = (time.perf_counter() - start) * 1000
+        total_ms = elapsed_ms + match_ms
+        within_budget = total_ms <= self.frame_budget_ms
+        with self._lock:
+            self.checks += 1
+            self.events += len(events)
+            self.last_ms = round(total_ms, 2)
+            if not within_budget:
+                self.over_budget += 1
+        return dict(
+            result,
+            events=events,
+            stock_zeroed=sorted(stock_updates),
+            timings={"match_ms": round(match_ms, 2), "total_ms": round(total_ms, 2)},
+            budget_ms=self.frame_budget_ms,
+            within_budget=within_budget,
+        )
+
+    def _write(self, events: List[Dict[str, Any]], stock_updates: Dict[int, int]) -> int:
+        changed = db_service.record_planogram_events(events, stock_updates)
+        with self._lock:
+            self.stock_updates += changed
+        return changed
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Wait for queued event/stock writes to reach the database."""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "min_overlap": self.min_overlap,
+                "frame_budget_ms": self.frame_budget_ms,
+                "empty_frames": self.empty_frames,
+                "checks": self.checks,
+                "events": self.events,
+                "stock_updates": self.stock_updates,
+                "over_budget": self.over_budget,
+                "last_ms": self.last_ms,
+                "tracked_facings": len(self._state),
+                "empty_products": sum(1 for n in self._empty_streak.values() if n),
+            }
+
+
+# Global planogram engine
+planogram_engine = PlanogramEngine()
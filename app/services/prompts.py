@@ -0,0 +1,218 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Fixed column order for catalogue lines. Changing it invalidates every cached prefix.
+CATALOGUE_FIELDS = ("id", "name", "category", "price", "shelf_location")
+
+# Question words that say which columns an answer needs when the context must be trimmed
+FIELD_HINTS = {
+    "price": ("price", "cost", "how much", "cheap", "expensive", "cheapest", "afford"),
+    "shelf_location": ("where", "aisle", "shelf", "find", "locate", "location"),
+    "stock_quantity": ("stock", "available", "left", "have any", "sold out", "how many"),
+    "description": ("sugar", "gluten", "vegan", "organic", "healthy", "ingredient", "contain", "calorie"),
+}
+
+_STOPWORDS = {
+    "the", "and", "for", "are", "is", "this", "that", "what", "which", "with", "there",
+    "any", "how", "many", "much", "does", "have", "you", "image", "picture", "photo", "shelf",
+}
+
+
+def _format_value(field: str, value: Any) -> str:
+    if value is None or value == "":
+        return "-"
+    if field == "price":
+        try:
+            return f"{float(value):.2f}"
+        except (TypeError, ValueError):
+            return str(value)
+    # Collapse whitespace so stray newlines/tabs can't shift the layout
+    return " ".join(str(value).split())
+
+
+def query_terms(text: str) -> List[str]:
+    """Content words of a question (lower-case, 3+ characters, stopwords removed)."""
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) >= 3 and w not in _STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English BPE vocabularies)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def render_catalogue_line(product: Dict[str, Any], fields=CATALOGUE_FIELDS) -> str:
+    return "- " + " | ".join(
+        f"#{product.get('id')}" if field == "id" else _format_value(field, product.get(field))
+        for field in fields
+    )
+
+
+def render_catalogue(
+    products: List[Dict[str, Any]],
+    version: Optional[str] = None,
+    fields=CATALOGUE_FIELDS,
+    note: Optional[str] = None,
+) -> str:
+    """Render products as a canonical, byte-identical catalogue block.
+
+    Products are sorted by id and every value is normalised, so the same rows
+    always produce the same bytes regardless of query order. The header
+    carries a version stamp; when none is given a content hash is used.
+    """
+    if not products:
+        return "Products: (none)"
+    ordered = sorted(products, key=lambda p: p.get("id") or 0)
+    lines = [render_catalogue_line(p, fields) for p in ordered]
+    body = "\n".join(lines)
+    if version is None:
+        version = hashlib.sha1(body.encode("utf-8")).hexdigest()[:12]
+    extra = f"; {note}" if note else ""
+    header = f"Products (catalogue v{version}; columns: {' | '.join(fields)}{extra}):"
+    return f"{header}\n{body}"
+
+
+def fields_for_question(question: str):
+    """Columns a question needs; falls back to the full catalogue columns."""
+    q = question.lower()
+    wanted = [field for field, hints in FIELD_HINTS.items() if any(h in q for h in hints)]
+    if not wanted:
+        return CATALOGUE_FIELDS
+    return ("id", "name") + tuple(wanted)
+
+
+def relevance(product: Dict[str, Any], terms: List[str]) -> float:
+    """Weighted term overlap: name matches count most, then category, then description."""
+    if not terms:
+        return 0.0
+    name = (product.get("name") or "").lower()
+    category = (product.get("category") or "").lower()
+    description = (product.get("description") or "").lower()
+    score = 0.0
+    for term in terms:
+        score += 3.0 * (term in name) + 2.0 * (term in category) + 1.0 * (term in description)
+    return score
+
+
+def assemble_context(
+    products: List[Dict[str, Any]],
+    question: Optional[str],
+    token_budget: int,
+    version: Optional[str] = None,
+    full_context: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Fit the product context into ``token_budget`` tokens.
+
+    If the whole canonical catalogue fits, it is returned unchanged so the
+    prompt prefix stays cacheable. Otherwise products are ranked by relevance
+    to the question, trimmed to the columns the question needs, and added
+    until the budget is spent. The kept rows are still rendered in id order.
+    ``full_context`` lets callers pass an already-rendered catalogue.
+    """
+    full = full_context if full_context is not None else render_catalogue(products, version)
+    full_tokens = estimate_tokens(full)
+    if full_tokens <= token_budget or not products:
+        return {"context": full, "included": len(products), "truncated": 0, "tokens": full_tokens}
+
+    fields = fields_for_question(question or "")
+    terms = query_terms(question or "")
+    ranked = sorted(products, key=lambda p: (-relevance(p, terms), p.get("id") or 0))
+    # Reserve room for the header line
+    used = estimate_tokens(f"Products (catalogue v{version or 'x' * 12}; columns: {' | '.join(fields)}; "
+                           f"{len(products)} of {len(products)} most relevant):")
+    selected = []
+    for p in ranked:
+        cost = estimate_tokens(render_catalogue_line(p, fields)) + 1
+        if used + cost > token_budget:
+            break
+        selected.append(p)
+        used += cost
+
+    note = f"{len(selected)} of {len(products)} most relevant"
+    context = render_catalogue(selected, version, fields, note) if selected else "Products: (none)"
+    return {
+        "context": context,
+        "included": len(selected),
+        "truncated": len(products) - len(selected),
+        "tokens": estimate_tokens(context),
+    }
+
+
+def build_chat_messages(system_prompt: str, context: str, question: str) -> List[Dict[str, str]]:
+    """Order chat messages so everything shared between requests comes first.
+
+    The system prompt and catalogue form one system message (the stable
+    prefix Ollama can reuse from its KV cache); the question is always last.
+    """
+    system = f"{system_prompt}\n\n{context}" if context else system_prompt
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": question},
+    ]
+
+
+def build_conversation_messages(
+    system_prompt: str,
+    context: str,
+    history: List[Dict[str, str]],
+    question: str,
+) -> List[Dict[str, str]]:
+    """Like ``build_chat_messages`` with prior conversation turns before the question."""
+    messages = build_chat_messages(system_prompt, context, question)
+    return messages[:1] + list(history) + messages[1:]
+
+
+def prefix_key(model: str, messages: List[Dict[str, str]]) -> str:
+    """Identify the reusable prefix: every message except the final user turn."""
+    h = hashlib.sha1(model.encode("utf-8"))
+    for m in messages[:-1]:
+        h.update(b"\x00" + m["role"].encode("utf-8") + b"\x00" + m["content"].encode("utf-8"))
+    return h.hexdigest()
+
+
+class PrefixCacheStats:
+    """Estimate prompt-eval time saved by KV-cache reuse of stable prefixes.
+
+    The first request seen for a prefix is treated as the cold baseline. Later
+    requests with the same prefix report a lower ``prompt_eval_duration`` when
+    Ollama reuses the cached prefix; the difference is counted as time saved.
+    """
+
+    def __init__(self, max_prefixes: int = 256):
+        self.max_prefixes = max_prefixes
+        self._baselines: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cold = 0
+        self.warm = 0
+        self.saved_ns = 0
+        self.prompt_eval_ns = 0
+
+    def record(self, key: str, data: Dict[str, Any]) -> None:
+        duration = data.get("prompt_eval_duration")
+        if duration is None:
+            return
+        duration = int(duration)
+        with self._lock:
+            self.prompt_eval_ns += duration
+            baseline = self._baselines.get(key)
+            if baseline is None:
+                self.cold += 1
+                self._baselines[key] = duration
+                if len(self._baselines) > self.max_prefixes:
+                    self._baselines.popitem(last=False)
+                return
+            self.warm += 1
+            self._baselines.move_to_end(key)
+            self.saved_ns += max(0, baseline - duration)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tracked_prefixes": len(self._baselines),
+                "cold_requests": self.cold,
+                "warm_requests": self.warm,
+                "prompt_eval_ms": round(self.prompt_eval_ns / 1e6, 1),
+                "prompt_eval_saved_ms": round(self.saved_ns / 1e6, 1),
+            }
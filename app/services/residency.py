@@ -0,0 +1,130 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from ..config import (
+    OLLAMA_BASE_URL,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_PRELOAD_MODELS,
+    OLLAMA_TEXT_MODEL,
+    OLLAMA_VISION_MODEL,
+)
+
+
+def canonical_name(model: str) -> str:
+    """Ollama's name for ``model``: an untagged name means ``:latest``."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelResidencyManager:
+    """Keep the configured Ollama models loaded so requests never pay a cold load.
+
+    Models are pre-loaded with an empty-prompt generate call (which makes
+    Ollama load the weights without generating anything) and pinned with
+    ``keep_alive``. Residency is read back from Ollama's ``/api/ps``.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        self.base_url = base_url.rstrip('/')
+        self.keep_alive = keep_alive
+        self.configured_models = self._parse_models(OLLAMA_PRELOAD_MODELS)
+        self.preload_results: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_models(raw: str) -> List[str]:
+        raw = raw.strip()
+        if raw.lower() == "none":
+            return []
+        if not raw:
+            return [OLLAMA_TEXT_MODEL, OLLAMA_VISION_MODEL]
+        return [m.strip() for m in raw.split(",") if m.strip()]
+
+    def keep_alive_value(self) -> Any:
+        """Ollama accepts durations ("30m") or integer seconds (-1 = forever)."""
+        try:
+            return int(self.keep_alive)
+        except ValueError:
+            return self.keep_alive
+
+    def preload(self, model: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        payload = {"model": model, "prompt": "", "stream": False, "keep_alive": self.keep_alive_value()}
+        try:
+            resp = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=300)
+            if resp.ok:
+                result = {"status": "loaded", "load_ms": round((time.perf_counter() - start) * 1000, 1)}
+            else:
+                result = {"status": "error", "error": f"{resp.status_code}: {resp.text}"}
+        except Exception as e:
+            result = {"status": "error", "error": str(e)}
+        with self._lock:
+            self.preload_results[model] = result
+        return result
+
+    def preload_all(self, models: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        for model in models if models is not None else self.configured_models:
+            self.preload(model)
+        return dict(self.preload_results)
+
+    def preload_in_background(self, models: Optional[List[str]] = None) -> threading.Thread:
+        """Warm models without blocking application startup."""
+        thread = threading.Thread(target=self.preload_all, args=(models,), name="ollama-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def available_models(self) -> List[Dict[str, Any]]:
+        """Models pulled into Ollama (``/api/tags``); vision models have a "clip" family."""
+        try:
+            resp = requests.get(f"{self.base_url}/api/tags", timeout=3)
+            if not resp.ok:
+                return []
+            models = resp.json().get("models", [])
+        except Exception:
+            return []
+        return [
+            {
+                "name": m.get("name") or m.get("model"),
+                "size": m.get("size"),
+                "families": (m.get("details") or {}).get("families") or [],
+            }
+            for m in models
+        ]
+
+    def resident_models(self) -> List[Dict[str, Any]]:
+        try:
+            resp = requests.get(f"{self.base_url}/api/ps", timeout=3)
+            if not resp.ok:
+                return []
+            models = resp.json().get("models", [])
+        except Exception:
+            return []
+        return [
+            {
+                "name": m.get("name") or m.get("model"),
+                "size": m.get("size"),
+                "size_vram": m.get("size_vram"),
+                "expires_at": m.get("expires_at"),
+            }
+            for m in models
+        ]
+
+    def get_status(self) -> Dict[str, Any]:
+        resident = self.resident_models()
+        resident_names = {canonical_name(m["name"]) for m in resident}
+        with self._lock:
+            preload = dict(self.preload_results)
+        return {
+            "keep_alive": self.keep_alive,
+            "configured": [
+                {"name": m, "resident": canonical_name(m) in resident_names, "preload": preload.get(m)}
+                for m in self.configured_models
+            ],
+            "resident": resident,
+        }
+
+
+# Global residency manager instance
+residency_manager = ModelResidencyManager()
@@ -0,0 +1,185 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Any, Callable, Dict, List, Optional
+
+from ..config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_PRIORITY_AGING_S,
+    LLM_DEADLINE_INTERACTIVE_S,
+    LLM_DEADLINE_NORMAL_S,
+)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # shopper text/voice questions
+    NORMAL = 1  # image questions
+    BACKGROUND = 2  # capture/caption batches
+
+
+DEFAULT_DEADLINES = {
+    Priority.INTERACTIVE: LLM_DEADLINE_INTERACTIVE_S,
+    Priority.NORMAL: LLM_DEADLINE_NORMAL_S,
+    Priority.BACKGROUND: None,
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class _Job:
+    __slots__ = ("fn", "priority", "deadline", "enqueued", "seq", "future", "started")
+
+    def __init__(self, fn, priority, deadline, seq):
+        self.fn = fn
+        self.priority = priority
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.seq = seq
+        self.future: Future = Future()
+        self.started = False
+
+
+class JobScheduler:
+    """Priority-aware gate in front of the model backend.
+
+    At most ``max_concurrency`` jobs run at once; the rest wait in a queue
+    ordered by priority class. A waiting job's effective priority improves by
+    one class every ``aging_s`` seconds so background work cannot starve, and a
+    job whose deadline passes before it starts fails with ``DeadlineExceeded``
+    instead of occupying the backend for an answer nobody is waiting for.
+    A job that more callers come to depend on can be ``promote``d while it waits.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, aging_s: float = LLM_PRIORITY_AGING_S):
+        self.max_concurrency = max(1, max_concurrency)
+        self.aging_s = aging_s
+        self._cond = threading.Condition()
+        self._queue: List[_Job] = []
+        self._seq = itertools.count()
+        self._workers: List[threading.Thread] = []
+        self.running = 0
+        self.completed = {p.name.lower(): 0 for p in Priority}
+        self.expired = {p.name.lower(): 0 for p in Priority}
+        self.promoted = 0
+        self._wait_ms = {p.name.lower(): [] for p in Priority}
+
+    def _ensure_workers(self) -> None:
+        while len(self._workers) < self.max_concurrency:
+            t = threading.Thread(target=self._worker, name=f"llm-scheduler-{len(self._workers)}", daemon=True)
+            self._workers.append(t)
+            t.start()
+
+    def _effective_priority(self, job: _Job, now: float) -> float:
+        if self.aging_s <= 0:
+            return job.priority
+        return job.priority - (now - job.enqueued) / self.aging_s
+
+    def _next_job(self) -> _Job:
+        now = time.monotonic()
+        best = min(self._queue, key=lambda j: (self._effective_priority(j, now), j.seq))
+        self._queue.remove(best)
+        return best
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = self._next_job()
+                job.started = True
+                name = Priority(job.priority).name.lower()
+                waited = (time.monotonic() - job.enqueued) * 1000
+                samples = self._wait_ms[name]
+                samples.append(waited)
+                if len(samples) > 500:
+                    del samples[:250]
+                if job.deadline is not None and time.monotonic() > job.deadline:
+                    self.expired[name] += 1
+                    job.future.set_exception(
+                        DeadlineExceeded(f"{name} job waited {waited:.0f} ms and missed its deadline")
+                    )
+                    continue
+                self.running += 1
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn())
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    self.completed[name] += 1
+
+    def prepare(
+        self,
+        fn: Callable[[], Any],
+        priority: Priority = Priority.NORMAL,
+        deadline_s: Optional[float] = -1,
+    ) -> _Job:
+        """A job for ``fn``, not yet queued; ``deadline_s=-1`` uses the class default, ``None`` means no deadline."""
+        priority = Priority(priority)
+        if deadline_s == -1:
+            deadline_s = DEFAULT_DEADLINES[priority]
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        return _Job(fn, priority, deadline, next(self._seq))
+
+    def enqueue(self, job: _Job) -> Future:
+        with self._cond:
+            self._ensure_workers()
+            job.enqueued = time.monotonic()
+            self._queue.append(job)
+            self._cond.notify()
+        return job.future
+
+    def submit(
+        self,
+        fn: Callable[[], Any],
+        priority: Priority = Priority.NORMAL,
+        deadline_s: Optional[float] = -1,
+    ) -> Future:
+        """Queue ``fn``; ``deadline_s=-1`` uses the class default, ``None`` means no deadline."""
+        return self.enqueue(self.prepare(fn, priority, deadline_s))
+
+    def run(self, fn: Callable[[], Any], priority: Priority = Priority.NORMAL, deadline_s: Optional[float] = -1) -> Any:
+        return self.submit(fn, priority, deadline_s).result()
+
+    def promote(self, job: _Job, priority: Priority) -> bool:
+        """Raise a job that has not started yet to ``priority`` (its deadline is kept)."""
+        with self._cond:
+            if job.started or priority >= job.priority:
+                return False
+            job.priority = Priority(priority)
+            self.promoted += 1
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = {p.name.lower(): 0 for p in Priority}
+            for job in self._queue:
+                queued[Priority(job.priority).name.lower()] += 1
+            wait = {
+                name: {
+                    "avg_ms": round(sum(s) / len(s), 1) if s else 0.0,
+                    "max_ms": round(max(s), 1) if s else 0.0,
+                }
+                for name, s in self._wait_ms.items()
+            }
+            return {
+                "max_concurrency": self.max_concurrency,
+                "aging_s": self.aging_s,
+                "running": self.running,
+                "queued": queued,
+                "completed": dict(self.completed),
+                "expired": dict(self.expired),
+                "promoted": self.promoted,
+                "queue_wait": wait,
+            }
+
+
+# Global scheduler for Ollama work
+llm_scheduler = JobScheduler()
@@ -0,0 +1,152 @@
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .prompts import estimate_tokens
+from ..config import LLM_SESSION_IDLE_S, LLM_SESSION_MAX, LLM_SESSION_TOKEN_BUDGET
+
+
+def _gist(text: str, max_words: int = 20) -> str:
+    """First sentence of a turn, capped at ``max_words``."""
+    first = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    words = first.split()
+    return " ".join(words[:max_words]) + (" ..." if len(words) > max_words else "")
+
+
+class ConversationSession:
+    def __init__(self, session_id: str, search: Optional[str] = None):
+        self.id = session_id
+        self.search = search
+        self.turns: List[Dict[str, str]] = []
+        self.summary = ""
+        self.created = time.time()
+        self.last_active = time.monotonic()
+
+    def history_messages(self) -> List[Dict[str, str]]:
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Earlier in this conversation: {self.summary}"})
+        return messages + self.turns
+
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(m["content"]) for m in self.history_messages())
+
+
+class SessionStore:
+    """Bounded in-memory conversation store with idle eviction.
+
+    Each session keeps its most recent turns verbatim. When the history goes
+    over ``token_budget``, the oldest turns are folded into a short extractive
+    summary (first sentence of each turn). If the summary itself gets too long,
+    its oldest part is dropped. This keeps per-turn prompt cost roughly
+    constant however long the conversation runs.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = LLM_SESSION_MAX,
+        idle_ttl_s: float = LLM_SESSION_IDLE_S,
+        token_budget: int = LLM_SESSION_TOKEN_BUDGET,
+        keep_recent_turns: int = 2,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self.compacted_turns = 0
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_active > self.idle_ttl_s:
+                self._sessions.popitem(last=False)
+                self.evicted_idle += 1
+            elif len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted_capacity += 1
+            else:
+                break
+
+    def get_or_create(
+        self, session_id: Optional[str] = None, search: Optional[str] = None, register: bool = True
+    ) -> ConversationSession:
+        """Return the live session for ``session_id`` or start a new one.
+
+        With ``register=False`` a new session is only stored by its first
+        ``record_turn``, so a request that fails before answering leaves nothing behind.
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ConversationSession(uuid.uuid4().hex, search)
+                if register:
+                    self._add(session)
+            else:
+                self._sessions.move_to_end(session.id)
+            if search:
+                session.search = search
+            session.last_active = time.monotonic()
+            return session
+
+    def _add(self, session: ConversationSession) -> None:
+        self._sessions[session.id] = session
+        self.created += 1
+        self._evict()
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        with self._lock:
+            self._evict()
+            return self._sessions.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def record_turn(self, session: ConversationSession, question: str, answer: str) -> None:
+        with self._lock:
+            session.turns.append({"role": "user", "content": question})
+            session.turns.append({"role": "assistant", "content": answer})
+            session.last_active = time.monotonic()
+            self._compact(session)
+            if session.id not in self._sessions:
+                self._add(session)
+
+    def _compact(self, session: ConversationSession) -> None:
+        while session.history_tokens() > self.token_budget and len(session.turns) > self.keep_recent_turns:
+            turn = session.turns.pop(0)
+            speaker = "Shopper asked" if turn["role"] == "user" else "Assistant said"
+            piece = f"{speaker}: {_gist(turn['content'])}"
+            session.summary = f"{session.summary} {piece}".strip()
+            self.compacted_turns += 1
+        # The summary gets at most a third of the budget; drop its oldest words first
+        max_chars = max(0, self.token_budget // 3) * 4
+        if len(session.summary) > max_chars:
+            session.summary = "... " + session.summary[-max_chars:].split(" ", 1)[-1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evict()
+            return {
+                "active": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_s": self.idle_ttl_s,
+                "token_budget": self.token_budget,
+                "created": self.created,
+                "evicted_idle": self.evicted_idle,
+                "evicted_capacity": self.evicted_capacity,
+                "compacted_turns": self.compacted_turns,
+            }
+
+
+# Global session store instance
+session_store = SessionStore()
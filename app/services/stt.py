@@ -1,6 +1,7 @@
 # Speech-to-Text service using faster-whisper with fallback
+import io
 import os
-from typing import Optional
+from typing import Optional, Union
 from pathlib import Path
 
 try:
@@ -52,11 +53,12 @@ class STTService:
                 self.fallback_mode = True
                 self.is_initialized = True
     
-    def transcribe_audio(self, audio_path: str) -> str:
+    def transcribe_audio(self, audio_path: Union[str, bytes]) -> str:
         """Transcribe audio file to text using faster-whisper or fallback.
         
         Args:
-            audio_path: Path to the audio file
+            audio_path: Path to the audio file, or the raw audio bytes of an
+                upload (decoded in memory, no temp file)
             
         Returns:
             Transcribed text string
@@ -64,8 +66,12 @@ class STTService:
         if not self.is_initialized:
             self.initialize_model()
         
-        if not os.path.exists(audio_path):
+        if isinstance(audio_path, (bytes, bytearray)):
+            audio_source = io.BytesIO(audio_path)
+        elif not os.path.exists(audio_path):
             raise FileNotFoundError(f"Audio file not found: {audio_path}")
+        else:
+            audio_source = audio_path
         
         # If in fallback mode, return a placeholder
         if self.fallback_mode:
@@ -74,7 +80,7 @@ class STTService:
         try:
             # Transcribe with faster-whisper
             segments, info = self.model.transcribe(
-                audio_path,
+                audio_source,
                 beam_size=5,
                 language="en",  # Set to None for auto-detection
                 condition_on_previous_text=False
@@ -0,0 +1,173 @@
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+from ..config import LLM_COLD_LOAD_MS
+
+TOKENS_PER_SEC_BUCKETS = [1, 2, 5, 10, 20, 35, 50, 100, 200]
+MS_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative Prometheus-style export."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        target = q * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 2) if self.count else None,
+            "min": round(self.min, 2) if self.min is not None else None,
+            "max": round(self.max, 2) if self.max is not None else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {str(b): c for b, c in zip(self.buckets + ["+Inf"], self.counts)},
+        }
+
+
+class _ModelStats:
+    def __init__(self):
+        self.calls = 0
+        self.cold_loads = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+        self.operations: Dict[str, int] = {}
+        self.tokens_per_sec = Histogram(TOKENS_PER_SEC_BUCKETS)
+        self.prompt_eval_ms = Histogram(MS_BUCKETS)
+        self.load_ms = Histogram(MS_BUCKETS)
+        self.total_ms = Histogram(MS_BUCKETS)
+
+
+class InferenceTelemetry:
+    """Aggregate Ollama's per-call timing fields by model.
+
+    Ollama reports durations in nanoseconds: ``total_duration``,
+    ``load_duration``, ``prompt_eval_count``/``prompt_eval_duration`` and
+    ``eval_count``/``eval_duration``. Together they show whether latency
+    comes from model loads, long prompts or slow generation. A call counts as
+    a cold load when ``load_duration`` exceeds ``cold_load_ms``.
+    """
+
+    def __init__(self, cold_load_ms: float = LLM_COLD_LOAD_MS):
+        self.cold_load_ms = cold_load_ms
+        self._models: Dict[str, _ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, operation: str, data: Dict[str, Any]) -> None:
+        if not data or "total_duration" not in data:
+            return
+        ns = 1e6
+        with self._lock:
+            stats = self._models.setdefault(model, _ModelStats())
+            stats.calls += 1
+            stats.operations[operation] = stats.operations.get(operation, 0) + 1
+            stats.total_ms.observe(data.get("total_duration", 0) / ns)
+            load_ms = data.get("load_duration", 0) / ns
+            stats.load_ms.observe(load_ms)
+            if load_ms > self.cold_load_ms:
+                stats.cold_loads += 1
+            if data.get("prompt_eval_duration") is not None:
+                stats.prompt_eval_ms.observe(data["prompt_eval_duration"] / ns)
+            stats.prompt_tokens += data.get("prompt_eval_count", 0) or 0
+            eval_count = data.get("eval_count", 0) or 0
+            eval_duration = data.get("eval_duration", 0) or 0
+            stats.eval_tokens += eval_count
+            if eval_count and eval_duration:
+                stats.tokens_per_sec.observe(eval_count / (eval_duration / 1e9))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                model: {
+                    "calls": s.calls,
+                    "cold_loads": s.cold_loads,
+                    "prompt_tokens": s.prompt_tokens,
+                    "eval_tokens": s.eval_tokens,
+                    "operations": dict(s.operations),
+                    "tokens_per_sec": s.tokens_per_sec.to_dict(),
+                    "prompt_eval_ms": s.prompt_eval_ms.to_dict(),
+                    "load_ms": s.load_ms.to_dict(),
+                    "total_ms": s.total_ms.to_dict(),
+                }
+                for model, s in self._models.items()
+            }
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Compact per-model view for /llm/status."""
+        with self._lock:
+            return {
+                model: {
+                    "calls": s.calls,
+                    "cold_loads": s.cold_loads,
+                    "avg_tokens_per_sec": round(s.tokens_per_sec.sum / s.tokens_per_sec.count, 1)
+                    if s.tokens_per_sec.count else None,
+                    "avg_prompt_eval_ms": round(s.prompt_eval_ms.sum / s.prompt_eval_ms.count, 1)
+                    if s.prompt_eval_ms.count else None,
+                    "avg_total_ms": round(s.total_ms.sum / s.total_ms.count, 1) if s.total_ms.count else None,
+                }
+                for model, s in self._models.items()
+            }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        histograms = (
+            ("shelf_llm_tokens_per_second", "tokens_per_sec", "Generation speed per call"),
+            ("shelf_llm_prompt_eval_ms", "prompt_eval_ms", "Prompt evaluation time per call"),
+            ("shelf_llm_load_ms", "load_ms", "Model load time per call"),
+            ("shelf_llm_total_ms", "total_ms", "Total Ollama time per call"),
+        )
+        with self._lock:
+            models = dict(self._models)
+            lines.append("# TYPE shelf_llm_calls_total counter")
+            for model, s in models.items():
+                lines.append(f'shelf_llm_calls_total{{model="{model}"}} {s.calls}')
+            lines.append("# TYPE shelf_llm_cold_loads_total counter")
+            for model, s in models.items():
+                lines.append(f'shelf_llm_cold_loads_total{{model="{model}"}} {s.cold_loads}')
+            lines.append("# TYPE shelf_llm_prompt_tokens_total counter")
+            for model, s in models.items():
+                lines.append(f'shelf_llm_prompt_tokens_total{{model="{model}"}} {s.prompt_tokens}')
+            lines.append("# TYPE shelf_llm_eval_tokens_total counter")
+            for model, s in models.items():
+                lines.append(f'shelf_llm_eval_tokens_total{{model="{model}"}} {s.eval_tokens}')
+            for metric, attr, help_text in histograms:
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for model, s in models.items():
+                    h: Histogram = getattr(s, attr)
+                    running = 0
+                    for bound, c in zip(h.buckets + ["+Inf"], h.counts):
+                        running += c
+                        lines.append(f'{metric}_bucket{{model="{model}",le="{bound}"}} {running}')
+                    lines.append(f'{metric}_sum{{model="{model}"}} {round(h.sum, 3)}')
+                    lines.append(f'{metric}_count{{model="{model}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+# Global inference telemetry instance
+llm_telemetry = InferenceTelemetry()
@@ -0,0 +1,287 @@
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .planogram import overlap_matrix
+from ..config import (
+    SHELF_REGIONS,
+    TRACK_HIGH_THRESH,
+    TRACK_LOW_THRESH,
+    TRACK_MATCH_IOU,
+    TRACK_MIN_HITS,
+    TRACK_MAX_AGE,
+    TRACK_COUNT_ALPHA,
+)
+
+# Constant-velocity model over (cx, cy, w, h); noise scales with box size as in SORT/ByteTrack
+_F = np.eye(8, dtype=np.float64)
+_F[:4, 4:] = np.eye(4)
+_H = np.eye(4, 8, dtype=np.float64)
+_STD_POSITION = 1.0 / 20
+_STD_VELOCITY = 1.0 / 160
+
+
+def _xyxy_to_cxcywh(boxes: np.ndarray) -> np.ndarray:
+    return np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                            boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+
+
+def _cxcywh_to_xyxy(state: np.ndarray) -> np.ndarray:
+    cx, cy, w, h = state[:, 0], state[:, 1], state[:, 2], state[:, 3]
+    return np.column_stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+
+def _size_std(wh: np.ndarray, weight: float) -> np.ndarray:
+    """(N, 4) standard deviations for (x, y, w, h)-like components: x/w scale with w, y/h with h."""
+    w, h = wh[:, 0], wh[:, 1]
+    return weight * np.column_stack([w, h, w, h])
+
+
+def greedy_match(scores: np.ndarray, threshold: float) -> List[Tuple[int, int]]:
+    """Highest-score-first one-to-one pairs (row, col) with score >= ``threshold``."""
+    scores = scores.copy()
+    pairs = []
+    while scores.size:
+        i, j = np.unravel_index(np.argmax(scores), scores.shape)
+        if scores[i, j] < threshold:
+            break
+        pairs.append((int(i), int(j)))
+        scores[i, :] = -1.0
+        scores[:, j] = -1.0
+    return pairs
+
+
+class _Tracks:
+    """Struct of arrays for one stream's tracks, so predict/update are batched."""
+
+    def __init__(self):
+        self.mean = np.zeros((0, 8))
+        self.cov = np.zeros((0, 8, 8))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.labels = np.zeros(0, dtype=object)
+        self.scores = np.zeros(0)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)
+        self.next_id = 1
+        self.frames = 0
+        self.counts: Dict[str, Dict[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def predict(self) -> None:
+        if not len(self):
+            return
+        std = np.concatenate([_size_std(self.mean[:, 2:4], _STD_POSITION), _size_std(self.mean[:, 2:4], _STD_VELOCITY)], axis=1)
+        self.mean = self.mean @ _F.T
+        self.cov = _F @ self.cov @ _F.T + np.einsum("ni,ij->nij", std ** 2, np.eye(8))
+
+    def correct(self, index: np.ndarray, measurement: np.ndarray) -> None:
+        """Kalman update of tracks ``index`` with (K, 4) cx, cy, w, h measurements."""
+        mean, cov = self.mean[index], self.cov[index]
+        r = _size_std(mean[:, 2:4], _STD_POSITION) ** 2
+        s = _H @ cov @ _H.T + np.einsum("ni,ij->nij", r, np.eye(4))
+        gain = np.linalg.solve(s, (cov @ _H.T).transpose(0, 2, 1)).transpose(0, 2, 1)
+        self.mean[index] = mean + np.einsum("nij,nj->ni", gain, measurement - mean @ _H.T)
+        self.cov[index] = cov - gain @ s @ gain.transpose(0, 2, 1)
+
+    def add(self, measurement: np.ndarray, labels: np.ndarray, scores: np.ndarray, hits: int = 1) -> None:
+        n = len(measurement)
+        if not n:
+            return
+        mean = np.concatenate([measurement, np.zeros((n, 4))], axis=1)
+        std = np.concatenate([_size_std(measurement[:, 2:4], 2 * _STD_POSITION),
+                              _size_std(measurement[:, 2:4], 10 * _STD_VELOCITY)], axis=1)
+        self.mean = np.concatenate([self.mean, mean])
+        self.cov = np.concatenate([self.cov, np.einsum("ni,ij->nij", std ** 2, np.eye(8))])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n)])
+        self.next_id += n
+        self.labels = np.concatenate([self.labels, labels])
+        self.scores = np.concatenate([self.scores, scores])
+        self.hits = np.concatenate([self.hits, np.full(n, hits, dtype=np.int64)])
+        self.misses = np.concatenate([self.misses, np.zeros(n, dtype=np.int64)])
+
+    def keep(self, mask: np.ndarray) -> None:
+        for name in ("mean", "cov", "ids", "labels", "scores", "hits", "misses"):
+            setattr(self, name, getattr(self, name)[mask])
+
+
+class ShelfTracker:
+    """ByteTrack-style multi-frame tracking with smoothed per-region item counts.
+
+    Each call to ``update`` advances one stream (``key``) by a frame. Tracks
+    are Kalman-predicted, then matched to high-confidence detections of the
+    same label by IoU; tracks still unmatched get a second chance against
+    low-confidence detections, which keeps partly occluded items alive.
+    Unmatched high-confidence detections start tentative tracks, confirmed
+    after ``min_hits`` matched frames (immediately on a stream's first
+    frame). Confirmed tracks survive up to ``max_age`` missed frames and keep
+    counting while they do, so one missed detection no longer changes the
+    count. Per region and label, counts are then smoothed with an
+    exponential moving average.
+
+    ``regions`` maps names to normalised ``[x0, y0, x1, y1]`` rectangles; a
+    track belongs to every region containing its centre.
+    """
+
+    def __init__(
+        self,
+        regions: Dict[str, List[float]] = SHELF_REGIONS,
+        high_thresh: float = TRACK_HIGH_THRESH,
+        low_thresh: float = TRACK_LOW_THRESH,
+        match_iou: float = TRACK_MATCH_IOU,
+        min_hits: int = TRACK_MIN_HITS,
+        max_age: int = TRACK_MAX_AGE,
+        count_alpha: float = TRACK_COUNT_ALPHA,
+        max_keys: int = 32,
+    ):
+        self.regions = regions or {"shelf": [0.0, 0.0, 1.0, 1.0]}
+        self.high_thresh = high_thresh
+        self.low_thresh = low_thresh
+        self.match_iou = match_iou
+        self.min_hits = max(1, min_hits)
+        self.max_age = max_age
+        self.count_alpha = count_alpha
+        self.max_keys = max_keys
+        self._region_rects = np.array(list(self.regions.values()), dtype=np.float64).reshape(-1, 4)
+        self._streams: Dict[Hashable, _Tracks] = {}
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.update_ms = 0.0
+
+    def _associate(self, tracks: _Tracks, candidates: np.ndarray, boxes: np.ndarray, labels: np.ndarray,
+                   detections: np.ndarray) -> List[Tuple[int, int]]:
+        """Match tracks ``candidates`` to ``detections`` (indices into boxes/labels)."""
+        if not len(candidates) or not len(detections):
+            return []
+        iou = overlap_matrix(_cxcywh_to_xyxy(tracks.mean[candidates, :4]), boxes[detections])
+        iou[tracks.labels[candidates][:, None] != labels[detections][None, :]] = 0.0
+        return [(int(candidates[i]), int(detections[j])) for i, j in greedy_match(iou, self.match_iou)]
+
+    def update(self, key: Hashable, detections: Sequence[Dict[str, Any]], image_size: Sequence[int]) -> Dict[str, Any]:
+        """Advance stream ``key`` by one frame of detections; returns tracks and smoothed counts."""
+        start = time.perf_counter()
+        with self._lock:
+            tracks = self._streams.pop(key, None)
+            if tracks is None:
+                tracks = _Tracks()
+            self._streams[key] = tracks  # most recently used last
+            while len(self._streams) > self.max_keys:
+                self._streams.pop(next(iter(self._streams)))
+            result = self._step(tracks, detections, image_size)
+            self.frames += 1
+            elapsed = (time.perf_counter() - start) * 1000
+            self.update_ms += elapsed
+        result["track_ms"] = round(elapsed, 3)
+        return result
+
+    def _step(self, tracks: _Tracks, detections: Sequence[Dict[str, Any]], image_size: Sequence[int]) -> Dict[str, Any]:
+        boxes = np.array([d["bbox_xyxy"] for d in detections], dtype=np.float64).reshape(-1, 4)
+        scores = np.array([d["confidence"] for d in detections], dtype=np.float64)
+        labels = np.array([d["label"] for d in detections], dtype=object)
+        high = np.flatnonzero(scores >= self.high_thresh)
+        low = np.flatnonzero((scores >= self.low_thresh) & (scores < self.high_thresh))
+
+        tracks.predict()
+        tracks.frames += 1
+        # First pass: every track against confident detections
+        matches = self._associate(tracks, np.arange(len(tracks)), boxes, labels, high)
+        matched_tracks = {t for t, _ in matches}
+        # Second pass: confirmed tracks left over against weak detections
+        leftover = np.array([t for t in range(len(tracks)) if t not in matched_tracks and tracks.hits[t] >= self.min_hits],
+                            dtype=np.int64)
+        matches += self._associate(tracks, leftover, boxes, labels, low)
+
+        if matches:
+            t_idx = np.array([t for t, _ in matches])
+            d_idx = np.array([d for _, d in matches])
+            tracks.correct(t_idx, _xyxy_to_cxcywh(boxes[d_idx]))
+            tracks.scores[t_idx] = scores[d_idx]
+            tracks.hits[t_idx] += 1
+        matched = np.zeros(len(tracks), dtype=bool)
+        if matches:
+            matched[t_idx] = True
+        tracks.misses = np.where(matched, 0, tracks.misses + 1)
+        # Tentative tracks die on their first miss, confirmed ones after max_age
+        confirmed = tracks.hits >= self.min_hits
+        tracks.keep(np.where(confirmed, tracks.misses <= self.max_age, tracks.misses == 0))
+
+        used = {d for _, d in matches}
+        new = np.array([d for d in high if d not in used], dtype=np.int64)
+        # Nothing to confirm against on a stream's first frame, so its items count straight away
+        tracks.add(_xyxy_to_cxcywh(boxes[new]), labels[new], scores[new], hits=self.min_hits if tracks.frames == 1 else 1)
+        return self._report(tracks, image_size)
+
+    def _report(self, tracks: _Tracks, image_size: Sequence[int]) -> Dict[str, Any]:
+        width, height = image_size
+        confirmed = np.flatnonzero(tracks.hits >= self.min_hits)
+        boxes = _cxcywh_to_xyxy(tracks.mean[confirmed, :4])
+        centres = tracks.mean[confirmed, :2] / np.array([max(width, 1), max(height, 1)], dtype=np.float64)
+        # (tracks, regions) membership of each track centre
+        inside = ((centres[:, None, 0] >= self._region_rects[None, :, 0]) & (centres[:, None, 0] < self._region_rects[None, :, 2])
+                  & (centres[:, None, 1] >= self._region_rects[None, :, 1]) & (centres[:, None, 1] < self._region_rects[None, :, 3]))
+        labels = tracks.labels[confirmed]
+        raw: Dict[str, Dict[str, int]] = {}
+        for r, region in enumerate(self.regions):
+            values, counts = np.unique(labels[inside[:, r]].astype(str), return_counts=True)
+            raw[region] = dict(zip(values.tolist(), counts.tolist()))
+
+        alpha = self.count_alpha
+        smoothed: Dict[str, Dict[str, float]] = {}
+        for region in self.regions:
+            previous = tracks.counts.get(region, {})
+            current = raw[region]
+            smoothed[region] = {}
+            for label in set(previous) | set(current):
+                if label in previous:
+                    value = alpha * current.get(label, 0) + (1 - alpha) * previous[label]
+                else:
+                    value = float(current[label])
+                if value >= 0.05:
+                    smoothed[region][label] = value
+        tracks.counts = smoothed
+
+        return {
+            "tracks": [
+                {
+                    "track_id": int(tracks.ids[i]),
+                    "label": str(tracks.labels[i]),
+                    "confidence": round(float(tracks.scores[i]), 4),
+                    "bbox_xyxy": [round(float(v), 2) for v in box],
+                    "hits": int(tracks.hits[i]),
+                    "missed_frames": int(tracks.misses[i]),
+                }
+                for i, box in zip(confirmed, boxes)
+            ],
+            "counts": {region: {label: int(round(v)) for label, v in sorted(c.items()) if round(v) > 0}
+                       for region, c in smoothed.items()},
+            "raw_counts": raw,
+            "frame": tracks.frames,
+        }
+
+    def detections(self, tracked: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Confirmed tracks as detection dicts (e.g. for planogram checks)."""
+        return [{"label": t["label"], "confidence": t["confidence"], "bbox_xyxy": t["bbox_xyxy"], "track_id": t["track_id"]}
+                for t in tracked["tracks"]]
+
+    def reset(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._streams.clear()
+            else:
+                self._streams.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "streams": len(self._streams),
+                "active_tracks": sum(int((t.hits >= self.min_hits).sum()) for t in self._streams.values()),
+                "frames": self.frames,
+                "avg_update_ms": round(self.update_ms / self.frames, 3) if self.frames else None,
+            }
+
+
+# Global tracker (camera stream and per-shelf planogram checks)
+shelf_tracker = ShelfTracker()
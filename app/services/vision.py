@@ -1,39 +1,376 @@
-# TODO: Implement YOLOv8 shelf recognition service
-# This service will:
-# 1. Load and manage YOLOv8 models
-# 2. Process shelf images for product detection
-# 3. Return structured detection results
-# 4. Integrate with product database for identification
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .. import vision
+from ..model_registry import model_registry
+from .batcher import DynamicBatcher
+from .image_cache import PerceptualCache
+from .image_pipeline import content_hash, decode_image
+from .worker_pool import DetectionWorkerPool
+from ..tiling import tile_grid
+from ..config import CONFIDENCE_THRESHOLD, VISION_MODEL_PATH, VISION_BACKEND, VISION_BATCH_SIZE, VISION_BATCH_WINDOW_MS
+from ..config import VISION_TILE_SIZE, VISION_TILE_OVERLAP
+from ..config import (
+    VISION_WORKERS, VISION_WORKER_THREADS, VISION_WORKER_PIN_CPUS, VISION_WORKER_TIMEOUT_S, VISION_WORKER_HEALTH_S,
+)
+
+# (image, confidence threshold, model name or None for the default, use the result cache)
+_Item = Tuple[np.ndarray, float, Optional[str], bool]
 
 class VisionService:
+    """Resident YOLOv8 detector (ultralytics, ONNX Runtime or OpenVINO, see VISION_BACKEND).
+
+    The model is loaded once (at startup when ``VISION_PRELOAD`` is set) and
+    warmed with a dummy inference so the first real request doesn't pay for
+    lazy initialisation. All inference goes through a ``DynamicBatcher``:
+    its single worker thread is the only caller of the model (which isn't
+    safe to call concurrently), and images arriving within
+    ``VISION_BATCH_WINDOW_MS`` of each other share one batched forward pass.
+    Decoding runs on a separate thread pool so the event loop stays free.
+    Frames that perceptually match a recent one at the same threshold and
+    resolution reuse its detections instead of going through the model.
+    Tile crops are never matched that way (a small new item barely moves a
+    tile's hash); a tiled image's merged result is cached for exact repeats only.
+    Callers that already know the frame changed (change-gated camera frames,
+    planogram checks) pass ``cache=False``: a removed product can leave the
+    thumbnail hash untouched.
+
+    With ``VISION_WORKERS`` > 0 the model is not loaded in the API process at
+    all: frames go to a ``DetectionWorkerPool`` of processes instead, one
+    frame per worker at a time, so inference uses every core.
+    """
+
     def __init__(self):
         self.model = None
         self.is_initialized = False
-    
-    def initialize_model(self, model_path: str = "yolov8n.pt"):
-        """TODO: Initialize YOLOv8 model"""
-        self.is_initialized = False
-        # TODO: Load YOLOv8 model from model_path
-        # TODO: Set up detection parameters
-        pass
-    
-    def detect_products(self, image_path: str, confidence_threshold: float = 0.5):
-        """TODO: Detect products in shelf image"""
+        self.model_path = VISION_MODEL_PATH
+        self.load_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self._init_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="vision-decode")
+        self._batcher = DynamicBatcher(
+            self._run_batch, max_batch=VISION_BATCH_SIZE, window_ms=VISION_BATCH_WINDOW_MS, name="vision-batcher"
+        )
+        self.result_cache = PerceptualCache()
+        self.requests = 0
+        self.workers = VISION_WORKERS
+        self.worker_loader = "app.vision:load_model"
+        self.pool: Optional[DetectionWorkerPool] = None
+
+    def initialize_model(self, warmup: bool = True):
+        """Load the YOLOv8 model (VISION_MODEL_PATH) and run one warm-up inference."""
+        with self._init_lock:
+            if self.is_initialized:
+                return
+            start = time.perf_counter()
+            if self.workers > 0:
+                self._start_pool(start)
+                return
+            self.model = vision.load_model()
+            if self.model is None:
+                self.error = f"YOLO model not available ({VISION_BACKEND} backend missing or weights failed to load)"
+                return
+            self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+            if warmup:
+                start = time.perf_counter()
+                vision.infer(np.zeros((640, 640, 3), dtype=np.uint8), conf=0.99, model=self.model)
+                self.warmup_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.error = None
+            self.is_initialized = True
+
+    def _start_pool(self, start: float) -> None:
+        # Workers load and warm up their own model; the API process keeps none
+        pool = DetectionWorkerPool(
+            self.workers,
+            threads_per_worker=VISION_WORKER_THREADS,
+            loader=self.worker_loader,
+            job_timeout_s=VISION_WORKER_TIMEOUT_S,
+            health_interval_s=VISION_WORKER_HEALTH_S,
+            pin_cpus=VISION_WORKER_PIN_CPUS,
+        )
+        try:
+            pool.start()
+        except Exception as e:
+            pool.stop()
+            self.error = str(e)
+            return
+        self.pool = pool
+        self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.error = None
+        self.is_initialized = True
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+            self.is_initialized = False
+
+    def initialize_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.initialize_model, name="vision-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def _model_for(self, name: Optional[str]):
+        if name is None:
+            return self.model
+        model = vision.load_model(name)
+        if model is None:
+            raise RuntimeError(f"Vision model '{name}' could not be loaded")
+        return model
+
+    def _cache_key(self, image: np.ndarray, conf: float, model: Optional[str]):
+        # The hash is taken on a thumbnail, so the resolution (and with it the box coordinates) must be in the key
+        return ("detect", conf, model or self.model_path, image.shape[:2])
+
+    def _run_batch(self, items: List[_Item]) -> List[Dict[str, Any]]:
+        """Batcher callback: micro-batch images per (confidence threshold, model) through the model.
+
+        A group that fails (e.g. its model can't be loaded) gets the exception
+        as its results, so other requests merged into the batch still succeed.
+        """
         if not self.is_initialized:
-            raise RuntimeError("Vision service not initialized. Call initialize_model() first.")
-        
-        # TODO: Implement YOLOv8 inference
-        # TODO: Process detection results
-        # TODO: Map detections to product database
-        return []
-    
+            self.initialize_model()
+        if not self.is_initialized:
+            raise RuntimeError(self.error or "Vision service not initialized")
+        results: List[Any] = [None] * len(items)
+        hashes: List[Optional[int]] = [None] * len(items)
+        groups: Dict[Tuple[float, Optional[str]], List[int]] = {}
+        for i, (image, conf, model, use_cache) in enumerate(items):
+            hashes[i] = self.result_cache.hash(image) if use_cache else None
+            cached = self.result_cache.get(self._cache_key(image, conf, model), hashes[i])
+            if cached is not None:
+                results[i] = dict(cached, cached=True, timings={})
+            else:
+                groups.setdefault((conf, model), []).append(i)
+        for (conf, model), indices in groups.items():
+            try:
+                outputs = vision.infer_batch([items[i][0] for i in indices], conf=conf, model=self._model_for(model))
+            except Exception as e:
+                for i in indices:
+                    results[i] = e
+                continue
+            for i, (detections, speed) in zip(indices, outputs):
+                results[i] = self._store(items[i], hashes[i], detections, speed, len(indices))
+        self.requests += len(items)
+        return results
+
+    def _store(self, item: _Item, image_hash: Optional[int], detections, speed, batch_size: int):
+        """Result dict for fresh model output; also remembered in the result cache (if hashed)."""
+        image, conf, model, _ = item
+        result = {
+            "detections": detections,
+            "count": len(detections),
+            "image_size": [int(image.shape[1]), int(image.shape[0])],
+            "model": model or model_registry.default,
+            "batch_size": batch_size,
+            "timings": {
+                "preprocess_ms": round(speed.get("preprocess", 0.0), 2),
+                "infer_ms": round(speed.get("inference", 0.0), 2),
+                "postprocess_ms": round(speed.get("postprocess", 0.0), 2),
+            },
+        }
+        self.result_cache.put(self._cache_key(image, conf, model), image_hash, result)
+        return dict(result, cached=False)
+
+    def _submit_to_pool(self, item: _Item) -> Future:
+        image, conf, model, use_cache = item
+        image_hash = self.result_cache.hash(image) if use_cache else None
+        cached = self.result_cache.get(self._cache_key(image, conf, model), image_hash)
+        self.requests += 1
+        out: Future = Future()
+        if cached is not None:
+            out.set_result(dict(cached, cached=True, timings={}))
+            return out
+
+        def done(job: Future) -> None:
+            if job.exception() is not None:
+                out.set_exception(job.exception())
+            else:
+                out.set_result(self._store(item, image_hash, *job.result(), 1))
+
+        self.pool.submit(image, conf, model).add_done_callback(done)
+        return out
+
+    def _submit_many(self, items: List[Tuple[np.ndarray, float, Optional[str]]], cache: bool = True) -> List[Future]:
+        """Queue images for detection on the worker pool if enabled, else the in-process batcher.
+
+        Model names are checked here (KeyError if unknown) so a typo fails
+        the request instead of the batch it would have joined. ``cache=False``
+        bypasses the near-duplicate result cache (tile crops).
+        """
+        items = [(image, conf, self.resolve_model(model), cache) for image, conf, model in items]
+        if self.workers <= 0:
+            return self._batcher.submit_many(items)
+        if self.pool is None:
+            raise RuntimeError(self.error or "Vision worker pool not started")
+        return [self._submit_to_pool(item) for item in items]
+
+    async def _ensure_pool_async(self) -> None:
+        # Starting worker processes blocks for the model load; keep it off the event loop
+        if self.workers > 0 and not self.is_initialized:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.initialize_model)
+
+    @staticmethod
+    def resolve_model(model: Optional[str]) -> Optional[str]:
+        """Registry name of a non-default detector, or None for the default one."""
+        name = model_registry.resolve(model)
+        return None if name == model_registry.default else name
+
+    def detect_image(
+        self, image: np.ndarray, confidence_threshold: float = CONFIDENCE_THRESHOLD, model: Optional[str] = None,
+        cache: bool = True,
+    ) -> Dict[str, Any]:
+        if self.workers > 0 and not self.is_initialized:
+            self.initialize_model()
+        return self._submit_many([(image, confidence_threshold, model)], cache=cache)[0].result()
+
+    def _tile_runner(self, confidence_threshold: float, model: Optional[str] = None):
+        """``run_batch`` for ``vision.infer_tiled``: tiles go through the batcher or worker pool."""
+        def run(images: List[np.ndarray]) -> List[Tuple[List[Dict[str, Any]], Dict[str, float]]]:
+            futures = self._submit_many([(image, confidence_threshold, model) for image in images], cache=False)
+            return [(r["detections"], r["timings"]) for r in (f.result() for f in futures)]
+        return run
+
+    def detect_image_tiled(
+        self, image: np.ndarray, confidence_threshold: float = CONFIDENCE_THRESHOLD, model: Optional[str] = None,
+        cache: bool = True,
+    ) -> Dict[str, Any]:
+        """Detect on overlapping tiles (plus the full frame), micro-batched like any other images.
+
+        Blocks until every tile is done; async callers run it in an executor.
+        """
+        if len(tile_grid(image.shape[1], image.shape[0], VISION_TILE_SIZE, VISION_TILE_OVERLAP)) == 1:
+            return self.detect_image(image, confidence_threshold, model, cache)
+        key, digest, cached = self._tiled_lookup(image, confidence_threshold, model, cache)
+        if cached is not None:
+            return cached
+        if self.workers > 0 and not self.is_initialized:
+            self.initialize_model()
+        detections, info = vision.infer_tiled(
+            image, conf=confidence_threshold, run_batch=self._tile_runner(confidence_threshold, model)
+        )
+        timings = {
+            stage: round(info["speed"].get(stage, 0.0), 2) for stage in ("preprocess_ms", "infer_ms", "postprocess_ms")
+        }
+        timings["merge_ms"] = round(info["merge_ms"], 2)
+        return self._tiled_store(key, digest, {
+            "detections": detections,
+            "count": len(detections),
+            "image_size": [int(image.shape[1]), int(image.shape[0])],
+            "model": model_registry.resolve(model),
+            "tiles": {"count": info["tiles"], "tile_size": info["tile_size"], "overlap": info["overlap"],
+                      "full_frame": info["full_frame"], "raw_detections": info["raw_detections"]},
+            "timings": timings,
+        })
+
+    def _tiled_lookup(self, image: np.ndarray, conf: float, model: Optional[str], cache: bool = True):
+        """Cache key, exact content hash and cached merged result (or None) for a tiled image."""
+        key = ("tiled", conf, self.resolve_model(model) or self.model_path, image.shape[:2])
+        digest = content_hash(image) if cache and self.result_cache.enabled else None
+        cached = self.result_cache.get(key, digest, max_distance=0)
+        if cached is None:
+            return key, digest, None
+        self.requests += 1
+        return key, digest, dict(cached, cached=True, timings={})
+
+    def _tiled_store(self, key, digest: Optional[int], result: Dict[str, Any]) -> Dict[str, Any]:
+        self.result_cache.put(key, digest, result)
+        return dict(result, cached=False)
+
+    @staticmethod
+    def _timed_decode(data: bytes) -> Tuple[np.ndarray, float]:
+        start = time.perf_counter()
+        image = decode_image(data)
+        return image, (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _with_stage_timings(result: Dict[str, Any], decode_ms: float, start: float) -> Dict[str, Any]:
+        result = dict(result)
+        result["timings"] = {
+            "decode_ms": round(decode_ms, 2),
+            **result["timings"],
+            "total_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+        return result
+
+    def detect_products(
+        self, data: bytes, confidence_threshold: float = CONFIDENCE_THRESHOLD, tiled: bool = False,
+        model: Optional[str] = None, cache: bool = True,
+    ) -> Dict[str, Any]:
+        """Decode uploaded bytes and detect objects; timings cover every stage."""
+        start = time.perf_counter()
+        image, decode_ms = self._timed_decode(data)
+        detect = self.detect_image_tiled if tiled else self.detect_image
+        return self._with_stage_timings(detect(image, confidence_threshold, model, cache), decode_ms, start)
+
+    async def detect_products_async(
+        self, data: bytes, confidence_threshold: float = CONFIDENCE_THRESHOLD, tiled: bool = False,
+        model: Optional[str] = None, cache: bool = True,
+    ) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        image, decode_ms = await loop.run_in_executor(self._executor, self._timed_decode, data)
+        await self._ensure_pool_async()
+        if tiled:
+            # Waits on the batcher for every tile and merges in pure Python; the default
+            # executor keeps that off the event loop without tying up the decode threads
+            result = await loop.run_in_executor(
+                None, self.detect_image_tiled, image, confidence_threshold, model, cache
+            )
+        else:
+            result = await asyncio.wrap_future(self._submit_many([(image, confidence_threshold, model)], cache=cache)[0])
+        return self._with_stage_timings(result, decode_ms, start)
+
+    async def detect_batch_async(
+        self,
+        items: List[Tuple[str, bytes]],
+        confidence_threshold: float = CONFIDENCE_THRESHOLD,
+        model: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Detect objects in many named images; one result (or error) per image, in order."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        decoded = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self._timed_decode, data) for _, data in items),
+            return_exceptions=True,
+        )
+        ok = [i for i, d in enumerate(decoded) if not isinstance(d, BaseException)]
+        await self._ensure_pool_async()
+        futures = self._submit_many([(decoded[i][0], confidence_threshold, model) for i in ok])
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+        by_index = dict(zip(ok, results))
+
+        out = []
+        for i, (name, _) in enumerate(items):
+            if isinstance(decoded[i], BaseException):
+                out.append({"filename": name, "error": str(decoded[i])})
+            elif isinstance(by_index[i], BaseException):
+                out.append({"filename": name, "error": str(by_index[i])})
+            else:
+                out.append({"filename": name, **self._with_stage_timings(by_index[i], decoded[i][1], start)})
+        return out
+
     def get_model_info(self):
-        """TODO: Return model information and capabilities"""
         return {
-            "model_name": "YOLOv8 (not yet implemented)",
+            "model_name": self.model_path,
+            "backend": VISION_BACKEND,
             "is_initialized": self.is_initialized,
-            "capabilities": ["object_detection", "product_recognition"],
-            "status": "stub"
+            "available": vision._YOLO_AVAILABLE,
+            "load_ms": self.load_ms,
+            "warmup_ms": self.warmup_ms,
+            "requests": self.requests,
+            "batching": self._batcher.get_stats(),
+            "workers": self.pool.get_stats() if self.pool is not None else None,
+            "result_cache": self.result_cache.get_stats(),
+            "error": self.error,
+            "capabilities": ["object_detection"],
+            "status": "ready" if self.is_initialized else ("error" if self.error else "loading"),
         }
 
 # Global vision service instance
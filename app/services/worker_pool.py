@@ -0,0 +1,363 @@
+"""Process pool of detection workers fed through shared memory.
+
+Each worker is a separate process (its own GIL) holding a loaded model with
+a fixed number of inference threads, so a 4-core Pi can run several
+detections at once while the API process only decodes and dispatches.
+
+Frames are not pickled: every worker owns a shared-memory slot that the
+parent copies the image into, and only (shape, dtype, conf) goes over the
+pipe. A feeder thread per worker takes jobs from the shared queue, watches
+the job's deadline, pings the worker while idle, and restarts it if it
+dies, hangs or stops answering.
+
+Top-level imports are kept light on purpose: worker processes are started
+with "spawn" and set their thread-count environment before the model (and
+app.config) is imported.
+"""
+import importlib
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def _load_callable(spec: str):
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _pin_threads(threads: int) -> None:
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VISION_ONNX_THREADS"):
+        os.environ[var] = str(threads)
+
+
+def _worker_main(conn, loader: str, threads: int, cpus: Optional[List[int]]) -> None:
+    """Worker process: load the model once, then serve detect/ping requests over ``conn``."""
+    _pin_threads(threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+    try:
+        model = _load_callable(loader)()
+        if model is None:
+            raise RuntimeError(f"{loader} returned no model")
+        torch = __import__("sys").modules.get("torch")
+        if torch is not None:
+            torch.set_num_threads(threads)
+        from app import vision
+        # Warm-up so the first real frame doesn't pay for lazy initialisation
+        vision.infer(np.zeros((640, 640, 3), dtype=np.uint8), conf=0.99, model=model)
+    except Exception as e:
+        conn.send(("error", repr(e)))
+        return
+    conn.send(("ready", os.getpid()))
+
+    slot: Optional[shared_memory.SharedMemory] = None
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind = message[0]
+        if kind == "stop":
+            break
+        if kind == "ping":
+            conn.send(("pong", message[1]))
+            continue
+        _, job_id, slot_name, shape, dtype, conf, name = message
+        try:
+            # Other detectors come from this worker's own model registry
+            job_model = model if name is None else vision.load_model(name)
+            if job_model is None:
+                raise RuntimeError(f"model '{name}' could not be loaded")
+            if slot is None or slot.name != slot_name:
+                if slot is not None:
+                    slot.close()
+                slot = shared_memory.SharedMemory(name=slot_name)
+            image = np.ndarray(shape, dtype=dtype, buffer=slot.buf)
+            detections, speed = vision.infer(image, conf=conf, model=job_model)
+            del image
+            conn.send(("result", job_id, detections, speed))
+        except Exception as e:
+            conn.send(("failed", job_id, repr(e)))
+    if slot is not None:
+        slot.close()
+
+
+class _Worker:
+    """Parent-side handle: process, pipe, shared-memory slot and counters."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.slot: Optional[shared_memory.SharedMemory] = None
+        self.pid: Optional[int] = None
+        self.busy = False
+        self.jobs = 0
+        self.failures = 0
+        self.busy_ms = 0.0
+        self.last_seen = 0.0
+        self.started_at = 0.0
+
+    def ensure_slot(self, nbytes: int) -> shared_memory.SharedMemory:
+        if self.slot is None or self.slot.size < nbytes:
+            self.release_slot()
+            self.slot = shared_memory.SharedMemory(create=True, size=nbytes)
+        return self.slot
+
+    def release_slot(self) -> None:
+        if self.slot is not None:
+            self.slot.close()
+            try:
+                self.slot.unlink()
+            except FileNotFoundError:
+                pass
+            self.slot = None
+
+
+class DetectionWorkerPool:
+    """Run ``vision.infer`` across ``workers`` processes; ``submit`` returns a Future."""
+
+    def __init__(
+        self,
+        workers: int,
+        threads_per_worker: int = 1,
+        loader: str = "app.vision:load_model",
+        job_timeout_s: float = 30.0,
+        health_interval_s: float = 5.0,
+        start_timeout_s: float = 120.0,
+        pin_cpus: bool = False,
+        start_method: str = "spawn",
+    ):
+        self.size = max(1, workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.loader = loader
+        self.job_timeout_s = job_timeout_s
+        self.health_interval_s = health_interval_s
+        self.start_timeout_s = start_timeout_s
+        self.pin_cpus = pin_cpus
+        self._ctx = mp.get_context(start_method)
+        self._jobs: "queue.Queue[Optional[Tuple[np.ndarray, float, Optional[str], Future]]]" = queue.Queue()
+        self._workers = [_Worker(i) for i in range(self.size)]
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.max_queue_depth = 0
+        self.error: Optional[str] = None
+
+    # Lifecycle
+
+    def _cpus_for(self, index: int) -> Optional[List[int]]:
+        if not self.pin_cpus or not hasattr(os, "sched_getaffinity"):
+            return None
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (index * self.threads_per_worker) % len(cpus)
+        return [cpus[(start + i) % len(cpus)] for i in range(self.threads_per_worker)]
+
+    def _spawn(self, worker: _Worker) -> None:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, self.loader, self.threads_per_worker, self._cpus_for(worker.index)),
+            name=f"vision-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        if not parent.poll(self.start_timeout_s):
+            process.kill()
+            raise RuntimeError(f"vision worker {worker.index} did not start within {self.start_timeout_s}s")
+        status = parent.recv()
+        if status[0] != "ready":
+            process.join(1)
+            raise RuntimeError(f"vision worker {worker.index} failed to load the model: {status[1]}")
+        worker.process, worker.conn, worker.pid = process, parent, status[1]
+        worker.started_at = worker.last_seen = time.monotonic()
+
+    def _kill(self, worker: _Worker) -> None:
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join(5)
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.process = worker.conn = None
+
+    def _restart(self, worker: _Worker, reason: str) -> None:
+        print(f"Restarting vision worker {worker.index}: {reason}")
+        self._kill(worker)
+        with self._lock:
+            self.restarts += 1
+        while not self._stopping:
+            try:
+                self._spawn(worker)
+                return
+            except Exception as e:
+                self.error = str(e)
+                time.sleep(1.0)
+
+    def start(self) -> None:
+        """Start every worker and wait until its model is loaded."""
+        for worker in self._workers:
+            self._spawn(worker)
+        for worker in self._workers:
+            thread = threading.Thread(target=self._feed, args=(worker,), name=f"vision-feeder-{worker.index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.error = None
+
+    def stop(self) -> None:
+        self._stopping = True
+        for _ in self._workers:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(5)
+        for worker in self._workers:
+            if worker.conn is not None:
+                try:
+                    worker.conn.send(("stop",))
+                except (OSError, ValueError):
+                    pass
+            self._kill(worker)
+            worker.release_slot()
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and not job[-1].done():
+                job[-1].set_exception(RuntimeError("Vision worker pool stopped"))
+
+    # Jobs
+
+    def submit(self, image: np.ndarray, conf: float, model: Optional[str] = None) -> Future:
+        """Queue ``image``; the Future resolves to ``(detections, speed)`` from ``vision.infer``."""
+        future: Future = Future()
+        if self._stopping:
+            future.set_exception(RuntimeError("Vision worker pool stopped"))
+            return future
+        self._jobs.put((np.ascontiguousarray(image), conf, model, future))
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._jobs.qsize())
+        return future
+
+    def _wait(self, worker: _Worker, deadline: float):
+        """Next message from the worker, or None if it missed ``deadline``; EOFError if it died."""
+        while True:
+            if worker.process is None or not worker.process.is_alive():
+                raise EOFError(f"vision worker {worker.index} exited")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                if worker.conn.poll(min(remaining, 0.5)):
+                    return worker.conn.recv()
+            except OSError as e:
+                raise EOFError(str(e))
+
+    def _ping(self, worker: _Worker) -> bool:
+        token = time.monotonic()
+        try:
+            worker.conn.send(("ping", token))
+            reply = self._wait(worker, time.monotonic() + self.health_interval_s)
+        except (EOFError, OSError, ValueError):
+            return False
+        if reply is not None and reply[0] == "pong" and reply[1] == token:
+            worker.last_seen = time.monotonic()
+            return True
+        return False
+
+    def _feed(self, worker: _Worker) -> None:
+        job_id = 0
+        while not self._stopping:
+            try:
+                job = self._jobs.get(timeout=self.health_interval_s)
+            except queue.Empty:
+                # Idle health check
+                if not self._stopping and not self._ping(worker):
+                    self._restart(worker, "failed health check")
+                continue
+            if job is None:
+                break
+            image, conf, model, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            job_id += 1
+            worker.busy = True
+            start = time.monotonic()
+            reason = "job timed out"
+            try:
+                slot = worker.ensure_slot(image.nbytes)
+                np.ndarray(image.shape, dtype=image.dtype, buffer=slot.buf)[...] = image
+                worker.conn.send(("detect", job_id, slot.name, image.shape, image.dtype.str, conf, model))
+                reply = self._wait(worker, start + self.job_timeout_s)
+            except (EOFError, OSError, ValueError):
+                reply, reason = None, "worker crashed"
+            worker.busy = False
+            worker.busy_ms += (time.monotonic() - start) * 1000
+            if reply is not None and reply[0] == "result" and reply[1] == job_id:
+                worker.jobs += 1
+                worker.last_seen = time.monotonic()
+                with self._lock:
+                    self.completed += 1
+                future.set_result((reply[2], reply[3]))
+                continue
+            worker.failures += 1
+            with self._lock:
+                self.failed += 1
+            if reply is not None and reply[0] == "failed":
+                worker.last_seen = time.monotonic()
+                future.set_exception(RuntimeError(f"Detection failed in worker {worker.index}: {reply[2]}"))
+                continue
+            future.set_exception(RuntimeError(f"Vision worker {worker.index} {reason}"))
+            self._restart(worker, reason)
+
+    # Metrics
+
+    def health(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "index": w.index,
+                "pid": w.pid,
+                "alive": w.process is not None and w.process.is_alive(),
+                "busy": w.busy,
+                "jobs": w.jobs,
+                "failures": w.failures,
+                "avg_ms": round(w.busy_ms / w.jobs, 2) if w.jobs else None,
+                "last_seen_s": round(now - w.last_seen, 1) if w.last_seen else None,
+                "uptime_s": round(now - w.started_at, 1) if w.started_at else None,
+            }
+            for w in self._workers
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        workers = self.health()
+        with self._lock:
+            return {
+                "workers": self.size,
+                "threads_per_worker": self.threads_per_worker,
+                "alive": sum(1 for w in workers if w["alive"]),
+                "busy": sum(1 for w in workers if w["busy"]),
+                "queue_depth": self._jobs.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "restarts": self.restarts,
+                "error": self.error,
+                "per_worker": workers,
+            }
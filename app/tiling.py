@@ -0,0 +1,95 @@
+"""Slicing wide shelf images into overlapping tiles and merging tile detections.
+
+YOLO letterboxes every input to ~640 px, so on a 4000 px panorama a spice
+packet shrinks to a few pixels. Running the model on native-resolution
+tiles keeps small items detectable; ``merge_tile_detections`` then maps the
+boxes back to the full image and removes duplicates from the overlaps.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .detectors import batched_nms
+
+
+def _starts(length: int, tile: int, stride: int) -> np.ndarray:
+    if length <= tile:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, length - tile, stride, dtype=np.int64)
+    # Last tile is flush with the edge instead of running past it
+    return np.append(starts, length - tile)
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: float) -> np.ndarray:
+    """(K, 4) xyxy tile rectangles covering the image, overlapping by ``overlap`` of a tile."""
+    stride = max(1, int(round(tile_size * (1.0 - overlap))))
+    xs, ys = _starts(width, tile_size, stride), _starts(height, tile_size, stride)
+    gx, gy = np.meshgrid(xs, ys)
+    x0, y0 = gx.ravel(), gy.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def crop_tiles(image: np.ndarray, tiles: np.ndarray) -> List[np.ndarray]:
+    """Tile views into ``image`` (no pixel copies)."""
+    return [image[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+
+
+def merge_tile_detections(
+    per_tile: Sequence[List[Dict[str, Any]]],
+    tiles: np.ndarray,
+    iou: float = 0.5,
+    method: str = "nms",
+    metric: str = "ios",
+    extra: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """Shift tile detections into image coordinates and drop cross-tile duplicates.
+
+    ``tiles`` holds each tile's xyxy rectangle in the image. ``extra`` are
+    detections already in image coordinates (e.g. from a downscaled
+    full-frame pass). ``method`` is ``"nms"`` (keep the best box of each
+    overlapping group) or ``"fusion"`` (replace it by the confidence-weighted
+    mean of the group). Overlap is intersection over the smaller box by
+    default, and boxes touching a tile edge inside the image rank below
+    complete ones, so an item cut in half by one tile is reported with its
+    full extent from the neighbouring tile.
+    """
+    rows = [d for dets in per_tile for d in dets] + list(extra or [])
+    if not rows:
+        return []
+    tiles = np.asarray(tiles, dtype=np.float32).reshape(-1, 4)
+    counts = np.array([len(dets) for dets in per_tile])
+    n_extra = len(extra or [])
+    # Tile rectangle per detection; full-frame detections get the whole image
+    image_rect = np.array([0, 0, tiles[:, 2].max(), tiles[:, 3].max()], dtype=np.float32)
+    rects = np.concatenate([np.repeat(tiles, counts, axis=0), np.tile(image_rect, (n_extra, 1))])
+    shift = np.concatenate([rects[:len(rects) - n_extra, :2], np.zeros((n_extra, 2), dtype=np.float32)])
+    boxes = np.array([d["bbox_xyxy"] for d in rows], dtype=np.float32).reshape(-1, 4) + np.tile(shift, 2)
+    scores = np.array([d["confidence"] for d in rows], dtype=np.float32)
+    labels, classes = np.unique(np.array([d["label"] for d in rows], dtype=object), return_inverse=True)
+
+    inner = rects != image_rect  # tile edges that are not image edges
+    touches = np.abs(boxes - rects) <= 1.0
+    clipped = (inner & touches).any(axis=1)
+
+    keep = batched_nms(boxes, scores - clipped.astype(np.float32), classes, iou, metric)
+    if method == "fusion":
+        kb = boxes[keep]
+        w = np.clip(np.minimum(kb[:, None, 2], boxes[None, :, 2]) - np.maximum(kb[:, None, 0], boxes[None, :, 0]), 0, None)
+        h = np.clip(np.minimum(kb[:, None, 3], boxes[None, :, 3]) - np.maximum(kb[:, None, 1], boxes[None, :, 1]), 0, None)
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        if metric == "ios":
+            overlap = w * h / np.maximum(np.minimum(areas[keep][:, None], areas[None, :]), 1e-9)
+        else:
+            overlap = w * h / np.maximum(areas[keep][:, None] + areas[None, :] - w * h, 1e-9)
+        member = (overlap > iou) & (classes[keep][:, None] == classes[None, :])
+        member[np.arange(len(keep)), keep] = True  # a box always belongs to its own group
+        # Edge-clipped boxes only count when their group has nothing better
+        weights = np.where(member, (scores * np.where(clipped, 1e-3, 1.0))[None, :], 0.0)
+        fused = weights @ boxes / weights.sum(axis=1, keepdims=True)
+    else:
+        fused = boxes[keep]
+
+    return [
+        {"label": str(labels[classes[i]]), "confidence": float(scores[i]), "bbox_xyxy": [round(float(v), 2) for v in box]}
+        for i, box in zip(keep, fused)
+    ]
@@ -1,29 +1,169 @@
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import os
+import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .config import (
+    VISION_BACKEND, VISION_TILE_SIZE, VISION_TILE_OVERLAP, VISION_TILE_BATCH,
+    VISION_TILE_WORKERS, VISION_TILE_FULL_FRAME, VISION_TILE_MERGE, VISION_TILE_MERGE_IOU,
+)
+from .detectors import backend_available
+from .model_registry import model_registry
+from .tiling import tile_grid, crop_tiles, merge_tile_detections
 
-# Try YOLOv8 (ultralytics); fall back to dummy detector if unavailable
-try:
-    from ultralytics import YOLO
-    _YOLO_AVAILABLE = True
-except Exception:
-    _YOLO_AVAILABLE = False
+# YOLOv8 through the configured backend (ultralytics, onnx, openvino); fall back
+# to dummy detector if unavailable. Checked without importing torch.
+_YOLO_AVAILABLE = backend_available(VISION_BACKEND)
 
-_MODEL = None
+def load_model(name: Optional[str] = None):
+    """Detector ``name`` from the model registry (default VISION_MODEL_PATH), loaded on first use.
 
-def load_model():
-    global _MODEL
-    if _YOLO_AVAILABLE and _MODEL is None:
+    Returns None if it can't be loaded; raises KeyError for an unknown name.
+    """
+    name = model_registry.resolve(name)
+    if name == model_registry.default and not _YOLO_AVAILABLE:
+        return None
+    try:
+        # Nano model by default for speed (VISION_MODEL_PATH)
+        loaded = model_registry.is_loaded(name)
+        model = model_registry.get(name)
+        if not loaded:
+            print(f"YOLOv8 model '{name}' loaded successfully")
+        return model
+    except Exception as e:
+        print(f"Error loading YOLO model '{name}': {e}")
+        return None
+
+def _boxes_array(boxes) -> np.ndarray:
+    """(N, 6) float32 rows of x0, y0, x1, y1, conf, cls in one device-to-host transfer."""
+    data = boxes.data
+    if hasattr(data, "cpu"):
+        data = data.cpu().numpy()
+    data = np.asarray(data, dtype=np.float32)
+    # Tracking results carry an id column before conf/cls
+    return data[:, [0, 1, 2, 3, -2, -1]] if data.ndim == 2 and data.shape[1] > 6 else data.reshape(-1, 6)
+
+def _label_table(names, model=None) -> np.ndarray:
+    """Class id -> name lookup array.
+
+    Cached on ``model`` (when given) so it is built once per loaded model
+    and dropped with it when the registry evicts the model.
+    """
+    cached = getattr(model, "_label_table", None)
+    if cached is not None and cached[0] is names:
+        return cached[1]
+    mapping = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+    table = np.array([str(i) for i in range(max(mapping, default=-1) + 1)], dtype=object)
+    for i, name in mapping.items():
+        table[int(i)] = name
+    if model is not None:
         try:
-            # Use the nano model for speed
-            _MODEL = YOLO('yolov8n.pt')
-            print("YOLOv8 model loaded successfully")
-        except Exception as e:
-            print(f"Error loading YOLO model: {e}")
-            return None
-    return _MODEL
+            model._label_table = (names, table)
+        except AttributeError:
+            pass
+    return table
+
+def _to_detections(results, conf: float = 0.0, model=None) -> List[Dict[str, Any]]:
+    """Model results -> detection dicts, vectorized over boxes (no per-box tensor calls)."""
+    detections = []
+    for r in results:
+        data = _boxes_array(r.boxes)
+        data = data[data[:, 4] >= conf]
+        if not len(data):
+            continue
+        ids, table = data[:, 5].astype(np.int64), _label_table(r.names, model)
+        if ids.min() < 0 or ids.max() >= len(table):
+            labels = [table[i] if 0 <= i < len(table) else str(i) for i in ids.tolist()]
+        else:
+            labels = table[ids].tolist()
+        detections.extend(
+            {"label": label, "confidence": confv, "bbox_xyxy": xyxy}
+            for label, confv, xyxy in zip(labels, data[:, 4].tolist(), data[:, :4].tolist())
+        )
+    return detections
+
+def to_columns(detections: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Columnar form of detections: one list per field instead of one dict per box."""
+    return {
+        "label": [d["label"] for d in detections],
+        "confidence": [d["confidence"] for d in detections],
+        "bbox_xyxy": [d["bbox_xyxy"] for d in detections],
+    }
+
+def _speed(result) -> Dict[str, float]:
+    return {stage: float(ms or 0.0) for stage, ms in (getattr(result, "speed", None) or {}).items()}
+
+def infer_batch(images: List[Any], conf: float = 0.25, model=None) -> List[Tuple[List[Dict[str, Any]], Dict[str, float]]]:
+    """Run the model on several images in one call; no dummy fallback.
+
+    Returns one ``(detections, speed)`` pair per image, where ``speed`` holds
+    the model's per-image stage timings in ms (``preprocess``, ``inference``,
+    ``postprocess``).
+    """
+    model = model or load_model()
+    if model is None:
+        raise RuntimeError(f"YOLO model not available (install the {VISION_BACKEND} backend and make sure VISION_MODEL_PATH can be loaded)")
+    if not images:
+        return []
+    results = model(list(images), conf=conf, verbose=False)
+    return [(_to_detections([r], conf, model), _speed(r)) for r in results]
+
+def infer(image: Any, conf: float = 0.25, model=None) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """Run the model on a path or a BGR ndarray; see ``infer_batch``."""
+    return infer_batch([image], conf=conf, model=model)[0]
+
+def infer_tiled(
+    image: Any,
+    conf: float = 0.25,
+    model=None,
+    tile_size: int = VISION_TILE_SIZE,
+    overlap: float = VISION_TILE_OVERLAP,
+    batch_size: int = VISION_TILE_BATCH,
+    workers: int = VISION_TILE_WORKERS,
+    full_frame: bool = VISION_TILE_FULL_FRAME,
+    merge: str = VISION_TILE_MERGE,
+    merge_iou: float = VISION_TILE_MERGE_IOU,
+    run_batch: Optional[Callable[[List[Any]], List[Tuple[List[Dict[str, Any]], Dict[str, float]]]]] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Detect on overlapping native-resolution tiles of a large BGR image.
+
+    Tiles go through ``run_batch`` (default ``infer_batch`` on ``model``)
+    ``batch_size`` at a time, with up to ``workers`` batches in flight (only
+    use >1 with a thread-safe backend such as onnx/openvino, or a
+    ``run_batch`` that queues to worker processes). With ``full_frame`` the
+    downscaled whole image is also run so items larger than a tile are still
+    found. Returns the merged detections in image coordinates and a summary
+    of the tiling, including the summed per-stage ``speed`` and ``merge_ms``.
+    """
+    run_batch = run_batch or (lambda images: infer_batch(images, conf=conf, model=model))
+    height, width = image.shape[:2]
+    tiles = tile_grid(width, height, tile_size, overlap)
+    if len(tiles) == 1:
+        detections, speed = run_batch([image])[0]
+        return detections, {"tiles": 1, "raw_detections": len(detections), "speed": speed, "merge_ms": 0.0}
+    crops = crop_tiles(image, tiles) + ([image] if full_frame else [])
+    chunks = [crops[i:i + batch_size] for i in range(0, len(crops), max(1, batch_size))]
+    if workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outputs = [pair for out in pool.map(run_batch, chunks) for pair in out]
+    else:
+        outputs = [pair for chunk in chunks for pair in run_batch(chunk)]
+    per_tile = [dets for dets, _ in outputs[:len(tiles)]]
+    extra = outputs[len(tiles)][0] if full_frame else None
+    start = time.perf_counter()
+    merged = merge_tile_detections(per_tile, tiles, iou=merge_iou, method=merge, extra=extra)
+    merge_ms = (time.perf_counter() - start) * 1000
+    speed: Dict[str, float] = {}
+    for _, stages in outputs:
+        for stage, ms in stages.items():
+            speed[stage] = speed.get(stage, 0.0) + ms
+    return merged, {
+        "tiles": len(tiles), "tile_size": tile_size, "overlap": overlap, "full_frame": full_frame,
+        "raw_detections": sum(len(dets) for dets, _ in outputs), "speed": speed, "merge_ms": merge_ms,
+    }
 
-def detect(image_path: str, conf: float = 0.25) -> List[Dict[str, Any]]:
+def detect(image_path: str, conf: float = 0.25, tiled: bool = False) -> List[Dict[str, Any]]:
     # Check if file exists
     if not os.path.exists(image_path):
         print(f"Warning: Image file '{image_path}' does not exist. Using dummy detection.")
@@ -36,19 +176,12 @@ def detect(image_path: str, conf: float = 0.25) -> List[Dict[str, Any]]:
                 print("YOLO model not available, using dummy detection")
                 return [{"label": "bottle", "confidence": 0.42, "bbox_xyxy": [10, 10, 100, 180]}]
             
-            results = model(image_path, conf=conf, verbose=False)
-            detections = []
-            for r in results:
-                for b in r.boxes:
-                    cls_id = int(b.cls.item())
-                    name = r.names[cls_id]
-                    confv = float(b.conf.item())
-                    xyxy = b.xyxy[0].tolist()
-                    detections.append({
-                        "label": name,
-                        "confidence": confv,
-                        "bbox_xyxy": xyxy
-                    })
+            if tiled:
+                from .services.image_pipeline import decode_image
+                detections, _ = infer_tiled(decode_image(Path(image_path).read_bytes()), conf=conf, model=model)
+            else:
+                results = model(image_path, conf=conf, verbose=False)
+                detections = _to_detections(results, conf, model)
             
             if not detections:
                 print(f"No objects detected in {image_path} with confidence >= {conf}")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Compare detector backends on latency and agreement with a reference model.
+
+    python scripts/bench_detector.py --images shelf_samples/ \\
+        --model ultralytics:yolov8n.pt --model onnx:models/yolov8n.onnx --model onnx:models/yolov8n-int8.onnx
+
+The first --model is the reference. For every model this reports load time,
+per-image latency (p50/p95, batch size 1 and --batch) and, against the
+reference detections, precision/recall of matched boxes (same label,
+IoU >= --match-iou) and their mean IoU. Without --images, random frames are
+used, which is only meaningful for latency.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_llm import percentile  # noqa: E402
+from app import vision  # noqa: E402
+from app.detectors import load_detector  # noqa: E402
+from app.services.image_pipeline import decode_image  # noqa: E402
+from app.services.planogram import overlap_matrix  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_images(directory, limit: int):
+    if directory:
+        paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)[:limit]
+        return [decode_image(p.read_bytes()) for p in paths]
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(min(limit, 8))]
+
+
+def agreement(reference, candidate, match_iou: float):
+    """Greedy same-label matching of candidate detections to reference ones."""
+    tp, ious, n_ref, n_cand = 0, [], 0, 0
+    for ref, cand in zip(reference, candidate):
+        n_ref, n_cand = n_ref + len(ref), n_cand + len(cand)
+        if not ref or not cand:
+            continue
+        iou = overlap_matrix([d["bbox_xyxy"] for d in cand], [d["bbox_xyxy"] for d in ref])
+        same = np.array([[c["label"] == r["label"] for r in ref] for c in cand])
+        iou = np.where(same, iou, 0.0)
+        used = set()
+        for ci in np.argsort(-np.array([c["confidence"] for c in cand])):
+            order = [ri for ri in np.argsort(-iou[ci]) if ri not in used and iou[ci, ri] >= match_iou]
+            if order:
+                used.add(order[0])
+                tp += 1
+                ious.append(float(iou[ci, order[0]]))
+    return {
+        "precision": round(tp / n_cand, 3) if n_cand else 1.0,
+        "recall": round(tp / n_ref, 3) if n_ref else 1.0,
+        "mean_iou": round(float(np.mean(ious)), 3) if ious else None,
+        "detections": n_cand,
+    }
+
+
+def bench(model, images, conf: float, runs: int, warmup: int, batch: int):
+    for _ in range(warmup):
+        vision.infer(images[0], conf=conf, model=model)
+    single = []
+    for i in range(runs):
+        start = time.perf_counter()
+        vision.infer(images[i % len(images)], conf=conf, model=model)
+        single.append((time.perf_counter() - start) * 1000)
+    batched = []
+    for i in range(max(1, runs // batch)):
+        chunk = [images[(i * batch + j) % len(images)] for j in range(batch)]
+        start = time.perf_counter()
+        vision.infer_batch(chunk, conf=conf, model=model)
+        batched.append((time.perf_counter() - start) * 1000 / batch)
+    detections = [d for d, _ in vision.infer_batch(images, conf=conf, model=model)]
+    return {
+        "p50_ms": round(percentile(single, 50), 2),
+        "p95_ms": round(percentile(single, 95), 2),
+        f"batch{batch}_per_image_ms": round(percentile(batched, 50), 2),
+    }, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detector backend benchmark")
+    parser.add_argument("--model", action="append", required=True, help="backend:path, e.g. onnx:models/yolov8n.onnx")
+    parser.add_argument("--images", default=None, help="Directory of test images")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum images")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--match-iou", type=float, default=0.5)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.limit)
+    if not args.images:
+        print("No --images given: using random frames (latency only, agreement is meaningless)")
+    results, reference = [], None
+    for spec in args.model:
+        backend, _, path = spec.partition(":")
+        start = time.perf_counter()
+        model = load_detector(backend, path)
+        load_ms = round((time.perf_counter() - start) * 1000, 1)
+        latency, detections = bench(model, images, args.conf, args.runs, args.warmup, args.batch)
+        if reference is None:
+            reference = detections
+        row = {"model": spec, "load_ms": load_ms, **latency, **agreement(reference, detections, args.match_iou)}
+        results.append(row)
+        print(json.dumps(row))
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Benchmark the /llm/ask, /llm/query and /llm/voice routes at fixed concurrency levels.
+
+Against a running API:
+    python scripts/bench_llm.py --api-url http://localhost:8000 --concurrency 1,4,8 --requests 40
+
+Self-contained (starts scripts/fake_ollama.py and a uvicorn API pointed at it):
+    python scripts/bench_llm.py --spawn --tokens-per-sec 30 --failure-rate 0.02
+
+Reports throughput and p50/p95/p99 latency per endpoint and concurrency level.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+QUESTIONS = [
+    "Which drink has less sugar?",
+    "What snacks do you recommend for a party?",
+    "Where is the milk?",
+    "How much is bread?",
+]
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    if lo == hi:
+        return ordered[int(k)]
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def make_image_bytes() -> bytes:
+    try:
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new("RGB", (320, 240), (200, 180, 40)).save(buf, format="JPEG")
+        return buf.getvalue()
+    except ImportError:
+        return b"\xff\xd8\xff\xd9"
+
+
+def make_wav_bytes(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buf.getvalue()
+
+
+def build_request(endpoint: str, i: int, image: bytes, audio: bytes):
+    question = QUESTIONS[i % len(QUESTIONS)]
+    if endpoint == "ask":
+        return "/llm/ask", {"data": {"question": question}}
+    if endpoint == "query":
+        return "/llm/query", {
+            "data": {"user_query": "What products are on this shelf?"},
+            "files": {"image": ("shelf.jpg", image, "image/jpeg")},
+        }
+    if endpoint == "voice":
+        return "/llm/voice", {"files": {"audio": ("query.wav", audio, "audio/wav")}}
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def run_level(api_url: str, endpoint: str, concurrency: int, total: int, timeout: float, image: bytes, audio: bytes):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def one(i: int):
+        path, kwargs = build_request(endpoint, i, image, audio)
+        t0 = time.perf_counter()
+        try:
+            ok = session.post(f"{api_url}{path}", timeout=timeout, **kwargs).ok
+        except requests.RequestException:
+            ok = False
+        return ok, (time.perf_counter() - t0) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [ms for ok, ms in results if ok]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(1 for ok, _ in results if not ok),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def spawn_stack(args):
+    """Start a fake Ollama in-process and the API as a uvicorn subprocess."""
+    from fake_ollama import FakeOllamaConfig, start_in_thread
+
+    config = FakeOllamaConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        response_tokens=args.response_tokens,
+        failure_rate=args.failure_rate,
+    )
+    fake, ollama_url = start_in_thread(config)
+    port = free_port()
+    env = dict(os.environ, OLLAMA_BASE_URL=ollama_url)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=str(Path(__file__).resolve().parent.parent),
+        env=env,
+    )
+    api_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(f"{api_url}/health")
+    except Exception:
+        api.terminate()
+        raise
+    return fake, api, api_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM pipeline benchmark")
+    parser.add_argument("--api-url", default="http://localhost:8000")
+    parser.add_argument("--endpoints", default="ask,query,voice", help="Comma-separated: ask, query, voice")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint and level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write results to this JSON file")
+    spawn = parser.add_argument_group("self-contained mode")
+    spawn.add_argument("--spawn", action="store_true", help="Start a fake Ollama and the API locally")
+    spawn.add_argument("--latency-ms", type=float, default=50.0)
+    spawn.add_argument("--tokens-per-sec", type=float, default=50.0)
+    spawn.add_argument("--response-tokens", type=int, default=20)
+    spawn.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = api = None
+    api_url = args.api_url.rstrip("/")
+    if args.spawn:
+        fake, api, api_url = spawn_stack(args)
+
+    image, audio = make_image_bytes(), make_wav_bytes()
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    results = []
+    try:
+        print(f"{'endpoint':<8} {'conc':>4} {'reqs':>5} {'errs':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for endpoint in endpoints:
+            for level in levels:
+                r = run_level(api_url, endpoint, level, args.requests, args.timeout, image, audio)
+                results.append(r)
+                print(f"{r['endpoint']:<8} {r['concurrency']:>4} {r['requests']:>5} {r['errors']:>5} "
+                      f"{r['throughput_rps']:>8} {r['p50_ms']:>7}ms {r['p95_ms']:>7}ms {r['p99_ms']:>7}ms")
+    finally:
+        if api is not None:
+            api.terminate()
+            api.wait(timeout=10)
+        if fake is not None:
+            fake.shutdown()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Export YOLOv8 weights for the PyTorch-free detector backends (app/detectors.py).
+
+    python scripts/export_detector.py --weights yolov8n.pt --out models --calib-dir shelf_samples/
+
+Writes, for each requested format:
+    onnx:      models/yolov8n.onnx (fp32) and models/yolov8n-int8.onnx
+    openvino:  models/yolov8n_openvino_model/ (fp32) and models/yolov8n-int8_openvino_model/
+
+int8 models are statically quantized with images from --calib-dir (a few
+dozen representative shelf photos are enough). Without calibration images
+ONNX falls back to dynamic (weight-only) quantization and OpenVINO int8 is
+skipped. Needs ultralytics for the export step, plus onnxruntime/onnx and
+openvino/nncf for quantization; the app itself then only needs the runtime.
+
+Run with VISION_BACKEND=onnx VISION_MODEL_PATH=models/yolov8n-int8.onnx.
+"""
+import argparse
+import shutil
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.detectors import ExportedYOLODetector  # noqa: E402
+from app.services.image_pipeline import decode_image  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def calibration_batches(calib_dir, imgsz: int, limit: int):
+    """Preprocessed (1, 3, imgsz, imgsz) tensors, exactly as the app feeds the model."""
+    if not calib_dir:
+        return []
+    paths = sorted(p for p in Path(calib_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)[:limit]
+    prep = ExportedYOLODetector(names={}, imgsz=imgsz)
+    return [prep.preprocess([decode_image(p.read_bytes())])[0] for p in paths]
+
+
+def export(weights: str, fmt: str, imgsz: int, out_dir: Path) -> Path:
+    from ultralytics import YOLO
+    exported = Path(YOLO(weights).export(format=fmt, imgsz=imgsz, dynamic=(fmt == "onnx"), simplify=True))
+    target = out_dir / exported.name
+    if exported.resolve() != target.resolve():
+        if target.exists():
+            shutil.rmtree(target) if target.is_dir() else target.unlink()
+        shutil.move(str(exported), str(target))
+    return target
+
+
+def quantize_onnx(fp32: Path, batches, out: Path) -> Path:
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static,
+    )
+
+    if batches:
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self._it = iter(batches)
+
+            def get_next(self):
+                batch = next(self._it, None)
+                return None if batch is None else {"images": batch}
+
+        quantize_static(
+            str(fp32), str(out), Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        )
+    else:
+        print("No calibration images: using dynamic (weight-only) int8 quantization")
+        quantize_dynamic(str(fp32), str(out), weight_type=QuantType.QUInt8)
+
+    # Keep the class names and other ultralytics metadata on the quantized model
+    source, quantized = onnx.load(str(fp32)), onnx.load(str(out))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, str(out))
+    return out
+
+
+def quantize_openvino(fp32_dir: Path, batches, out_dir: Path) -> Path:
+    import nncf
+    import openvino as ov
+
+    core = ov.Core()
+    model = core.read_model(str(next(fp32_dir.glob("*.xml"))))
+    quantized = nncf.quantize(model, nncf.Dataset(batches), preset=nncf.QuantizationPreset.MIXED)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ov.save_model(quantized, str(out_dir / f"{out_dir.name.replace('_openvino_model', '')}.xml"))
+    if (fp32_dir / "metadata.yaml").exists():
+        shutil.copy(fp32_dir / "metadata.yaml", out_dir / "metadata.yaml")
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and int8-quantize YOLOv8 for ONNX Runtime / OpenVINO")
+    parser.add_argument("--weights", default="yolov8n.pt")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--out", default="models", help="Output directory")
+    parser.add_argument("--formats", default="onnx", help="Comma-separated: onnx, openvino")
+    parser.add_argument("--calib-dir", default=None, help="Directory of representative images for int8 calibration")
+    parser.add_argument("--calib-images", type=int, default=64, help="Maximum calibration images")
+    parser.add_argument("--no-int8", action="store_true", help="Only export fp32")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(args.weights).stem
+    batches = [] if args.no_int8 else calibration_batches(args.calib_dir, args.imgsz, args.calib_images)
+
+    for fmt in [f.strip() for f in args.formats.split(",") if f.strip()]:
+        if fmt not in ("onnx", "openvino"):
+            parser.error(f"unknown format '{fmt}'")
+        fp32 = export(args.weights, fmt, args.imgsz, out_dir)
+        print(f"{fmt} fp32: {fp32}")
+        if args.no_int8:
+            continue
+        if fmt == "onnx":
+            print(f"onnx int8: {quantize_onnx(fp32, batches, out_dir / f'{stem}-int8.onnx')}")
+        elif batches:
+            print(f"openvino int8: {quantize_openvino(fp32, batches, out_dir / f'{stem}-int8_openvino_model')}")
+        else:
+            print("openvino int8 skipped: pass --calib-dir with calibration images")
+
+
+if __name__ == "__main__":
+    main()
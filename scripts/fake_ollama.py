@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Stand-in Ollama server for load testing without model weights.
+
+Implements /api/tags, /api/ps, /api/generate and /api/chat (streaming and
+non-streaming) with configurable latency, generation speed and failure
+injection. Responses carry the same timing fields real Ollama returns.
+
+Usage:
+    python scripts/fake_ollama.py --port 11434 --tokens-per-sec 20 --failure-rate 0.05
+    OLLAMA_BASE_URL=http://localhost:11434 python run.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ["phi3:mini", "moondream"]
+
+
+class FakeOllamaConfig:
+    def __init__(
+        self,
+        models=None,
+        latency_ms: float = 50.0,
+        prompt_ms_per_char: float = 0.05,
+        load_ms: float = 500.0,
+        tokens_per_sec: float = 50.0,
+        response_tokens: int = 20,
+        failure_rate: float = 0.0,
+        seed=None,
+    ):
+        self.models = list(models or DEFAULT_MODELS)
+        self.latency_ms = latency_ms  # fixed overhead before the first token
+        self.prompt_ms_per_char = prompt_ms_per_char  # prompt evaluation cost for uncached prefix
+        self.load_ms = load_ms  # cold load the first time a model is used
+        self.tokens_per_sec = tokens_per_sec
+        self.response_tokens = response_tokens
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+
+class FakeOllamaState:
+    """Loaded models and the last prompt per model (for simulated prefix caching)."""
+
+    def __init__(self, config: FakeOllamaConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.loaded = {}
+        self.last_prompt = {}
+        self.requests = 0
+
+    def admit(self, model: str, prompt: str, keep_alive):
+        """Return (load_ns, prompt_eval_ns, prompt_eval_count) and record the model as loaded."""
+        with self.lock:
+            self.requests += 1
+            load_ns = 0 if model in self.loaded else int(self.config.load_ms * 1e6)
+            expires = datetime.now(timezone.utc) + timedelta(minutes=5)
+            if isinstance(keep_alive, int) and keep_alive < 0:
+                expires = datetime.now(timezone.utc) + timedelta(days=3650)
+            self.loaded[model] = expires
+            previous = self.last_prompt.get(model, "")
+            self.last_prompt[model] = prompt
+        shared = 0
+        for a, b in zip(previous, prompt):
+            if a != b:
+                break
+            shared += 1
+        uncached = len(prompt) - shared
+        prompt_eval_ns = int(uncached * self.config.prompt_ms_per_char * 1e6)
+        return load_ns, prompt_eval_ns, max(1, uncached // 4)
+
+
+def _prompt_text(body) -> str:
+    if "messages" in body:
+        return "\n".join(f"{m.get('role')}:{m.get('content', '')}" for m in body["messages"])
+    return body.get("prompt", "")
+
+
+def make_handler(state: FakeOllamaState):
+    config = state.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, data) -> None:
+            raw = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json(200, {"models": [{"name": m, "model": m, "size": 0} for m in config.models]})
+            elif self.path == "/api/ps":
+                with state.lock:
+                    loaded = dict(state.loaded)
+                self._send_json(200, {"models": [
+                    {"name": m, "model": m, "size": 0, "size_vram": 0, "expires_at": exp.isoformat()}
+                    for m, exp in loaded.items()
+                ]})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path not in ("/api/generate", "/api/chat"):
+                self._send_json(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            model = body.get("model", "")
+            if model not in config.models:
+                self._send_json(404, {"error": f"model '{model}' not found, try pulling it first"})
+                return
+            if config.random.random() < config.failure_rate:
+                self._send_json(500, {"error": "injected failure"})
+                return
+
+            prompt = _prompt_text(body)
+            load_ns, prompt_eval_ns, prompt_count = state.admit(model, prompt, body.get("keep_alive"))
+            time.sleep((load_ns + prompt_eval_ns) / 1e9 + config.latency_ms / 1000)
+
+            is_chat = self.path == "/api/chat"
+            # An empty generate prompt only loads the model, as in real Ollama
+            n_tokens = 0 if (not is_chat and not prompt) else config.response_tokens
+            num_predict = (body.get("options") or {}).get("num_predict")
+            if num_predict is not None and num_predict >= 0:
+                n_tokens = min(n_tokens, num_predict)
+            tokens = [f"tok{i} " if (i + 1) % 8 else f"tok{i}. " for i in range(n_tokens)]
+            per_token = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+
+            def chunk(text: str, done: bool):
+                data = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+                if is_chat:
+                    data["message"] = {"role": "assistant", "content": text}
+                else:
+                    data["response"] = text
+                if done:
+                    eval_ns = int(n_tokens * per_token * 1e9)
+                    data.update(
+                        done_reason="stop",
+                        total_duration=load_ns + prompt_eval_ns + eval_ns + int(config.latency_ms * 1e6),
+                        load_duration=load_ns,
+                        prompt_eval_count=prompt_count,
+                        prompt_eval_duration=prompt_eval_ns,
+                        eval_count=n_tokens,
+                        eval_duration=eval_ns,
+                    )
+                return data
+
+            if body.get("stream", True):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for tok in tokens:
+                        time.sleep(per_token)
+                        self._write_chunk(chunk(tok, False))
+                    self._write_chunk(chunk("", True))
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client closed the stream early; real Ollama aborts generation here
+                    self.close_connection = True
+            else:
+                time.sleep(per_token * n_tokens)
+                self._send_json(200, chunk("".join(tokens).strip(), True))
+
+        def _write_chunk(self, data) -> None:
+            raw = json.dumps(data).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(raw):X}\r\n".encode("ascii") + raw + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def make_server(config: FakeOllamaConfig = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Create (but don't start) a fake Ollama server; port 0 picks a free port."""
+    state = FakeOllamaState(config or FakeOllamaConfig())
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def start_in_thread(config: FakeOllamaConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """Start a fake server in a daemon thread and return (server, base_url)."""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="Comma-separated model names")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Fixed latency before the first token")
+    parser.add_argument("--prompt-ms-per-char", type=float, default=0.05, help="Cost of uncached prompt characters")
+    parser.add_argument("--load-ms", type=float, default=500.0, help="Cold load time per model")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=20)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        latency_ms=args.latency_ms,
+        prompt_ms_per_char=args.prompt_ms_per_char,
+        load_ms=args.load_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        response_tokens=args.response_tokens,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    server = make_server(config, args.host, args.port)
+    print(f"Fake Ollama listening on http://{args.host}:{server.server_address[1]} (models: {', '.join(config.models)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
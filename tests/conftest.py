@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Importing the app creates the global db_service, which initialises its database;
+# keep that (and every test that doesn't set its own path) off the committed shelf_assistant.db
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="shelf_tests_"), "shelf.db"))
@@ -0,0 +1,778 @@
+import io
+import threading
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.main import app
+from app.services.image_cache import PerceptualCache
+from app.services.vision import VisionService, vision_service
+
+client = TestClient(app)
+
+
+class _FakeBoxes:
+    """numpy stand-in for ultralytics Boxes (cls/conf/xyxy/data)"""
+
+    def __init__(self, rows):
+        self.data = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.xyxy = self.data[:, :4]
+        self.conf = self.data[:, 4]
+        self.cls = self.data[:, 5]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield _FakeBoxes(self.data[i:i + 1])
+
+
+class _FakeResult:
+    names = {0: "bottle", 1: "can"}
+
+    def __init__(self, rows):
+        self.boxes = _FakeBoxes(rows)
+        self.speed = {"preprocess": 1.0, "inference": 5.0, "postprocess": 0.5}
+
+
+class FakeYOLO:
+    """Callable model returning canned detections for any image"""
+
+    def __init__(self, rows=None):
+        self.rows = rows if rows is not None else [[10, 20, 110, 220, 0.9, 0], [200, 20, 260, 120, 0.4, 1]]
+        self.calls = []
+
+    def __call__(self, source, conf=0.25, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        self.calls.append(len(images))
+        rows = [r for r in self.rows if r[4] >= conf]
+        return [_FakeResult(rows) for _ in images]
+
+
+def jpeg_bytes(size=(320, 240), color=(10, 120, 200)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def fake_detector(monkeypatch):
+    """Point the global vision service at a fake YOLO model"""
+    model = FakeYOLO()
+    from app import vision
+    load_named = vision.load_model
+    monkeypatch.setattr(vision, "load_model", lambda name=None: model if name is None else load_named(name))
+    monkeypatch.setattr(vision_service, "model", None)
+    monkeypatch.setattr(vision_service, "is_initialized", False)
+    monkeypatch.setattr(vision_service, "result_cache", PerceptualCache())
+    return model
+
+
+def test_service_warms_up_and_reports_timings(fake_detector):
+    """Loading runs a warm-up pass and detections carry per-stage timings"""
+    service = VisionService()
+    service.initialize_model()
+    assert service.is_initialized and service.warmup_ms is not None
+
+    result = service.detect_products(jpeg_bytes(), confidence_threshold=0.25)
+
+    assert result["count"] == 2
+    assert result["detections"][0] == {"label": "bottle", "confidence": pytest.approx(0.9),
+                                       "bbox_xyxy": [10.0, 20.0, 110.0, 220.0]}
+    assert result["image_size"] == [320, 240]
+    assert set(result["timings"]) == {"decode_ms", "preprocess_ms", "infer_ms", "postprocess_ms", "total_ms"}
+
+
+def test_detect_route(fake_detector):
+    """/vision/detect decodes the upload and filters by confidence"""
+    response = client.post("/vision/detect", files={"file": ("shelf.jpg", jpeg_bytes(), "image/jpeg")},
+                           data={"conf": "0.5"})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [d["label"] for d in data["detections"]] == ["bottle"]
+
+
+def test_detect_route_rejects_bad_images(fake_detector):
+    """Undecodable uploads are a client error"""
+    response = client.post("/vision/detect", files={"file": ("shelf.jpg", b"not an image", "image/jpeg")})
+    assert response.status_code == 400
+
+
+def test_batch_route_accepts_files_and_zip(fake_detector):
+    """Multipart files and zip archives are micro-batched with per-image results"""
+    import zipfile
+    files = [("files", (f"s{i}.jpg", jpeg_bytes(), "image/jpeg")) for i in range(3)]
+    files.append(("files", ("broken.jpg", b"garbage", "image/jpeg")))
+    response = client.post("/vision/detect/batch", files=files)
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [d["filename"] for d in data] == ["s0.jpg", "s1.jpg", "s2.jpg", "broken.jpg"]
+    assert all(d["count"] == 2 for d in data[:3]) and "error" in data[3]
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("b.jpg", jpeg_bytes())
+        zf.writestr("a.png", jpeg_bytes())
+        zf.writestr("notes.txt", "ignored")
+    response = client.post("/vision/detect/batch", files={"archive": ("sweep.zip", buf.getvalue(), "application/zip")})
+    assert [d["filename"] for d in response.json()["data"]] == ["a.png", "b.jpg"]
+
+
+def test_concurrent_single_calls_share_a_batch(fake_detector):
+    """Images submitted inside the batching window go through one model call"""
+    from app.services.batcher import DynamicBatcher
+    seen = []
+
+    def process(items):
+        seen.append(len(items))
+        return [i * 2 for i in items]
+
+    batcher = DynamicBatcher(process, max_batch=4, window_ms=50)
+    futures = [batcher.submit(i) for i in range(6)]
+    assert [f.result(timeout=2) for f in futures] == [0, 2, 4, 6, 8, 10]
+    assert seen == [4, 2]
+
+
+def test_failing_model_group_does_not_fail_the_whole_batch(fake_detector):
+    """Requests merged into one batch fail only with their own model group"""
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    vision_service.initialize_model()
+    good, bad = vision_service._batcher.submit_many([(image, 0.25, None, False), (image, 0.25, "missing.pt", False)])
+    assert good.result(timeout=2)["count"] == 2
+    with pytest.raises(KeyError):
+        bad.result(timeout=2)
+
+
+def shelf_bytes(seed=0, noise=0):
+    """Synthetic shelf-like image (coloured blocks), optionally with pixel noise"""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    for y in range(0, 240, 60):
+        for x in range(0, 320, 40):
+            image[y:y + 50, x:x + 30] = rng.integers(0, 255, 3)
+    if noise:
+        jitter = np.random.default_rng(99).integers(-noise, noise + 1, image.shape)
+        image = np.clip(image.astype(int) + jitter, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("algorithm", ["ahash", "dhash", "phash"])
+def test_perceptual_cache_matches_near_duplicates(algorithm):
+    """A noisy re-capture hits the cache; a different shelf or namespace does not"""
+    cache = PerceptualCache(max_entries=4, max_distance=6, algorithm=algorithm)
+    cache.put("caption", cache.hash(shelf_bytes()), "three cans")
+
+    assert cache.get("caption", cache.hash(shelf_bytes(noise=4))) == "three cans"
+    assert cache.get("caption", cache.hash(shelf_bytes(seed=5))) is None
+    assert cache.get("other-prompt", cache.hash(shelf_bytes())) is None
+    assert cache.hash(b"not an image") is None
+    stats = cache.get_stats()
+    assert stats["exact_hits"] + stats["near_hits"] == 1 and stats["misses"] == 2
+
+
+def test_repeated_frames_skip_the_detector(fake_detector):
+    """The same frame at the same threshold and resolution is answered from the result cache"""
+    first = vision_service.detect_products(jpeg_bytes(), confidence_threshold=0.25)
+    calls = len(fake_detector.calls)
+    second = vision_service.detect_products(jpeg_bytes(), confidence_threshold=0.25)
+    vision_service.detect_products(jpeg_bytes(), confidence_threshold=0.5)
+
+    assert first["cached"] is False and second["cached"] is True
+    assert second["detections"] == first["detections"]
+    assert len(fake_detector.calls) == calls + 1
+
+    # The same scene at another resolution has other box coordinates, so it is not a hit
+    larger = vision_service.detect_products(jpeg_bytes(size=(1280, 960)), confidence_threshold=0.25)
+    assert larger["cached"] is False and larger["image_size"] == [1280, 960]
+
+
+class FakeCamera:
+    """Frame source whose pixel value counts the reads"""
+
+    name = "fake"
+
+    def __init__(self):
+        self.reads = 0
+        self.closed = False
+
+    def read(self):
+        self.reads += 1
+        return np.full((48, 64, 3), self.reads % 256, dtype=np.uint8)
+
+    def close(self):
+        self.closed = True
+
+
+def test_camera_session_serves_latest_frame_and_idles_out():
+    """One open serves many captures from the ring buffer; idling releases the camera"""
+    import time
+    from app.services.camera import CameraSession
+    sources = []
+
+    def open_source():
+        sources.append(FakeCamera())
+        return sources[-1]
+
+    session = CameraSession(open_source=open_source, ring_size=3, fps=200, idle_timeout_s=0.2, warmup_s=0)
+    first, _ = session.latest()
+    time.sleep(0.05)
+    second, _ = session.latest()
+
+    assert len(sources) == 1 and len(session.recent()) == 3
+    assert second[0, 0, 0] > first[0, 0, 0]
+    time.sleep(0.5)
+    assert not session.running and sources[0].closed
+    session.latest()
+    assert len(sources) == 2 and session.get_stats()["opens"] == 2
+    session.stop()
+
+
+def test_camera_session_restarts_while_idle_thread_is_closing():
+    """A request during the idle shutdown waits for the old thread and reopens instead of timing out"""
+    import time
+    from app.services.camera import CameraSession
+    closing = threading.Event()
+    sources = []
+
+    class SlowClosingCamera(FakeCamera):
+        def close(self):
+            closing.set()
+            time.sleep(0.3)
+            super().close()
+
+    def open_source():
+        sources.append(SlowClosingCamera())
+        return sources[-1]
+
+    session = CameraSession(open_source=open_source, ring_size=2, fps=200, idle_timeout_s=0.05, warmup_s=0)
+    session.latest()
+    assert closing.wait(2)
+    start = time.monotonic()
+    frame, _ = session.latest(timeout=2)
+    assert time.monotonic() - start < 1.5 and frame is not None
+    assert len(sources) == 2 and sources[0].closed
+    session.stop()
+
+
+def test_capture_route_is_change_gated(monkeypatch):
+    """/vision/capture captions the session's latest frame, and only when it changed"""
+    from app.services.camera import camera_session
+    from app.services.change_gate import ChangeGate
+    from app.services.llm import llm_service
+    from app.routes import vision as vision_routes
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    captions = []
+    monkeypatch.setattr(camera_session, "latest", lambda: (frame, 0.0))
+    monkeypatch.setattr(vision_routes, "change_gate", ChangeGate())
+    monkeypatch.setattr(llm_service, "caption_image",
+                        lambda image, **kw: captions.append(image) or f"caption {len(captions)}")
+
+    assert client.post("/vision/capture").json()["data"] == "caption 1"
+    response = client.post("/vision/capture").json()
+    assert response["message"] == "unchanged" and response["data"] == "caption 1"
+    frame[:120] = 255
+    assert client.post("/vision/capture").json()["data"] == "caption 2"
+    assert client.post("/vision/capture", data={"force": "true"}).json()["data"] == "caption 3"
+    assert captions[0][:2] == b"\xff\xd8"  # JPEG-encoded frame
+
+
+def twelve_product_shelf(missing=()):
+    """240x320 frame with a 3x4 grid of bright products (BlobYOLO finds each), minus ``missing`` slots"""
+    image = np.full((240, 320, 3), 90, dtype=np.uint8)
+    for r in range(3):
+        for c in range(4):
+            if (r, c) not in missing:
+                image[20 + r * 75:70 + r * 75, 15 + c * 78:45 + c * 78] = 255
+    return image
+
+
+def test_gated_frames_and_planogram_checks_bypass_near_duplicate_cache(fake_detector, planogram, monkeypatch):
+    """Removing one product can leave the dHash unchanged; changed frames must still be re-detected"""
+    from app.services.camera import camera_session
+    from app.services.change_gate import ChangeGate
+    from app.services.image_pipeline import dhash, hamming
+    from app.routes import vision as vision_routes
+    full, gap = twelve_product_shelf(), twelve_product_shelf(missing=[(0, 0)])
+    assert hamming(dhash(full), dhash(gap)) <= vision_service.result_cache.max_distance
+    monkeypatch.setattr(vision_service, "model", BlobYOLO())
+    monkeypatch.setattr(vision_service, "is_initialized", True)
+    monkeypatch.setattr(vision_routes, "change_gate", ChangeGate())
+    frame = {"image": full}
+    monkeypatch.setattr(camera_session, "latest", lambda: (frame["image"], 0.0))
+
+    assert client.post("/vision/capture/detect").json()["data"]["count"] == 12
+    frame["image"] = gap
+    data = client.post("/vision/capture/detect").json()["data"]
+    assert data["gate"]["skipped"] is False and data["count"] == 11
+
+    def png(image):
+        buf = io.BytesIO()
+        Image.fromarray(image).save(buf, format="PNG")
+        return buf.getvalue()
+
+    counts = [client.post("/planogram/check", files={"file": ("shelf.png", png(image), "image/png")}).json()["data"]
+              for image in (full, gap)]
+    assert [c["unassigned"] + sum(f["found"] + len(f["misplaced"]) for f in c["facings"]) for c in counts] == [12, 11]
+
+
+def test_change_gate_tracks_regions():
+    """Only regions whose pixels moved trigger analysis; counts are reported"""
+    from app.services.change_gate import ChangeGate
+    gate = ChangeGate(regions={"top": [0, 0, 1, 0.5], "bottom": [0, 0.5, 1, 1]}, max_skip_s=60)
+    frame = np.full((240, 320, 3), 80, dtype=np.uint8)
+    runs = []
+
+    gate.run("detect", frame, lambda: runs.append(1))
+    noisy = np.clip(frame.astype(int) + np.random.default_rng(0).integers(-8, 9, frame.shape), 0, 255)
+    skipped = gate.run("detect", noisy.astype(np.uint8), lambda: runs.append(1))
+    frame[200:, :160] = 250
+    changed = gate.run("detect", frame, lambda: runs.append(1))
+
+    assert skipped["skipped"] and not changed["skipped"]
+    assert changed["changed_regions"] == ["bottom"] and changed["region_changes"]["top"] == 0.0
+    stats = gate.get_stats()
+    assert len(runs) == 2 and stats["skips"] == 1 and stats["triggers"] == 2
+    assert stats["region_triggers"] == {"top": 0, "bottom": 1}
+
+
+@pytest.fixture
+def planogram(tmp_path, monkeypatch):
+    """Temporary DB with two products and one facing each, and a fresh engine"""
+    from app.services.db import db_service
+    from app.services.planogram import PlanogramEngine
+    from app.routes import planogram as planogram_routes
+    monkeypatch.setattr(db_service, "db_path", str(tmp_path / "shelf.db"))
+    db_service.init_database()
+    cola = db_service.create_product({"name": "Cola", "stock_quantity": 12, "shelf_location": "C1"})
+    water = db_service.create_product({"name": "Water", "stock_quantity": 5, "shelf_location": "C1"})
+    engine = PlanogramEngine(min_overlap=0.5)
+    monkeypatch.setattr(planogram_routes, "planogram_engine", engine)
+    # Left half of a 320x240 frame holds two cans, right half one bottle
+    engine.add_facing({"product_id": cola, "shelf_location": "C1", "label": "can",
+                       "x0": 0, "y0": 0, "x1": 0.5, "y1": 1, "expected_count": 2})
+    engine.add_facing({"product_id": water, "shelf_location": "C1", "label": "bottle",
+                       "x0": 0.5, "y0": 0, "x1": 1, "y1": 1, "expected_count": 1})
+    return engine, cola, water
+
+
+def test_overlap_matrix_is_pairwise():
+    """IoU and intersection-over-area for every (a, b) pair"""
+    from app.services.planogram import overlap_matrix
+    a = np.array([[0, 0, 10, 10], [5, 5, 15, 15]])
+    b = np.array([[0, 0, 10, 10], [0, 0, 20, 20], [30, 30, 40, 40]])
+    iou = overlap_matrix(a, b)
+    assert iou.shape == (2, 3)
+    assert iou[0].tolist() == pytest.approx([1.0, 0.25, 0.0])
+    assert iou[1, 0] == pytest.approx(25 / 175)
+    assert overlap_matrix(a, b, "ioa")[1].tolist() == pytest.approx([0.25, 1.0, 0.0])
+
+
+def test_planogram_events_and_stock(planogram):
+    """Empty and misplaced facings emit events once per state change; stock is zeroed after consecutive empty frames"""
+    from app.services.db import db_service
+    engine, cola, water = planogram
+    frame = [320, 240]
+    can = lambda x: {"label": "can", "confidence": 0.9, "bbox_xyxy": [x, 50, x + 40, 150]}
+    bottle = {"label": "bottle", "confidence": 0.9, "bbox_xyxy": [200, 40, 250, 160]}
+
+    full = engine.check([can(10), can(80), bottle], frame)
+    assert [f["status"] for f in full["facings"]] == ["ok", "ok"] and full["events"] == []
+
+    # Cola facing emptied, and a can turned up among the water
+    report = engine.check([can(220)], frame, apply_stock=True)
+    engine.flush()
+    cola_facing, water_facing = report["facings"]
+    assert cola_facing["empty_facings"] == 2 and water_facing["misplaced"] == ["can"]
+    assert sorted(e["event_type"] for e in report["events"]) == ["misplaced", "out_of_stock", "out_of_stock"]
+    # One missed frame is not enough to zero stock, and a frame with the item resets the count
+    assert report["stock_zeroed"] == [] and db_service.get_product(cola)["stock_quantity"] == 12
+    engine.check([can(220)], frame, apply_stock=True)
+    engine.check([can(10), can(220)], frame, apply_stock=True)
+    for _ in range(engine.empty_frames - 1):
+        assert engine.check([can(220)], frame, apply_stock=True)["stock_zeroed"] == [water]
+    assert engine.check([can(220)], frame, apply_stock=True)["stock_zeroed"] == [cola, water]
+    engine.flush()
+    assert db_service.get_product(cola)["stock_quantity"] == 0
+    assert db_service.get_product(water)["stock_quantity"] == 0
+
+    assert engine.check([can(220)], frame)["events"] == []
+    assert [e["event_type"] for e in engine.check([can(10)], frame)["events"]] == ["restocked"]
+    engine.flush()
+    assert [e["event_type"] for e in db_service.get_planogram_events()][0] == "restocked"
+
+
+def test_planogram_check_route(fake_detector, planogram):
+    """/planogram/check runs detection then matching, within the frame budget"""
+    response = client.post("/planogram/check", files={"file": ("shelf.jpg", jpeg_bytes(), "image/jpeg")},
+                           data={"shelf_location": "C1"})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    # Fake detector: one bottle at x 10-110 (left, cola facing) and one can at x 200-260 (right, water)
+    assert [f["misplaced"] for f in data["facings"]] == [["bottle"], ["can"]]
+    assert {"decode_ms", "infer_ms", "planogram_match_ms"} <= set(data["timings"])
+    assert data["within_budget"] is True
+    assert client.get("/planogram/facings").json()["total"] == 2
+
+
+def test_exported_detector_decodes_yolov8_output():
+    """Raw (B, 4+classes, anchors) output is filtered, NMS'd and mapped back to image pixels"""
+    from app import vision
+    from app.detectors import ExportedYOLODetector
+
+    class FakeExported(ExportedYOLODetector):
+        def _forward(self, batch):
+            assert batch.shape[1:] == (3, 640, 640) and batch.dtype == np.float32
+            # anchors: cx, cy, w, h, score(bottle), score(can) in letterboxed 640 space
+            anchors = np.array([
+                [120, 320, 200, 400, 0.9, 0.0],   # bottle at [10, 20, 110, 220] in the 320x240 image
+                [122, 322, 200, 400, 0.8, 0.0],   # duplicate, suppressed
+                [120, 320, 200, 400, 0.0, 0.7],   # same place, other class: kept
+                [500, 300, 40, 40, 0.1, 0.05],    # below conf
+            ], dtype=np.float32)
+            return np.repeat(anchors.T[None], len(batch), axis=0)
+
+    model = FakeExported(names={0: "bottle", 1: "can"}, imgsz=640, batch_size=1)
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    (detections, speed), second = vision.infer_batch([image, image], conf=0.25, model=model)
+
+    assert [d["label"] for d in detections] == ["bottle", "can"]
+    assert detections[0]["bbox_xyxy"] == pytest.approx([10, 20, 110, 220], abs=1e-3)
+    assert detections[0]["confidence"] == pytest.approx(0.9)
+    assert second[0] == detections and set(speed) == {"preprocess", "inference", "postprocess"}
+
+
+class BlobYOLO:
+    """Fake model that detects each bright square (value 255) in whatever image it is given"""
+
+    def __call__(self, source, conf=0.25, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        return [_FakeResult(self._blobs(image)) for image in images]
+
+    @staticmethod
+    def _blobs(image):
+        mask = image[:, :, 0] == 255
+        seen = np.zeros_like(mask)
+        rows = []
+        for y, x in zip(*np.nonzero(mask)):
+            if seen[y, x]:
+                continue
+            x1 = x + np.argmin(np.append(mask[y, x:], False))
+            y1 = y + np.argmin(np.append(mask[y:, x], False))
+            seen[y:y1, x:x1] = True
+            rows.append([x, y, x1, y1, 0.9, 0])
+        return rows
+
+
+def test_tile_grid_covers_image_with_overlap():
+    """Tiles overlap, stay inside the image and end flush with its edges"""
+    from app.tiling import tile_grid
+    tiles = tile_grid(2000, 600, 640, 0.25)
+    assert tiles[:, 0].tolist() == [0, 480, 960, 1360] and tiles[:, 1].tolist() == [0] * 4
+    assert tiles[:, 2].max() == 2000 and tiles[:, 3].max() == 600
+    assert tile_grid(500, 400, 640, 0.2).tolist() == [[0, 0, 500, 400]]
+
+
+@pytest.mark.parametrize("method", ["nms", "fusion"])
+def test_tiled_inference_finds_small_items_once(method):
+    """Items in tile overlaps are reported once, in full-image coordinates"""
+    from app import vision
+    image = np.zeros((600, 2000, 3), dtype=np.uint8)
+    image[100:120, 500:520] = 255     # inside the overlap of tiles 0 and 1
+    image[300:320, 1900:1920] = 255   # only in the last tile
+    image[50:70, 630:650] = 255       # cut by the edge of tile 0, whole in tile 1
+
+    detections, info = vision.infer_tiled(image, model=BlobYOLO(), tile_size=640, overlap=0.25,
+                                          batch_size=2, workers=2, full_frame=False, merge=method)
+
+    boxes = sorted(d["bbox_xyxy"] for d in detections)
+    np.testing.assert_allclose(boxes, [[500, 100, 520, 120], [630, 50, 650, 70], [1900, 300, 1920, 320]], atol=0.05)
+    assert info["tiles"] == 4 and info["raw_detections"] > 3
+
+
+def test_detect_route_tiled(fake_detector, monkeypatch):
+    """tiled=true on /vision/detect runs tiles through the batcher in VISION_TILE_BATCH chunks and merges off the loop"""
+    import threading
+    from app import vision
+    from app.config import VISION_TILE_BATCH
+    monkeypatch.setattr(vision_service, "model", BlobYOLO())
+    monkeypatch.setattr(vision_service, "is_initialized", True)
+    submitted, merged_on = [], []
+    submit_many, merge = vision_service._submit_many, vision.merge_tile_detections
+    monkeypatch.setattr(vision_service, "_submit_many",
+                        lambda items, cache=True: submitted.append(len(items)) or submit_many(items, cache))
+    monkeypatch.setattr(vision, "merge_tile_detections",
+                        lambda *a, **kw: merged_on.append(threading.current_thread().name) or merge(*a, **kw))
+    image = np.zeros((600, 2000, 3), dtype=np.uint8)
+    image[100:120, 500:520] = 255
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format="PNG")
+
+    response = client.post("/vision/detect", files={"file": ("pano.png", buf.getvalue(), "image/png")},
+                           data={"tiled": "true"})
+    data = response.json()["data"]
+    assert response.status_code == 200 and data["tiles"]["count"] > 1
+    assert [d["bbox_xyxy"] for d in data["detections"]] == [[500.0, 100.0, 520.0, 120.0]]
+    assert len(submitted) > 1 and max(submitted) <= VISION_TILE_BATCH
+    assert merged_on and merged_on[0].startswith("asyncio_")  # default executor, not the event loop
+
+
+def test_tiled_detection_is_not_fooled_by_near_duplicate_tiles(fake_detector, monkeypatch):
+    """A small new item on a cached panorama is still found; only exact repeats are cached"""
+    monkeypatch.setattr(vision_service, "model", BlobYOLO())
+    monkeypatch.setattr(vision_service, "is_initialized", True)
+    rng = np.random.default_rng(1)
+    shelf = np.clip(100 + rng.normal(0, 3, (640, 2600, 3)), 0, 254).astype(np.uint8)
+    assert vision_service.detect_image_tiled(shelf, 0.25)["count"] == 0
+
+    restocked = shelf.copy()
+    restocked[300:320, 900:920] = 255
+    first = vision_service.detect_image_tiled(restocked, 0.25)
+    again = vision_service.detect_image_tiled(restocked, 0.25)
+    assert first["count"] == 1 and first["cached"] is False
+    assert again["cached"] is True and again["detections"] == first["detections"]
+    assert vision_service.result_cache.get_stats()["near_hits"] == 0
+
+
+class CrashingYOLO(FakeYOLO):
+    """FakeYOLO that kills its process when asked for conf < 0.05 (worker pool loader)"""
+
+    def __call__(self, source, conf=0.25, verbose=False, **kwargs):
+        if conf < 0.05:
+            import os
+            os._exit(1)
+        return super().__call__(source, conf=conf, verbose=verbose, **kwargs)
+
+
+def test_worker_pool_detects_and_restarts_crashed_workers():
+    """Frames reach worker processes via shared memory; a crashed worker is replaced"""
+    import time
+    from app.services.worker_pool import DetectionWorkerPool
+    pool = DetectionWorkerPool(2, loader=f"{__name__}:CrashingYOLO", health_interval_s=0.5)
+    pool.start()
+    try:
+        frames = [np.full((240, 320, 3), i, dtype=np.uint8) for i in range(4)]
+        results = [f.result(timeout=30) for f in [pool.submit(frame, 0.25) for frame in frames]]
+        assert all(len(detections) == 2 and speed["inference"] == 5.0 for detections, speed in results)
+        assert results[0][0][0] == {"label": "bottle", "confidence": pytest.approx(0.9), "bbox_xyxy": [10.0, 20.0, 110.0, 220.0]}
+
+        with pytest.raises(RuntimeError, match="crashed"):
+            pool.submit(frames[0], 0.01).result(timeout=30)
+        deadline = time.monotonic() + 30
+        while (pool.restarts < 1 or pool.get_stats()["alive"] < 2) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert len(pool.submit(frames[1], 0.5).result(timeout=30)[0]) == 1
+
+        stats = pool.get_stats()
+        assert stats["alive"] == 2 and stats["restarts"] == 1
+        assert stats["completed"] == 5 and stats["failed"] == 1 and stats["queue_depth"] == 0
+    finally:
+        pool.stop()
+
+
+def test_service_uses_worker_pool(monkeypatch):
+    """With workers enabled, detections come from the pool and its metrics are reported"""
+    service = VisionService()
+    monkeypatch.setattr(service, "workers", 1)
+    monkeypatch.setattr(service, "worker_loader", f"{__name__}:FakeYOLO")
+    try:
+        result = service.detect_products(jpeg_bytes(), confidence_threshold=0.25)
+        assert result["count"] == 2 and result["cached"] is False
+        assert service.detect_products(jpeg_bytes(), confidence_threshold=0.25)["cached"] is True
+        info = service.get_model_info()
+        assert info["status"] == "ready" and info["workers"]["completed"] == 1 and info["workers"]["alive"] == 1
+    finally:
+        service.shutdown()
+
+
+def test_model_registry_loads_lazily_and_evicts_lru(tmp_path):
+    """Detectors load on first use; the LRU non-default model goes when over count or memory budget"""
+    from app.model_registry import ModelRegistry
+    for name, size in [("default.pt", 10), ("a.onnx", 10), ("b.pt", 10), ("big.pt", 3 * 2**20)]:
+        (tmp_path / name).write_bytes(b"\0" * size)
+    loads = []
+    registry = ModelRegistry(models_dir=str(tmp_path), default_path=str(tmp_path / "default.pt"), max_models=3,
+                             memory_budget_mb=2, loader=lambda backend, path: loads.append((backend, path)) or FakeYOLO())
+
+    assert set(registry.discover()) == {"default.pt", "a.onnx", "b.pt", "big.pt"} and loads == []
+    registry.get()
+    registry.get("a.onnx")
+    registry.get("b.pt")
+    registry.get("a.onnx")  # now b.pt is least recently used
+    assert [b for b, _ in loads] == ["ultralytics", "onnx", "ultralytics"]
+    registry.get("big.pt")  # over the 2 MB budget: evicts non-default models, LRU first
+    status = registry.get_status()
+    assert status["resident"] == ["default.pt", "big.pt"] and status["evictions"] == 2
+    assert {m["name"]: m["loaded"] for m in status["models"]} == {"default.pt": True, "a.onnx": False, "b.pt": False, "big.pt": True}
+    with pytest.raises(KeyError):
+        registry.get("missing.pt")
+
+
+def test_detect_with_named_model_and_models_route(fake_detector, tmp_path, monkeypatch):
+    """model= picks a registry detector; /vision/models reports its load state"""
+    from collections import OrderedDict
+    from app.model_registry import model_registry
+    (tmp_path / "spices.onnx").write_bytes(b"\0" * 10)
+    monkeypatch.setattr(model_registry, "models_dir", tmp_path)
+    monkeypatch.setattr(model_registry, "loader", lambda backend, path: FakeYOLO([[1, 2, 3, 4, 0.8, 1]]))
+    monkeypatch.setattr(model_registry, "_entries", {k: dict(v) for k, v in model_registry._entries.items()})
+    monkeypatch.setattr(model_registry, "_resident", OrderedDict())
+
+    listing = client.get("/vision/models").json()["data"]["detectors"]
+    assert {m["name"]: m["loaded"] for m in listing["models"]}["spices.onnx"] is False
+
+    response = client.post("/vision/detect", files={"file": ("s.jpg", jpeg_bytes(), "image/jpeg")},
+                           data={"model": "spices.onnx"})
+    data = response.json()["data"]
+    assert response.status_code == 200 and data["model"] == "spices.onnx"
+    assert [d["label"] for d in data["detections"]] == ["can"]
+
+    listing = client.get("/vision/models").json()["data"]["detectors"]
+    spices = next(m for m in listing["models"] if m["name"] == "spices.onnx")
+    assert spices["loaded"] and spices["backend"] == "onnx" and spices["memory_mb"] is not None
+    assert client.delete("/vision/models/spices.onnx").json()["data"]["unloaded"] is True
+    assert client.post("/vision/detect", files={"file": ("s.jpg", jpeg_bytes(), "image/jpeg")},
+                       data={"model": "nope.pt"}).status_code == 404
+
+
+def test_preloading_a_named_model_is_refused_in_worker_pool_mode(fake_detector, tmp_path, monkeypatch):
+    """With worker processes, /vision/models/{name}/load doesn't load the model in the API process"""
+    from collections import OrderedDict
+    from app.model_registry import model_registry
+    (tmp_path / "spices.onnx").write_bytes(b"\0" * 10)
+    monkeypatch.setattr(model_registry, "models_dir", tmp_path)
+    monkeypatch.setattr(model_registry, "loader", lambda backend, path: FakeYOLO())
+    monkeypatch.setattr(model_registry, "_entries", {k: dict(v) for k, v in model_registry._entries.items()})
+    monkeypatch.setattr(model_registry, "_resident", OrderedDict())
+    monkeypatch.setattr(vision_service, "workers", 2)
+
+    response = client.post("/vision/models/spices.onnx/load")
+    assert response.status_code == 409 and "worker" in response.json()["detail"]
+    assert "spices.onnx" not in model_registry._resident
+    assert client.post("/vision/models/nope.pt/load").status_code == 404
+
+    monkeypatch.setattr(vision_service, "workers", 0)
+    assert client.post("/vision/models/spices.onnx/load").status_code == 200
+
+def test_tracker_keeps_ids_and_counts_through_flicker():
+    """Tracks keep their ids when items drop out for a frame or only come back weakly"""
+    from app.services.tracker import ShelfTracker
+    tracker = ShelfTracker(regions={"left": [0, 0, 0.5, 1], "right": [0.5, 0, 1, 1]}, min_hits=2, max_age=3)
+    frame = (400, 200)
+    item = lambda label, x, conf=0.9: {"label": label, "confidence": conf, "bbox_xyxy": [x, 50, x + 40, 150]}
+    full = [item("can", 10), item("can", 80), item("bottle", 250)]
+
+    first = tracker.update("cam", full, frame)
+    assert first["counts"] == {"left": {"can": 2}, "right": {"bottle": 1}}
+    ids = {t["track_id"] for t in first["tracks"]}
+    # One can missed, the bottle only detected weakly: counts hold
+    second = tracker.update("cam", [item("can", 12), item("bottle", 252, conf=0.3)], frame)
+    assert second["counts"] == first["counts"] and second["raw_counts"] == first["raw_counts"]
+    third = tracker.update("cam", [item("can", 11), item("can", 81), item("bottle", 251)], frame)
+    assert {t["track_id"] for t in third["tracks"]} == ids
+
+    # A one-frame false positive never becomes a track
+    tracker.update("cam", full + [item("bottle", 330, conf=0.6)], frame)
+    assert tracker.update("cam", full, frame)["counts"]["right"] == {"bottle": 1}
+    # An item that is really gone drops out after max_age frames, then fades from the smoothed count
+    for _ in range(6):
+        last = tracker.update("cam", full[:2], frame)
+    assert last["raw_counts"]["right"] == {} and last["counts"]["right"] == {}
+    assert tracker.get_stats()["frames"] == 11
+
+
+def test_planogram_check_with_tracking_ignores_missed_frames(fake_detector, planogram, monkeypatch):
+    """track=true checks confirmed tracks, so one missed can raises no low/restocked events"""
+    from app.services.tracker import ShelfTracker
+    from app.routes import planogram as planogram_routes
+    monkeypatch.setattr(vision_service, "result_cache", PerceptualCache(max_entries=0))
+    monkeypatch.setattr(planogram_routes, "shelf_tracker", ShelfTracker())
+    cans = [[10, 50, 50, 150, 0.9, 1], [80, 50, 120, 150, 0.9, 1]]
+    bottle = [200, 40, 250, 160, 0.9, 0]
+
+    def check(rows, track=True):
+        fake_detector.rows = rows
+        response = client.post("/planogram/check", files={"file": ("shelf.jpg", jpeg_bytes(), "image/jpeg")},
+                               data={"shelf_location": "C1", "track": str(track).lower()})
+        assert response.status_code == 200
+        return response.json()["data"]
+
+    assert check(cans + [bottle])["events"] == []
+    flicker = check(cans[:1] + [bottle])
+    assert flicker["events"] == [] and flicker["tracking"]["counts"]["shelf"] == {"bottle": 1, "can": 2}
+    assert check(cans + [bottle])["events"] == []
+    # Without tracking the same miss is reported
+    assert [e["event_type"] for e in check(cans[:1] + [bottle], track=False)["events"]] == ["low"]
+
+
+def test_media_store_names_cleans_up_and_retains(tmp_path):
+    """Content-addressed files are deleted after processing, bounded by quota/age, or kept in retain mode"""
+    import os
+    import time
+    from app.services.image_handler import ImageHandler
+    from app.services.media_store import MediaStore
+    store = MediaStore(root=str(tmp_path / "media"), quota_mb=2500 / 2**20, max_age_s=3600)
+    handler = ImageHandler(store=store)
+
+    with handler.staged_upload(b"a" * 1000, "query") as path:
+        with store.stage(b"a" * 1000, "query") as same:
+            assert same == path and path.name.startswith("query_") and path.read_bytes() == b"a" * 1000
+        assert path.exists()  # still staged by the outer block
+    assert not path.exists() and store.get_stats()["deleted"] == 1
+
+    # Kept files are evicted least recently used first once over quota, never while staged
+    old, mid = store.put(b"o" * 1000, "capture"), store.put(b"m" * 1000, "capture")
+    store.touch(old)
+    with store.stage(b"s" * 1000, "voice") as staged:
+        assert staged.exists() and old.exists() and not mid.exists()
+    assert store.get_stats()["evicted"] == 1 and store.get_stats()["bytes"] == 1000
+
+    # Files older than max_age_s go on the next cleanup, including ones left by a previous run
+    stale = store.root / "capture_leftover.jpg"
+    stale.write_bytes(b"x")
+    os.utime(stale, (time.time() - 7200, time.time() - 7200))
+    assert MediaStore(root=str(store.root), max_age_s=3600).cleanup() == 1 and not stale.exists()
+
+    retained = MediaStore(root=str(tmp_path / "debug"), retain=True)
+    with retained.stage(b"frame", "capture") as kept:
+        pass
+    assert kept.exists() and retained.retain_copy(b"frame", "capture") == kept.name
+    assert MediaStore(root=str(tmp_path / "off")).retain_copy(b"frame", "capture") is None
+
+
+def test_detections_are_vectorized_and_columnar(fake_detector):
+    """Boxes are converted in one pass (labels mapped, conf filtered); format=columnar returns parallel lists"""
+    from app import vision
+    result = _FakeResult([[1, 2, 3, 4, 0.9, 1], [5, 6, 7, 8, 0.2, 0], [9, 10, 11, 12, 0.6, 5]])
+    detections = vision._to_detections([result], conf=0.5)
+    assert [d["label"] for d in detections] == ["can", "5"]
+    assert detections[0] == {"label": "can", "confidence": pytest.approx(0.9), "bbox_xyxy": [1.0, 2.0, 3.0, 4.0]}
+    assert vision._to_detections([_FakeResult([])]) == []
+
+    # The label table lives on the model, so another model's names are never reused
+    other = FakeYOLO()
+    relabelled = _FakeResult([[1, 2, 3, 4, 0.9, 1]])
+    relabelled.names = {0: "jar", 1: "box"}
+    assert vision._to_detections([result], 0.5, fake_detector)[0]["label"] == "can"
+    assert vision._to_detections([relabelled], 0.5, other)[0]["label"] == "box"
+    assert fake_detector._label_table[0] is _FakeResult.names and other._label_table[0] is relabelled.names
+
+    response = client.post("/vision/detect", files={"file": ("shelf.jpg", jpeg_bytes(), "image/jpeg")},
+                           data={"format": "columnar"})
+    data = response.json()["data"]
+    assert data["format"] == "columnar" and data["count"] == 2
+    assert data["detections"]["label"] == ["bottle", "can"]
+    assert data["detections"]["bbox_xyxy"][0] == [10.0, 20.0, 110.0, 220.0]
+    # The cached records behind a columnar response are left intact
+    again = client.post("/vision/detect", files={"file": ("shelf.jpg", jpeg_bytes(), "image/jpeg")})
+    assert [d["label"] for d in again.json()["data"]["detections"]] == ["bottle", "can"]
+
+    files = [("files", ("a.jpg", jpeg_bytes(), "image/jpeg")), ("files", ("b.jpg", b"garbage", "image/jpeg"))]
+    batch = client.post("/vision/detect/batch", files=files, data={"format": "columnar"}).json()["data"]
+    assert batch[0]["detections"]["confidence"] == [pytest.approx(0.9), pytest.approx(0.4)] and "error" in batch[1]
+    assert client.post("/vision/detect", files={"file": ("shelf.jpg", jpeg_bytes(), "image/jpeg")},
+                       data={"format": "xml"}).status_code == 422
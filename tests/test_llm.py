@@ -0,0 +1,538 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.coalesce import SingleFlight
+from app.services.db import db_service
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def catalogue():
+    """Temporary database seeded with a few products"""
+    temp_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+    db_service.db_path = temp_db.name
+    db_service.init_database()
+    db_service.create_product({"name": "Whole Milk", "category": "Dairy", "price": 1.2,
+                               "stock_quantity": 8, "shelf_location": "B2"})
+    db_service.create_product({"name": "Sourdough Bread", "category": "Bakery", "price": 3,
+                               "stock_quantity": 0, "shelf_location": "A1"})
+    db_service.create_product({"name": "Oat Milk", "category": "Dairy", "price": 2.5,
+                               "stock_quantity": 4, "shelf_location": "B3"})
+
+    yield
+
+    temp_db.close()
+    os.unlink(temp_db.name)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """Concurrent identical calls share one execution and one result"""
+    sf = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(sf.do("k", slow)))
+    leader.start()
+    started.wait(1)
+    followers = [threading.Thread(target=lambda: results.append(sf.do("k", slow))) for _ in range(4)]
+    for t in followers:
+        t.start()
+    for t in [leader] + followers:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == ["answer"] * 5
+    assert sf.get_stats()["coalesced"] == 4
+    assert sf.in_flight() == 0
+
+
+def test_single_flight_shares_errors_and_does_not_cache():
+    """Errors reach every waiter and finished calls are not reused"""
+    sf = SingleFlight()
+
+    def boom():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        sf.do("k", boom)
+    assert sf.do("k", lambda: 1) == 1
+    assert sf.do("k", lambda: 2) == 2
+
+
+def test_single_flight_key_is_order_independent():
+    """Payload dict ordering does not change the coalescing key"""
+    a = SingleFlight.make_key("generate", {"model": "m", "prompt": "p"})
+    b = SingleFlight.make_key("generate", {"prompt": "p", "model": "m"})
+    assert a == b
+    assert a != SingleFlight.make_key("generate", {"model": "m", "prompt": "q"})
+
+
+class _FakeResponse:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+
+@pytest.fixture
+def fake_ollama(monkeypatch):
+    """Capture payloads sent to Ollama instead of calling a real server"""
+    from app.services import llm as llm_module
+    sent = []
+
+    def fake_post(url, json=None, timeout=None, **kwargs):
+        sent.append((url, json))
+        text = f"reply from {json['model']}"
+        if url.endswith("/api/chat"):
+            return _FakeResponse({"message": {"role": "assistant", "content": text}, "prompt_eval_duration": 1000})
+        return _FakeResponse({"response": text})
+
+    monkeypatch.setattr(llm_module.requests, "get", lambda *a, **k: _FakeResponse({"models": []}))
+    monkeypatch.setattr(llm_module.requests, "post", fake_post)
+    return sent
+
+
+def test_per_request_model_does_not_mutate_defaults(fake_ollama):
+    """A model override applies to one call only and keep_alive is always sent"""
+    from app.services.llm import LLMService
+    service = LLMService()
+    default_model = service.text_model
+
+    answer = service.generate_answer("hi", model="tinyllama")
+
+    assert answer == "reply from tinyllama"
+    assert service.text_model == default_model
+    assert fake_ollama[-1][1]["model"] == "tinyllama"
+    assert "keep_alive" in fake_ollama[-1][1]
+
+
+def test_catalogue_rendering_is_order_independent():
+    """The catalogue block is byte-identical for the same rows in any order"""
+    from app.services.prompts import render_catalogue
+    rows = [
+        {"id": 2, "name": "Milk", "category": "Dairy", "price": 1.5, "shelf_location": "B2"},
+        {"id": 1, "name": "Bread\n loaf", "category": None, "price": 2, "shelf_location": "A1"},
+    ]
+    block = render_catalogue(rows)
+    assert block == render_catalogue(list(reversed(rows)))
+    assert block.splitlines()[1] == "- #1 | Bread loaf | - | 2.00 | A1"
+
+
+def test_generate_answer_puts_question_last(fake_ollama):
+    """Chat messages keep the system prompt and catalogue ahead of the question"""
+    from app.services.llm import LLMService
+    service = LLMService()
+    service.generate_answer("Where is milk?", context="Products: (none)")
+    service.generate_answer("Where is bread?", context="Products: (none)")
+
+    first, second = fake_ollama[-2][1]["messages"], fake_ollama[-1][1]["messages"]
+    assert first[0] == second[0]
+    assert first[-1] == {"role": "user", "content": "Where is milk?"}
+    stats = service.prefix_stats.get_stats()
+    assert stats["cold_requests"] == 1 and stats["warm_requests"] == 1
+
+
+@pytest.mark.parametrize("question,expected", [
+    ("Where is the sourdough bread?", "Sourdough Bread is on shelf A1."),
+    ("how much is whole milk", "Whole Milk costs 1.20."),
+    ("Is sourdough bread in stock?", "Sorry, Sourdough Bread is currently out of stock."),
+    ("Do you have oat milk?", "Yes, Oat Milk is in stock (4 available) on shelf B3."),
+])
+def test_intent_router_answers_templates(catalogue, question, expected):
+    """Templated questions are answered from the DB"""
+    from app.services.intent import IntentRouter
+    assert IntentRouter(enabled=True).answer(question) == expected
+
+
+def test_intent_router_falls_through(catalogue):
+    """Open-ended or ambiguous questions go to the LLM"""
+    from app.services.intent import IntentRouter
+    router = IntentRouter(enabled=True)
+    assert router.answer("Which drink has less sugar?") is None
+    assert router.answer("Where is the milk?") is None  # two milks
+    stats = router.get_stats()
+    assert stats["no_intent"] == 1 and stats["unresolved"] == 1 and stats["hit_rate"] == 0.0
+
+
+def test_intent_router_matches_whole_words_and_skips_pronouns(catalogue):
+    """"it" is neither a product name nor part of "Biscuits"; plurals still resolve"""
+    from app.services.intent import IntentRouter
+    db_service.create_product({"name": "Digestive Biscuits", "category": "Snacks", "price": 2,
+                               "stock_quantity": 0, "shelf_location": "B3"})
+    router = IntentRouter(enabled=True)
+    for question in ("How much is it?", "Where is it?", "Is it in stock?", "Where is that one?"):
+        assert router.answer(question) is None
+    assert router.answer("How much are the biscuits?") == "Digestive Biscuits costs 2.00."
+    assert router.answer("Where is the digestive biscuit?") == "Digestive Biscuits is on shelf B3."
+
+
+def test_ask_fast_path_skips_llm(catalogue, monkeypatch):
+    """/llm/ask answers templated questions without calling Ollama"""
+    from app.services.intent import intent_router
+    from app.services.llm import llm_service
+    monkeypatch.setattr(intent_router, "enabled", True)
+
+    def no_llm(*args, **kwargs):
+        raise AssertionError("LLM should not be called")
+
+    monkeypatch.setattr(llm_service, "generate_answer", no_llm)
+    response = client.post("/llm/ask", data={"question": "Where is whole milk?"})
+    assert response.status_code == 200
+    assert response.json()["data"] == "Whole Milk is on shelf B2."
+
+
+class _FakeStream(_FakeResponse):
+    def __init__(self, chunks):
+        super().__init__({})
+        self._chunks = chunks
+
+    def iter_lines(self):
+        import json
+        for chunk in self._chunks:
+            yield json.dumps(chunk).encode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / "shelf.jpg"
+    path.write_bytes(b"not really a jpeg")
+    return str(path)
+
+
+def _fake_pipeline(monkeypatch, caption_tokens):
+    from app.services import llm as llm_module
+    sent = []
+
+    def fake_post(url, json=None, timeout=None, stream=False, **kwargs):
+        sent.append((url, json))
+        if stream:
+            chunks = [{"response": t, "done": False} for t in caption_tokens]
+            return _FakeStream(chunks + [{"response": "", "done": True}])
+        return _FakeResponse({"message": {"role": "assistant", "content": "refined"}})
+
+    monkeypatch.setattr(llm_module.requests, "get", lambda *a, **k: _FakeResponse({"models": []}))
+    monkeypatch.setattr(llm_module.requests, "post", fake_post)
+    return sent
+
+
+def test_image_to_text_skips_refinement_for_describe(catalogue, monkeypatch, image_file):
+    """A describe request is answered by the caption alone"""
+    from app.services.llm import LLMService
+    sent = _fake_pipeline(monkeypatch, ["Shelf of ", "milk cartons. ", "Second. ", "Third. ", "Fourth."])
+
+    result = LLMService().image_to_text_detailed(image_file, "Describe the shelf", max_caption_sentences=2)
+
+    assert result["refined"] is False
+    assert result["answer"] == "Shelf of milk cartons. Second."
+    assert [url for url, _ in sent].count("http://localhost:11434/api/chat") == 0
+    assert {"stage1_ms", "stage2_ms", "context_ms", "total_ms"} <= set(result["timings"])
+
+
+def test_image_to_text_refines_with_product_context(catalogue, monkeypatch, image_file):
+    """Other queries are refined with matching products in the prompt"""
+    from app.services.llm import LLMService
+    sent = _fake_pipeline(monkeypatch, ["Two cartons."])
+
+    result = LLMService().image_to_text_detailed(image_file, "How many oat milk cartons?")
+
+    assert result["refined"] is True and result["answer"] == "refined"
+    assert [m["name"] for m in result["matches"]] == ["Whole Milk", "Oat Milk"]
+    system = sent[-1][1]["messages"][0]["content"]
+    assert "Oat Milk" in system
+
+
+def test_query_route_sends_upload_from_memory(catalogue, monkeypatch):
+    """Image uploads skip the temp file and large ones are downscaled before base64"""
+    import base64
+    import io
+    from PIL import Image
+    from app.services import image_handler as handler_module
+    sent = _fake_pipeline(monkeypatch, ["A shelf."])
+    monkeypatch.setattr(handler_module.image_handler, "save_uploaded_image",
+                        lambda *a, **k: pytest.fail("upload written to disk"))
+    buf = io.BytesIO()
+    Image.new("RGB", (2000, 1000), (200, 30, 30)).save(buf, format="JPEG")
+
+    response = client.post("/llm/query", files={"image": ("big.jpg", buf.getvalue(), "image/jpeg")})
+
+    assert response.status_code == 200
+    sent_image = Image.open(io.BytesIO(base64.b64decode(sent[-1][1]["images"][0])))
+    assert max(sent_image.size) == 768
+
+
+@pytest.fixture
+def fake_server():
+    """Bundled fake Ollama running on a free port"""
+    from scripts.fake_ollama import FakeOllamaConfig, start_in_thread
+    server, url = start_in_thread(FakeOllamaConfig(latency_ms=1, load_ms=5, tokens_per_sec=0, response_tokens=12))
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def test_llm_service_against_fake_ollama(catalogue, fake_server, image_file):
+    """Text, streamed vision and residency calls work end to end against the stand-in"""
+    from app.services.llm import LLMService
+    from app.services.residency import ModelResidencyManager
+    server, url = fake_server
+    service = LLMService()
+    service.base_url = url
+
+    assert service.generate_answer("Which drink has less sugar?").startswith("tok0")
+    result = service.image_to_text_detailed(image_file, "Describe the shelf", max_caption_sentences=1)
+    assert result["caption"] == "tok0 tok1 tok2 tok3 tok4 tok5 tok6 tok7."
+
+    residency = ModelResidencyManager(base_url=url)
+    assert residency.preload("phi3:mini")["status"] == "loaded"
+    assert residency.preload("missing")["status"] == "error"
+    assert "phi3:mini" in [m["name"] for m in residency.resident_models()]
+
+
+def test_residency_status_matches_untagged_model_names(monkeypatch):
+    """A configured 'moondream' is resident when Ollama reports 'moondream:latest'"""
+    from app.services.residency import ModelResidencyManager
+    residency = ModelResidencyManager(base_url="http://unused")
+    residency.configured_models = ["moondream", "phi3:mini", "llava"]
+    monkeypatch.setattr(residency, "resident_models", lambda: [{"name": "moondream:latest"}, {"name": "phi3:mini"}])
+    status = residency.get_status()
+    assert [m["resident"] for m in status["configured"]] == [True, True, False]
+
+
+def test_scheduler_runs_interactive_before_background():
+    """Queued interactive work overtakes queued background work"""
+    from app.services.scheduler import JobScheduler, Priority
+    scheduler = JobScheduler(max_concurrency=1, aging_s=0)
+    gate = threading.Event()
+    order = []
+
+    blocker = scheduler.submit(gate.wait, Priority.BACKGROUND, deadline_s=None)
+    time.sleep(0.05)
+    jobs = [
+        scheduler.submit(lambda: order.append("background"), Priority.BACKGROUND, deadline_s=None),
+        scheduler.submit(lambda: order.append("normal"), Priority.NORMAL, deadline_s=None),
+        scheduler.submit(lambda: order.append("interactive"), Priority.INTERACTIVE, deadline_s=None),
+    ]
+    gate.set()
+    for job in [blocker] + jobs:
+        job.result(timeout=2)
+
+    assert order == ["interactive", "normal", "background"]
+
+
+def test_scheduler_ages_waiting_jobs_and_expires_deadlines():
+    """Old background jobs are promoted and stale jobs fail fast"""
+    from app.services.scheduler import DeadlineExceeded, JobScheduler, Priority
+    scheduler = JobScheduler(max_concurrency=1, aging_s=0.05)
+    gate = threading.Event()
+    order = []
+
+    blocker = scheduler.submit(gate.wait, Priority.INTERACTIVE, deadline_s=None)
+    old = scheduler.submit(lambda: order.append("old background"), Priority.BACKGROUND, deadline_s=None)
+    stale = scheduler.submit(lambda: order.append("stale"), Priority.INTERACTIVE, deadline_s=0.05)
+    time.sleep(0.2)
+    fresh = scheduler.submit(lambda: order.append("fresh interactive"), Priority.INTERACTIVE, deadline_s=None)
+    gate.set()
+
+    blocker.result(timeout=2)
+    old.result(timeout=2)
+    fresh.result(timeout=2)
+    with pytest.raises(DeadlineExceeded):
+        stale.result(timeout=2)
+    assert order == ["old background", "fresh interactive"]
+    assert scheduler.get_stats()["expired"]["interactive"] == 1
+
+
+def test_coalesced_request_runs_at_most_urgent_callers_priority():
+    """An interactive caller joining a queued background request promotes it"""
+    from app.services.llm import LLMService
+    from app.services.scheduler import JobScheduler, Priority
+    service = LLMService()
+    service.scheduler = JobScheduler(max_concurrency=1, aging_s=0)
+    gate = threading.Event()
+    order = []
+
+    blocker = service.scheduler.submit(gate.wait, Priority.BACKGROUND, deadline_s=None)
+    time.sleep(0.05)
+    shared = lambda: order.append("shared") or {"text": "ok"}
+    results = []
+    callers = [threading.Thread(target=lambda p=p: results.append(service._scheduled("key", shared, p)))
+               for p in (Priority.BACKGROUND, Priority.INTERACTIVE)]
+    callers[0].start()
+    time.sleep(0.05)
+    normal = service.scheduler.submit(lambda: order.append("normal"), Priority.NORMAL, deadline_s=None)
+    callers[1].start()
+    deadline = time.time() + 2
+    while service.scheduler.get_stats()["promoted"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    gate.set()
+    for t in callers:
+        t.join(timeout=2)
+    blocker.result(timeout=2)
+    normal.result(timeout=2)
+
+    assert order == ["shared", "normal"]
+    assert results == [{"text": "ok"}, {"text": "ok"}]
+    assert service._inflight.get_stats()["coalesced"] == 1
+
+
+def test_session_history_is_compacted_to_budget():
+    """Old turns fold into a bounded summary while recent turns stay verbatim"""
+    from app.services.sessions import SessionStore
+    store = SessionStore(token_budget=60, keep_recent_turns=2)
+    session = store.get_or_create()
+    for i in range(10):
+        store.record_turn(session, f"Question number {i} about oat milk? More detail here.", f"Answer {i}. " * 5)
+
+    history = session.history_messages()
+    assert history[0]["role"] == "system" and "Shopper asked" in history[0]["content"]
+    assert history[-1]["content"].startswith("Answer 9.")
+    assert session.history_tokens() <= 60 + 30
+    assert store.get_stats()["compacted_turns"] > 0
+
+
+def test_session_store_evicts_idle_and_excess_sessions():
+    """Idle sessions expire and the store never exceeds its capacity"""
+    from app.services.sessions import SessionStore
+    store = SessionStore(max_sessions=2, idle_ttl_s=0.05)
+    first = store.get_or_create()
+    time.sleep(0.1)
+    assert store.get(first.id) is None
+    ids = [store.get_or_create().id for _ in range(3)]
+    assert store.get(ids[0]) is None and store.get(ids[2]) is not None
+    stats = store.get_stats()
+    assert stats["evicted_idle"] == 1 and stats["evicted_capacity"] == 1
+
+
+def test_chat_route_carries_history(catalogue, fake_ollama):
+    """Follow-ups in the same session send earlier turns to the model"""
+    first = client.post("/llm/chat", data={"question": "Tell me about oat milk"}).json()["data"]
+    second = client.post("/llm/chat", data={"question": "And is it gluten free?",
+                                            "session_id": first["session_id"]}).json()["data"]
+
+    assert second["session_id"] == first["session_id"]
+    messages = fake_ollama[-1][1]["messages"]
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "Tell me about oat milk"
+    assert client.delete(f"/llm/chat/{first['session_id']}").status_code == 200
+
+
+def test_chat_follow_ups_skip_the_fast_path(catalogue, fake_ollama, monkeypatch):
+    """Once a session has history, even template-shaped follow-ups go to the LLM with it"""
+    from app.services.intent import intent_router
+    monkeypatch.setattr(intent_router, "enabled", True)
+    db_service.create_product({"name": "Digestive Biscuits", "price": 2, "shelf_location": "B3"})
+    first = client.post("/llm/chat", data={"question": "Where is the sourdough bread?"}).json()["data"]
+    assert first["answer"] == "Sourdough Bread is on shelf A1." and fake_ollama == []
+
+    second = client.post("/llm/chat", data={"question": "How much is it?",
+                                            "session_id": first["session_id"]}).json()["data"]
+    assert second["answer"].startswith("reply from")
+    messages = fake_ollama[-1][1]["messages"]
+    assert messages[1]["content"] == "Where is the sourdough bread?" and messages[-1]["content"] == "How much is it?"
+    third = client.post("/llm/chat", data={"question": "Where is the oat milk?",
+                                           "session_id": first["session_id"]}).json()["data"]
+    assert third["answer"].startswith("reply from") and len(fake_ollama) == 2
+
+
+def test_failed_chat_leaves_no_session(catalogue, monkeypatch):
+    """A chat turn that errors before answering does not store a new session"""
+    from app.routes.llm import session_store
+    from app.services.llm import llm_service
+    before = session_store.get_stats()["active"]
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Ollama down")
+
+    monkeypatch.setattr(llm_service, "generate_answer", fail)
+    for _ in range(3):
+        assert client.post("/llm/chat", data={"question": "Tell me about oat milk"}).status_code == 500
+    assert session_store.get_stats()["active"] == before
+
+
+def test_context_assembly_respects_token_budget():
+    """Large catalogues are ranked, trimmed to needed columns and truncated"""
+    from app.services.prompts import assemble_context, estimate_tokens, render_catalogue
+    products = [
+        {"id": i, "name": f"Snack {i}", "category": "Snacks", "price": 1.0 + i, "shelf_location": f"S{i}"}
+        for i in range(1, 500)
+    ]
+    products.append({"id": 500, "name": "Oat Milk", "category": "Dairy", "price": 2.5, "shelf_location": "B3"})
+
+    result = assemble_context(products, "How much is oat milk?", token_budget=100)
+
+    assert result["tokens"] <= 100
+    assert result["truncated"] == len(products) - result["included"] > 0
+    lines = result["context"].splitlines()
+    assert "columns: id | name | price;" in lines[0]
+    assert "- #500 | Oat Milk | 2.50" in lines
+
+    small = products[-2:]
+    full = assemble_context(small, "How much is oat milk?", token_budget=100)
+    assert full["context"] == render_catalogue(small) and full["truncated"] == 0
+    assert estimate_tokens(full["context"]) == full["tokens"]
+
+
+def test_telemetry_aggregates_ollama_timings(catalogue, fake_server, image_file):
+    """Timing fields from every call land in per-model histograms and metrics"""
+    from app.services.llm import LLMService
+    from app.services.telemetry import InferenceTelemetry
+    server, url = fake_server
+    service = LLMService()
+    service.base_url = url
+    service.telemetry = InferenceTelemetry(cold_load_ms=1)
+
+    service.generate_answer("Which drink has less sugar?")
+    service.generate_answer("Which snack is cheapest?")
+    service.image_to_text_detailed(image_file, "How many oat milk cartons?")
+
+    stats = service.telemetry.get_stats()
+    assert stats["phi3:mini"]["calls"] == 3
+    assert stats["phi3:mini"]["cold_loads"] == 1
+    assert stats["phi3:mini"]["operations"] == {"generate_answer": 2, "image_to_text.refine": 1}
+    assert stats["moondream"]["operations"] == {"image_to_text.vision": 1}
+    text = service.telemetry.render_prometheus()
+    assert 'shelf_llm_calls_total{model="phi3:mini"} 3' in text
+    assert 'shelf_llm_total_ms_count{model="moondream"} 1' in text
+
+
+def test_product_context_is_cached_until_catalogue_changes(catalogue, monkeypatch):
+    """Repeated context builds skip the DB until a write bumps the data version"""
+    from app.services.llm import LLMService
+    service = LLMService()
+    first = service.build_product_context(None, "What is cheap?")
+    version = db_service.data_version
+
+    monkeypatch.setattr(db_service, "get_all_products", lambda: pytest.fail("should be cached"))
+    assert service.build_product_context(None, "What is cheap?")["context"] == first["context"]
+    assert f"catalogue v{version};" in first["context"]
+    monkeypatch.undo()
+
+    db_service.update_product(1, {"price": 9.99})
+    assert db_service.data_version == version + 1
+    refreshed = service.build_product_context(None, "What is cheap?")
+    assert "9.99" in refreshed["context"]
+    assert service.context_cache.get_stats()["hits"] == 1